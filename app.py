@@ -1,18 +1,48 @@
 import os
+import io
 import re
 import time
 import json
+import gzip
+import base64
+import hashlib
+import shutil
+import zipfile
+import tempfile
 import random
+import bisect
+import heapq
+from contextlib import contextmanager
+from collections import deque
 import threading
 import uuid
+import socket
+import sqlite3
+import mmap
+import struct
+import codecs
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from flask import Flask, render_template, request, jsonify, send_file, Response
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-from requests.adapters import HTTPAdapter
+from page_parsers import parse_cheyil_page, parse_quanben_page, parse_generic_page
+from urllib.parse import urljoin, urlparse, quote
+from requests.adapters import HTTPAdapter, BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from requests.compat import chardet
 from requests.packages.urllib3.util.retry import Retry
-from requests.exceptions import SSLError, ReadTimeout, ConnectionError, ChunkedEncodingError
+from requests.exceptions import SSLError, ConnectionError, ChunkedEncodingError, Timeout as RequestTimeout
+try:
+    import httpx # Optional, for HTTP_TRANSPORT = 'httpx'
+except ImportError:
+    httpx = None
+try:
+    import h2 # Lets httpx speak HTTP/2
+except ImportError:
+    h2 = None
 
 app = Flask(__name__)
 
@@ -43,9 +73,7 @@ def retry_failed(task_id):
     return jsonify({'status': 'ok'})
 
 # Configuration
-DOWNLOAD_FOLDER = 'downloads'
-if not os.path.exists(DOWNLOAD_FOLDER):
-    os.makedirs(DOWNLOAD_FOLDER)
+DOWNLOAD_FOLDER = os.environ.get('DOWNLOAD_FOLDER', 'downloads') # Created on first write, not at import
 
 # Global State
 tasks = {}
@@ -56,12 +84,88 @@ active_urls_lock = threading.Lock()
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"
 }
+CHAPTER_DELAY = (0.5, 1.5) # Anti-bot pause after each chapter, uniform between (min, max) seconds
 
 # --- Utility Functions ---
 
 def clean_filename(title):
     return re.sub(r'[\\/*?:"<>|]', "", title).strip()
 
+# Decorations search engines and mirror sites glue onto a book title
+TITLE_NOISE = ['最新章节列表', '最新章节', '全文免费阅读', '全文阅读', '免费阅读', '在线阅读', '无弹窗',
+               '章节列表', '章节目录', '目录', 'TXT下载', 'txt下载', '全集', '小说']
+UNKNOWN_AUTHORS = {'', '未知', '全本小说', '系统提示'}
+
+def normalize_book_title(title):
+    """Reduce '《斗破苍穹》最新章节_笔趣阁' style titles to a comparable key"""
+    text = re.sub(r'[《》「」"\']', '', title or '').strip()
+    head = re.split(r'[_|｜\-–—,，:：（(【\[\s]', text)[0] or text
+    stripped = True
+    while stripped:
+        stripped = False
+        for noise in TITLE_NOISE:
+            if head.endswith(noise) and len(head) > len(noise):
+                head = head[:-len(noise)]
+                stripped = True
+    return re.sub(r'[^\w\u4e00-\u9fa5]', '', head).lower()
+
+def normalize_author(author):
+    author = (author or '').strip()
+    if author in UNKNOWN_AUTHORS:
+        return ''
+    return re.sub(r'[^\w\u4e00-\u9fa5]', '', author).lower()
+
+CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+CN_UNITS = {'十': 10, '百': 100, '千': 1000, '万': 10000}
+
+def chinese_number(s):
+    """'一千零二十三' -> 1023, '二十' -> 20, '十五' -> 15"""
+    total, section, digit = 0, 0, 0
+    for ch in s:
+        if ch in CN_DIGITS:
+            digit = CN_DIGITS[ch]
+        elif ch == '万':
+            total += (section + digit) * 10000
+            section, digit = 0, 0
+        elif ch in CN_UNITS:
+            section += (digit or 1) * CN_UNITS[ch]
+            digit = 0
+    return total + section + digit
+
+def chapter_number(title):
+    """Chapter number from a '第123章' / '第一百二十三章' style title, or None"""
+    m = re.search(r'第\s*([0-9零〇一二两三四五六七八九十百千万]+)\s*[章节回]', title or '')
+    if not m:
+        return None
+    num = m.group(1)
+    return int(num) if num.isdigit() else chinese_number(num)
+
+def chapter_key(chapter):
+    """Site independent key of a chapter dict: its number, else its normalized title"""
+    if chapter.get('probe'): # Quanben gap fillers are numbered by page id, not chapter
+        return None
+    num = chapter_number(chapter['title'])
+    if num is not None:
+        return ('n', num)
+    key = re.sub(r'[^\w\u4e00-\u9fa5]', '', chapter['title'])
+    return ('t', key) if key else None
+
+def chapter_keys(chapters):
+    """chapter_key of every chapter of a TOC, made unique by how often it came
+    before: numbering that restarts each volume (第一卷 第1章, 第二卷 第1章)
+    yields ('n', 1, 0) and ('n', 1, 1) instead of one key for two chapters.
+    """
+    seen = {}
+    keys = []
+    for c in chapters:
+        key = chapter_key(c)
+        if key is not None:
+            n = seen.get(key, 0)
+            seen[key] = n + 1
+            key += (n,)
+        keys.append(key)
+    return keys
+
 def quanben_base64(s, staticchars):
     encodechars = ""
     for char in s:
@@ -76,19 +180,906 @@ def quanben_base64(s, staticchars):
         encodechars += staticchars[num1] + code + staticchars[num2]
     return encodechars
 
+# --- Metrics ---
+# Minimal Prometheus text-format registry. Recording is a dict update under a
+# lock, so it stays on in production; gauges are computed at scrape time.
+METRICS = []
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def metric_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, doc, labels=()):
+        self.name, self.doc, self.labels = name, doc, labels
+        self.lock = threading.Lock()
+        self.values = {}
+        METRICS.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def lines(self):
+        with self.lock:
+            return [f"{self.name}{metric_labels(self.labels, lv)} {v}" for lv, v in self.values.items()]
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.doc, self.labels, self.buckets = name, doc, labels, buckets
+        self.lock = threading.Lock()
+        self.values = {} # label values -> [per-bucket counts (+Inf last), sum, count]
+        METRICS.append(self)
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def lines(self):
+        out = []
+        with self.lock:
+            for lv, (counts, total, n) in self.values.items():
+                acc = 0
+                for bound, c in zip(list(self.buckets) + ['+Inf'], counts):
+                    acc += c
+                    out.append(f"{self.name}_bucket{metric_labels(self.labels, lv, [('le', bound)])} {acc}")
+                out.append(f"{self.name}_sum{metric_labels(self.labels, lv)} {round(total, 6)}")
+                out.append(f"{self.name}_count{metric_labels(self.labels, lv)} {n}")
+        return out
+
+class Gauge:
+    """Computed at scrape time: fn() -> {label values tuple: value}"""
+    kind = 'gauge'
+
+    def __init__(self, name, doc, labels, fn):
+        self.name, self.doc, self.labels, self.fn = name, doc, labels, fn
+        METRICS.append(self)
+
+    def lines(self):
+        return [f"{self.name}{metric_labels(self.labels, lv)} {v}" for lv, v in self.fn().items()]
+
+def render_metrics():
+    out = []
+    for m in METRICS:
+        out.append(f"# HELP {m.name} {m.doc}")
+        out.append(f"# TYPE {m.name} {m.kind}")
+        try:
+            out.extend(m.lines())
+        except Exception:
+            pass # A broken gauge must never break the scrape
+    return '\n'.join(out) + '\n'
+
+FETCH_SECONDS = Histogram('novel_fetch_seconds', 'Page fetch latency', ('domain', 'downloader'))
+FETCH_BYTES = Counter('novel_fetch_bytes_total', 'Response bytes fetched', ('domain', 'downloader'))
+FETCH_RESPONSES = Counter('novel_fetch_responses_total', 'Fetches by HTTP status or exception', ('domain', 'downloader', 'status'))
+FETCH_RETRIES = Counter('novel_fetch_retries_total', 'Retries by reason', ('domain', 'downloader', 'reason'))
+PARSE_SECONDS = Histogram('novel_parse_seconds', 'Per-chapter time outside network I/O (parsing, cleanup)', ('downloader',),
+                          buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+FETCH_BYTES_SKIPPED = Counter('novel_fetch_bytes_skipped_total', 'Body bytes left unread by streamed early abort',
+                              ('domain', 'downloader'))
+DNS_LOOKUPS = Counter('novel_dns_lookups_total', 'Host name lookups by cache result', ('result',))
+CHARSET_DECISIONS = Counter('novel_charset_decisions_total', 'Page charsets by where they came from', ('source',))
+CHAPTERS = Counter('novel_chapters_total', 'Chapters processed by outcome, rate() gives chapters/sec', ('downloader', 'result'))
+ENGINE_SECONDS = Histogram('novel_search_engine_seconds', 'Search engine latency', ('engine',))
+ENGINE_REQUESTS = Counter('novel_search_engine_requests_total', 'Search engine calls by outcome', ('engine', 'outcome'))
+
+# Network time spent by the current thread, lets the download loop split a
+# chapter's wall time into I/O and parsing without touching every parser
+io_clock = threading.local()
+
+def io_seconds():
+    return getattr(io_clock, 'seconds', 0.0)
+
+# --- Retry Policy ---
+# One policy for every downloader fetch: exponential backoff with full jitter,
+# a deadline across all attempts of one request, and a retry budget shared by
+# the whole task so a dying site can't keep a task sleeping forever.
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 15.0
+RETRY_DEADLINE = 60.0
+RETRY_TASK_BUDGET = 300
+RETRY_STATUS = {403, 408, 425, 429, 500, 502, 503, 504}
+NOT_FOUND_STATUS = {404, 410}
+TRANSIENT_ERRORS = (SSLError, RequestTimeout, ConnectionError, ChunkedEncodingError)
+
+def check_not_block_page(resp):
+    """Validator: tiny 200 pages are usually anti-bot or error stubs"""
+    if len(resp.content) < 500:
+        return 'short_page'
+    return None
+
+class RetryPolicy:
+    def __init__(self, attempts=RETRY_ATTEMPTS, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY,
+                 deadline=RETRY_DEADLINE, budget=RETRY_TASK_BUDGET):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'failed': 0, 'not_found': 0,
+                      'budget_exhausted': 0, 'sleep': 0.0, 'errors': {}}
+
+    def backoff(self, attempt, retry_after=None):
+        """Full jitter: uniform(0, min(cap, base * 2^attempt)), at least Retry-After"""
+        delay = random.uniform(0, min(self.cap, self.base * (2 ** attempt)))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.cap))
+        return delay
+
+    def classify(self, resp, validate):
+        """('ok' | 'retry' | 'not_found' | 'fatal', label)"""
+        code = resp.status_code
+        if code in NOT_FOUND_STATUS:
+            return 'not_found', f"HTTP {code}"
+        if code in RETRY_STATUS:
+            return 'retry', f"HTTP {code}"
+        if code >= 400:
+            return 'fatal', f"HTTP {code}"
+        label = validate(resp) if validate else None
+        if label:
+            return 'retry', label
+        return 'ok', None
+
+    def take_retry(self):
+        with self.lock:
+            if self.stats['retries'] >= self.budget:
+                self.stats['budget_exhausted'] += 1
+                return False
+            self.stats['retries'] += 1
+            return True
+
+    def count(self, key, label=None):
+        with self.lock:
+            if key:
+                self.stats[key] += 1
+            if label:
+                self.stats['errors'][label] = self.stats['errors'].get(label, 0) + 1
+
+    def run(self, send, validate=None, log=None, timeout=15, attempts=None, on_retry=None):
+        """Call send(timeout) -> Response until it succeeds or the policy gives up.
+
+        Returns (outcome, resp): outcome is 'ok', 'not_found' or 'failed'.
+        """
+        deadline = time.time() + self.deadline
+        attempts = attempts or self.attempts
+        self.count('requests')
+        resp = None
+        for attempt in range(attempts):
+            retry_after = None
+            try:
+                resp = send(max(1.0, min(timeout, deadline - time.time())))
+                kind, label = self.classify(resp, validate)
+                ra = resp.headers.get('Retry-After', '')
+                retry_after = int(ra) if ra.isdigit() else None
+                detail = label
+            except TRANSIENT_ERRORS as e:
+                kind, label, detail = 'retry', type(e).__name__, f"{type(e).__name__}: {str(e)[:50]}"
+            except Exception as e:
+                kind, label, detail = 'fatal', type(e).__name__, f"{type(e).__name__}: {str(e)[:50]}"
+
+            if kind == 'ok':
+                return 'ok', resp
+            if kind == 'not_found':
+                self.count('not_found', label)
+                return 'not_found', resp
+            self.count(None, label)
+            if kind == 'fatal' or attempt + 1 >= attempts:
+                break
+            delay = self.backoff(attempt, retry_after)
+            if time.time() + delay >= deadline or not self.take_retry():
+                break
+            if on_retry:
+                on_retry(label, delay)
+            if log:
+                log(f"网络波动 ({detail})，{delay:.1f}秒后重试...")
+            with self.lock:
+                self.stats['sleep'] += delay
+            time.sleep(delay)
+        self.count('failed')
+        return 'failed', resp
+
+    def snapshot(self):
+        with self.lock:
+            snap = dict(self.stats)
+            snap['errors'] = dict(self.stats['errors'])
+            snap['sleep'] = round(snap['sleep'], 1)
+            snap['budget_left'] = max(0, self.budget - self.stats['retries'])
+            return snap
+
+# --- Request Hedging ---
+# A chapter fetch that is still running after its domain's learned p95 gets a
+# second identical request; whichever answers first wins. Hedges are capped at
+# HEDGE_BUDGET of a domain's requests so a slow site never sees double load.
+HEDGE_REQUESTS = False # Default for new tasks, /api/start can override with "hedge"
+HEDGE_BUDGET = 0.05
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.2
+hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='hedge')
+
+class DomainLatency:
+    """Recent fetch latencies of one domain plus its hedge budget"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=200)
+        self.requests = 0
+        self.hedges = 0
+        self.p95 = None
+
+    def observe(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+            self.requests += 1
+            if len(self.samples) >= HEDGE_MIN_SAMPLES and (self.p95 is None or self.requests % 20 == 0):
+                ordered = sorted(self.samples)
+                self.p95 = ordered[int(len(ordered) * 0.95) - 1]
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, None while there is too little data"""
+        if self.p95 is None:
+            return None
+        return max(self.p95, HEDGE_MIN_DELAY)
+
+    def take_hedge(self):
+        with self.lock:
+            if self.hedges + 1 > self.requests * HEDGE_BUDGET:
+                return False
+            self.hedges += 1
+            return True
+
+domain_latency = {}
+domain_latency_lock = threading.Lock()
+
+def get_domain_latency(domain):
+    with domain_latency_lock:
+        if domain not in domain_latency:
+            domain_latency[domain] = DomainLatency()
+        return domain_latency[domain]
+
+# --- Download Tracing ---
+# Optional per-task timeline. Each chapter is one span with its stages inside:
+# fetch (one per page and attempt), backoff, parse, write and the anti-bot
+# sleep. /api/trace exports it as JSONL or as a Chrome trace (Perfetto,
+# chrome://tracing); the progress payload carries a running summary.
+TRACE_DOWNLOADS = False # Default for new tasks, /api/start can override with "trace"
+TRACE_MAX_SPANS = 50000 # Oldest spans are dropped beyond this, the summary keeps counting
+TRACE_SLOWEST = 5
+
+class DownloadTrace:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = deque(maxlen=TRACE_MAX_SPANS)
+        self.chapter = None # Index of the chapter being fetched
+        self.chapter_stages = {} # stage -> seconds, for the current chapter
+        self.stages = {} # stage -> [count, total, max]
+        self.slowest = [] # min-heap of (seconds, seq, index, title, stages)
+        self.seq = 0 # Tie-breaker, stage dicts don't compare
+
+    def add(self, stage, start, end, **args):
+        dur = max(0.0, end - start)
+        span = {'chapter': self.chapter, 'stage': stage, 'start': start, 'dur': dur,
+                'thread': threading.get_ident()}
+        if args:
+            span['args'] = args
+        with self.lock:
+            self.spans.append(span)
+            agg = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            agg[0] += 1
+            agg[1] += dur
+            agg[2] = max(agg[2], dur)
+            if self.chapter is not None and stage != 'chapter':
+                self.chapter_stages[stage] = self.chapter_stages.get(stage, 0.0) + dur
+
+    def begin(self, index):
+        with self.lock:
+            self.chapter = index
+            self.chapter_stages = {}
+
+    def end(self, start, title, outcome):
+        """Close the current chapter's span"""
+        end = time.time()
+        self.add('chapter', start, end, title=title, outcome=outcome)
+        with self.lock:
+            self.seq += 1
+            entry = (end - start, self.seq, self.chapter, title,
+                     {k: round(v, 3) for k, v in self.chapter_stages.items()})
+            if len(self.slowest) < TRACE_SLOWEST:
+                heapq.heappush(self.slowest, entry)
+            elif entry[0] > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+            self.chapter = None
+
+    def summary(self):
+        with self.lock:
+            stages = {s: {'count': c, 'total': round(t, 3), 'max': round(m, 3)}
+                      for s, (c, t, m) in self.stages.items()}
+            slowest = [{'chapter': i, 'title': t, 'seconds': round(d, 3), 'stages': st}
+                       for d, _, i, t, st in sorted(self.slowest, key=lambda e: -e[0])]
+        return {'stages': stages, 'slowest_chapters': slowest, 'spans': len(self.spans)}
+
+    def export_jsonl(self):
+        with self.lock:
+            spans = list(self.spans)
+        return ''.join(json.dumps(s, ensure_ascii=False) + '\n' for s in spans)
+
+    def export_chrome(self):
+        """Trace Event Format: complete ('X') events in microseconds"""
+        with self.lock:
+            spans = list(self.spans)
+        events = []
+        for s in spans:
+            args = dict(s.get('args', {}))
+            args['chapter'] = s['chapter']
+            events.append({'name': s['stage'], 'cat': 'download', 'ph': 'X', 'pid': 1, 'tid': s['thread'],
+                           'ts': int(s['start'] * 1e6), 'dur': int(s['dur'] * 1e6), 'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def close_quietly(future):
+    """Done-callback for the losing request of a hedge"""
+    try:
+        future.result().close()
+    except Exception:
+        pass
+
+# --- HTTP Record / Replay ---
+# A cassette sits under the sessions of every downloader and the searcher.
+# Record mode stores each response (status, headers, body, time taken) as a
+# gzip JSON line; replay mode answers from the file with the recorded
+# latency times HTTP_CASSETTE_SPEED, so a run can be repeated with no network.
+#   HTTP_CASSETTE=run.jsonl.gz HTTP_CASSETTE_MODE=record gunicorn app:app
+#   HTTP_CASSETTE=run.jsonl.gz HTTP_CASSETTE_SPEED=0 gunicorn app:app
+HTTP_CASSETTE = os.environ.get('HTTP_CASSETTE') # Unset: live network
+HTTP_CASSETTE_MODE = os.environ.get('HTTP_CASSETTE_MODE', 'replay')
+HTTP_CASSETTE_SPEED = float(os.environ.get('HTTP_CASSETTE_SPEED', '1.0')) # Latency scale, 0 = instant
+CASSETTE_SKIP_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'} # Bodies are stored decoded
+
+class CassetteMiss(requests.exceptions.RequestException):
+    """Replay found no recording for a request; not retried"""
+
+class Cassette:
+    def __init__(self, path, mode='replay', speed=1.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"cassette mode must be 'record' or 'replay', not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.stats = {'recorded': 0, 'replayed': 0, 'misses': 0}
+        self.exact = {} # (method, url) -> deque of entries, played in recorded order
+        self.shapes = {} # (method, url without query values) -> same, for random query params
+        self.file = None
+        if mode == 'replay':
+            self.load()
+
+    @staticmethod
+    def shape(url):
+        parts = urlparse(url)
+        keys = sorted(k.split('=', 1)[0] for k in parts.query.split('&') if k)
+        return f"{parts.scheme}://{parts.netloc}{parts.path}?{'&'.join(keys)}"
+
+    def load(self):
+        count = 0
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.exact.setdefault((entry['method'], entry['url']), deque()).append(entry)
+                    self.shapes.setdefault((entry['method'], self.shape(entry['url'])), deque()).append(entry)
+                    count += 1
+        except (EOFError, OSError, ValueError) as e:
+            print(f"> 录制文件读取中断 ({type(e).__name__})，已加载 {count} 条")
+        print(f"> 回放模式: {self.path}，{count} 条记录，延迟倍率 {self.speed}")
+
+    def record(self, request, resp, elapsed):
+        body = resp.content or b''
+        try:
+            text, encoded = body.decode('utf-8'), False
+        except UnicodeDecodeError:
+            text, encoded = base64.b64encode(body).decode('ascii'), True
+        entry = {'method': request.method, 'url': request.url, 'status': resp.status_code,
+                 'reason': resp.reason, 'elapsed': round(elapsed, 4),
+                 'headers': {k: v for k, v in resp.headers.items() if k.lower() not in CASSETTE_SKIP_HEADERS},
+                 'body': text}
+        if encoded:
+            entry['b64'] = True
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self.lock:
+            if self.file is None:
+                self.file = gzip.open(self.path, 'at', encoding='utf-8') # Appends a gzip member
+            self.file.write(line)
+            self.file.flush() # Every line is readable even if the process dies
+            self.stats['recorded'] += 1
+
+    def take(self, request):
+        """Next recorded entry for a request; the last one repeats once they run out"""
+        with self.lock:
+            for table, key in ((self.exact, request.url), (self.shapes, self.shape(request.url))):
+                queue = table.get((request.method, key))
+                if queue:
+                    self.stats['replayed'] += 1
+                    return queue.popleft() if len(queue) > 1 else queue[0]
+            self.stats['misses'] += 1
+        return None
+
+    def replay(self, request, adapter):
+        entry = self.take(request)
+        if entry is None:
+            raise CassetteMiss(f"录制中没有此请求: {request.method} {request.url}", request=request)
+        if self.speed > 0:
+            time.sleep(entry['elapsed'] * self.speed)
+        body = base64.b64decode(entry['body']) if entry.get('b64') else entry['body'].encode('utf-8')
+        resp = requests.Response()
+        resp.status_code = entry['status']
+        resp.reason = entry.get('reason', '')
+        resp.headers = CaseInsensitiveDict(entry['headers'])
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp._content = body
+        resp._content_consumed = True
+        resp.raw = io.BytesIO(body)
+        resp.url = request.url
+        resp.request = request
+        resp.connection = adapter
+        return resp
+
+class CassetteAdapter(HTTPAdapter):
+    def __init__(self, cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        if self.cassette.mode == 'replay':
+            return self.cassette.replay(request, self)
+        start = time.time()
+        resp = super().send(request, **kwargs)
+        resp.content # The cassette needs the body, so a recorded response is never streamed
+        self.cassette.record(request, resp, time.time() - start)
+        return resp
+
+http_cassette = Cassette(HTTP_CASSETTE, HTTP_CASSETTE_MODE, HTTP_CASSETTE_SPEED) if HTTP_CASSETTE else None
+
+def use_cassette(session, cassette=None):
+    """Mount the cassette (default: the configured one) under a Session; no-op without one"""
+    cassette = cassette or http_cassette
+    if cassette:
+        adapter = CassetteAdapter(cassette)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    return session
+
+# --- HTTP/2 Transport ---
+# requests holds one connection per in-flight request. With httpx (and h2)
+# installed, a downloader can send through one shared httpx client instead:
+# over TLS it negotiates HTTP/2, so every task fetching from the same CDN
+# multiplexes on a single connection. Responses are turned back into
+# requests.Response objects, so fetch(), read_body() and the parsers don't
+# change. Content-Encoding is negotiated by whichever library sends: both
+# advertise br when the brotli package is installed, gzip/deflate always.
+HTTP_TRANSPORT = os.environ.get('HTTP_TRANSPORT', 'requests') # Default for new tasks: 'requests' or 'httpx'
+HTTPX_MAX_CONNECTIONS = 100
+HTTPX_MAX_KEEPALIVE = 20
+httpx_client = None
+httpx_client_lock = threading.Lock()
+
+def get_httpx_client():
+    """The process-wide httpx client; pooling and HTTP/2 streams are shared by all tasks"""
+    global httpx_client
+    with httpx_client_lock:
+        if httpx_client is None:
+            httpx_client = httpx.Client(http2=h2 is not None, follow_redirects=False, # Session handles redirects
+                                        limits=httpx.Limits(max_connections=HTTPX_MAX_CONNECTIONS,
+                                                            max_keepalive_connections=HTTPX_MAX_KEEPALIVE))
+        return httpx_client
+
+def transport_available(name):
+    return name == 'requests' or (name == 'httpx' and httpx is not None)
+
+class HttpxBody:
+    """Streamed httpx body behind the file-like API requests reads resp.raw with"""
+    def __init__(self, resp, request):
+        self.resp = resp
+        self.request = request
+        self.chunks = resp.iter_bytes() # Decoded
+        self.buffer = b''
+        self._original_response = self.msg = self # What requests reads Set-Cookie through
+
+    def read(self, amt=None, **kwargs):
+        try:
+            while amt is None or len(self.buffer) < amt:
+                chunk = next(self.chunks, None)
+                if chunk is None:
+                    break
+                self.buffer += chunk
+        except httpx.TimeoutException as e:
+            raise RequestTimeout(e, request=self.request)
+        except httpx.TransportError as e:
+            raise ConnectionError(e, request=self.request)
+        data, self.buffer = (self.buffer, b'') if amt is None else (self.buffer[:amt], self.buffer[amt:])
+        return data
+
+    def tell(self):
+        return self.resp.num_bytes_downloaded # On the wire, like the Content-Length it's compared with
+
+    def get_all(self, name, default=None):
+        return self.resp.headers.get_list(name) or default
+
+    def close(self):
+        self.resp.close()
+
+class HttpxAdapter(BaseAdapter):
+    """requests adapter that sends through the shared httpx client"""
+    def __init__(self, client=None):
+        super().__init__()
+        self.client = client or get_httpx_client()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        req = httpx.Request(request.method, request.url, headers=dict(request.headers), content=request.body,
+                            extensions={'timeout': httpx.Timeout(timeout).as_dict()})
+        try:
+            r = self.client.send(req, stream=True)
+        except httpx.TimeoutException as e:
+            raise RequestTimeout(e, request=request)
+        except httpx.TransportError as e:
+            raise ConnectionError(e, request=request)
+        resp = requests.Response()
+        resp.status_code = r.status_code
+        resp.reason = r.reason_phrase
+        resp.headers = CaseInsensitiveDict(r.headers)
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp.raw = HttpxBody(r, request)
+        resp.url = request.url
+        resp.request = request
+        resp.connection = self
+        if not stream:
+            resp.content
+        return resp
+
+    def close(self):
+        pass # The client outlives any one session
+
+def use_transport(session, name):
+    """Mount the named transport under a Session; 'requests' keeps its own adapters"""
+    if name == 'httpx':
+        adapter = HttpxAdapter()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    return session
+
+# Called with every new downloader session, after the cassette. Harnesses use
+# it to route the real site URLs somewhere else (see mock_site.py)
+TRANSPORT_HOOKS = []
+
+def mount_transports(session, transport='requests'):
+    use_transport(session, transport)
+    use_cassette(session)
+    for hook in TRANSPORT_HOOKS:
+        hook(session)
+    return session
+
+# --- DNS Cache & Connection Warm-up ---
+# Every task has its own Session, so the first TOC fetch of each one paid DNS
+# and a TCP/TLS handshake, and so did every connection opened after an early
+# abort closed one. At task start a few connections to the book's host are
+# opened in the background while the TOC is fetched, so the first chapters go
+# out on sockets that are already up. Lookups can also be cached for DNS_TTL
+# seconds (getaddrinfo gives no TTL), but only by replacing socket.getaddrinfo
+# for the whole process, every library in it included: off unless DNS_TTL is
+# set in the environment.
+DNS_TTL = int(os.environ.get('DNS_TTL', '0')) # Seconds, 0 leaves lookups to the system resolver
+DNS_CACHE_SIZE = 1024
+WARMUP_CONNECTIONS = 2 # Per task: one chapter fetch plus a hedge
+WARMUP_TIMEOUT = 5
+dns_cache = {} # getaddrinfo args -> (expires, result)
+dns_cache_lock = threading.Lock()
+system_getaddrinfo = socket.getaddrinfo
+warmup_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='warmup')
+
+def cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    key = (host, port, family, type, proto, flags)
+    now = time.monotonic()
+    with dns_cache_lock:
+        hit = dns_cache.get(key)
+    if hit and hit[0] > now:
+        DNS_LOOKUPS.inc('hit')
+        return hit[1]
+    result = system_getaddrinfo(host, port, family, type, proto, flags) # Failures aren't cached
+    DNS_LOOKUPS.inc('miss')
+    with dns_cache_lock:
+        if len(dns_cache) >= DNS_CACHE_SIZE:
+            dns_cache.pop(next(iter(dns_cache))) # Oldest insert
+        dns_cache[key] = (now + DNS_TTL, result)
+    return result
+
+if DNS_TTL:
+    socket.getaddrinfo = cached_getaddrinfo # urllib3 and httpx both resolve through it
+
+def warm_connections(session, url, n):
+    """Open up to n connections to url's host with parallel HEAD requests; they
+    stay idle in the session's pool. Returns how many answered.
+
+    Best effort: a failure is logged and the first fetch connects as it
+    always did.
+    """
+    if type(session.get_adapter(url)).send is not HTTPAdapter.send:
+        return 0 # Replay, mock routing or httpx: requests don't go out through this pool
+    if session.trust_env and requests.utils.get_environ_proxies(url):
+        return 0
+    def head():
+        session.head(url, timeout=WARMUP_TIMEOUT, allow_redirects=False).close()
+    opened = 0
+    with ThreadPoolExecutor(max_workers=n) as pool: # At once, or they'd share one connection
+        for future in [pool.submit(head) for _ in range(n)]:
+            try:
+                future.result()
+                opened += 1
+            except Exception as e:
+                print(f"> 预热连接失败 {urlparse(url).netloc}: {e}")
+    return opened
+
+# --- Charset Detection ---
+# apparent_encoding runs detection over the whole body of every page. Instead:
+# the Content-Type charset, then a <meta> charset in the first few KB, then
+# what earlier pages of the same domain turned out to be, and only then a
+# sniff of the start of the body. Sites with a fixed charset skip all of it.
+CHARSET_META_BYTES = 4096
+CHARSET_SNIFF_BYTES = 16384
+CHARSET_ALIASES = {'gb2312': 'gb18030', 'gbk': 'gb18030', 'x-gbk': 'gb18030', 'utf8': 'utf-8'} # GB2312 pages use GBK chars
+CHARSET_HEADER_RE = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+CHARSET_META_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)', re.I)
+domain_charsets = {}
+domain_charsets_lock = threading.Lock()
+
+def normalize_charset(name):
+    """Python codec name for a declared charset, None if unknown"""
+    if isinstance(name, bytes):
+        name = name.decode('ascii', 'ignore')
+    name = CHARSET_ALIASES.get(name.strip().lower(), name.strip().lower())
+    try:
+        codecs.lookup(name)
+    except LookupError:
+        return None
+    return name
+
+def sniff_charset(data):
+    """Charset of a body prefix: UTF-8 if it decodes cleanly, else the detector's guess"""
+    sample = data[:CHARSET_SNIFF_BYTES]
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False) # A cut multi-byte char is fine
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    guess = chardet.detect(sample).get('encoding')
+    return normalize_charset(guess) if guess else 'gb18030'
+
+def detect_charset(resp):
+    domain = urlparse(resp.url).netloc
+    m = CHARSET_HEADER_RE.search(resp.headers.get('Content-Type', ''))
+    charset = normalize_charset(m.group(1)) if m else None
+    source = 'header'
+    if not charset:
+        m = CHARSET_META_RE.search(resp.content[:CHARSET_META_BYTES])
+        charset = normalize_charset(m.group(1)) if m else None
+        source = 'meta'
+    if not charset:
+        with domain_charsets_lock:
+            charset = domain_charsets.get(domain)
+        source = 'domain_cache'
+    if not charset:
+        charset = sniff_charset(resp.content)
+        source = 'sniff'
+    CHARSET_DECISIONS.inc(source)
+    if source != 'domain_cache':
+        with domain_charsets_lock:
+            domain_charsets[domain] = charset
+    return charset
+
+# --- Streamed Pages ---
+# Every fetch streams. Error statuses never read their body, and a chapter page
+# stops once its content container has closed and the next-page link has gone
+# by, so long footers, comments and scripts are neither downloaded nor parsed.
+STREAM_CUTOFF = True # Use the PageCutoff a downloader passes; False reads every page whole
+STREAM_CHUNK = 8192
+STREAM_DRAIN_BYTES = 16384 # A tail this small is read anyway so the connection stays reusable
+DIV_TAG_RE = re.compile(rb'<(/?)div\b', re.I)
+NEXT_LINK_LOOKBACK = 512 # Bytes re-scanned per chunk so a next link cut by the chunk boundary is still seen
+
+class PageCutoff:
+    """Incremental scan of a streamed page for the end of `<div id=container>`
+    and the `</a>` closing the first next-page link. next_link_re must match
+    inside an `<a>` tag only, so a "下一页" in the text or a `<link rel=next>`
+    in the head is no cut point. feed() looks only at bytes added since the
+    last call and returns the offset the page can be cut at.
+    """
+    def __init__(self, container_id, next_link_re):
+        self.container_id = container_id
+        self.container_re = re.compile(rb'<div\b[^>]*\bid=["\']?' + re.escape(container_id) + rb'(?![\w-])', re.I)
+        self.next_link_re = next_link_re
+        self.pos = 0 # Scan position for the container start and the next markers
+        self.div_pos = None # Scan position inside the container
+        self.depth = 0
+        self.content_end = None
+        self.next_end = None
+
+    def fresh(self):
+        return PageCutoff(self.container_id, self.next_link_re)
+
+    def feed(self, buf):
+        n = len(buf)
+        if self.div_pos is None:
+            m = self.container_re.search(buf, max(0, self.pos - 256))
+            if m:
+                self.div_pos, self.depth = m.end(), 1
+        if self.div_pos is not None and self.content_end is None:
+            for m in DIV_TAG_RE.finditer(buf, self.div_pos):
+                if m.end() >= n:
+                    break # Possibly a tag cut by the chunk boundary
+                depth = self.depth + (-1 if m.group(1) else 1)
+                if depth == 0:
+                    gt = buf.find(b'>', m.end())
+                    if gt < 0:
+                        break
+                    self.content_end = gt + 1
+                    break
+                self.depth, self.div_pos = depth, m.end()
+            else:
+                self.div_pos = max(self.div_pos, n - 8)
+        if self.next_end is None:
+            m = self.next_link_re.search(buf, max(0, self.pos - NEXT_LINK_LOOKBACK))
+            if m:
+                close = buf.find(b'</a>', m.end())
+                if close >= 0:
+                    self.next_end = close + 4
+        if self.next_end is None:
+            self.pos = n
+        if self.content_end is not None and self.next_end is not None:
+            return max(self.content_end, self.next_end)
+        return None
+
+def read_body(resp, cutoff=None):
+    """Load a streamed response's body into resp.content, stopping early where possible.
+
+    Returns the number of body bytes left unread when known, else 0.
+    """
+    scanner = cutoff.fresh() if cutoff and STREAM_CUTOFF and resp.status_code < 400 else None
+    if isinstance(resp._content, bytes):
+        resp._content_consumed = True # Built in memory by an adapter (replay, fixtures): nothing on the wire
+    in_memory = resp._content_consumed
+    buf = bytearray()
+    cut = None
+    finished = False
+    if resp.status_code < 400:
+        for chunk in resp.iter_content(STREAM_CHUNK):
+            buf += chunk
+            if scanner:
+                cut = scanner.feed(buf)
+                if cut is not None:
+                    break
+        else:
+            finished = True
+    skipped = 0
+    if not finished and not in_memory:
+        length = resp.headers.get('Content-Length', '')
+        remaining = int(length) - resp.raw.tell() if length.isdigit() and hasattr(resp.raw, 'tell') else None
+        if remaining is not None and remaining <= STREAM_DRAIN_BYTES:
+            for _ in resp.iter_content(STREAM_CHUNK):
+                pass
+        else:
+            skipped = max(remaining or 0, 0)
+            resp.raw.close() # Unread bytes on the socket: the connection can't go back to the pool
+    resp._content = bytes(buf[:cut] if cut is not None else buf)
+    resp._content_consumed = True
+    resp.close()
+    return skipped
+
+# --- Parse Pool ---
+# BeautifulSoup and the text cleanup hold the GIL, so with many tasks running
+# the chapter parsing starved the fetch threads. Chapter pages are parsed by
+# page_parsers.py functions (bytes in, cleaned text out), which can run in a
+# process pool shared by every task while the fetch thread just waits on the
+# result. Workers only import page_parsers (bs4, no app state), plus the
+# main script, which spawn re-runs in each of them: fine under gunicorn, but
+# started with `python app.py` every worker would load the whole app again.
+# Opt in with PARSE_PROCESSES=N; every gunicorn worker gets its own pool.
+PARSE_PROCESSES = int(os.environ.get('PARSE_PROCESSES', '0')) # 0: parse inline
+parse_pool = None
+parse_pool_lock = threading.Lock()
+
+def get_parse_pool():
+    global parse_pool
+    if not PARSE_PROCESSES:
+        return None
+    with parse_pool_lock:
+        if parse_pool is None:
+            # spawn, not fork: forking a process full of threads can copy held locks
+            parse_pool = ProcessPoolExecutor(max_workers=PARSE_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        return parse_pool
+
+def run_parser(parser, *args):
+    """parser(*args) in the parse pool, inline when there is none or it broke"""
+    global parse_pool
+    pool = get_parse_pool()
+    if pool is None:
+        return parser(*args)
+    try:
+        return pool.submit(parser, *args).result()
+    except BrokenProcessPool:
+        print("> 解析进程池异常，重建后改为本线程解析")
+        with parse_pool_lock:
+            if parse_pool is pool:
+                parse_pool = None # The next call starts a fresh pool
+        return parser(*args)
+
 # --- Universal Downloader Classes ---
 
 class BaseDownloader:
+    use_toc_cache = True
+    charset = None # Fixed page charset of the site, skips detection
+    transport = None # 'requests' or 'httpx' for this site, None follows HTTP_TRANSPORT
+
     def __init__(self, start_url, task_id):
         self.start_url = start_url
         self.task_id = task_id
-        self.session = requests.Session()
-        self.session.headers.update(HEADERS)
+        self.transport = self.transport or HTTP_TRANSPORT
+        self.session = self.new_session()
+        self.book_key = book_key(start_url)
+        self.fingerprint = None # toc_fingerprint() once the chapter list is in
+        self.toc_complete = True # False when get_chapter_list fell back to part of the TOC
+        self.chapter_keys = {} # chapter_keys() key -> index, for tasks reusing this one's files
+        self.index_keys = {} # and back
         self.domain = urlparse(start_url).netloc
         self.log_messages = []
         self.current_chapter_real_title = None # To store title found during fetch
         self.last_log_msg = None
         self.failed_chapters = [] # Store failed chapters for manual retry
+        self.retry_policy = RetryPolicy() # Per task: the retry budget is shared by all its fetches
+        self.hedge = HEDGE_REQUESTS
+        self.hedge_stats = {'sent': 0, 'won': 0}
+        self.all_chapters = None
+        self.pending_chapters = deque() # Fetch queue, readers can push chapters to the front
+        self.queue_lock = threading.Lock()
+        self.chapter_ready = threading.Condition() # Notified whenever a chapter file is written
+        self.missing_chapters = set() # Indexes that came back 404
+        self.trace = None # DownloadTrace when the task is traced
+
+    def new_session(self):
+        if not transport_available(self.transport):
+            print(f"> 传输 {self.transport} 不可用（未安装 httpx?），使用 requests")
+            self.transport = 'requests'
+        session = mount_transports(requests.Session(), self.transport)
+        session.headers.update(HEADERS)
+        return session
+
+    def set_transport(self, name):
+        """Switch to another transport; takes a fresh session"""
+        if name != self.transport:
+            self.transport = name
+            self.session = self.new_session()
+
+    def warm_up(self):
+        """Open connections to the book's host in the background"""
+        if WARMUP_CONNECTIONS:
+            warmup_executor.submit(self.warm_connections)
+
+    def warm_connections(self):
+        start = time.time()
+        opened = warm_connections(self.session, self.start_url, WARMUP_CONNECTIONS)
+        if opened:
+            self.span('warmup', start, connections=opened)
 
     def log(self, msg):
         # Deduplication Check
@@ -101,24 +1092,112 @@ class BaseDownloader:
         print(f"> {msg}")
         self.log_messages.append(msg)
 
-    def get_with_retry(self, url, retries=5):
-        """Standardized retry wrapper for ALL requests"""
-        for i in range(retries):
-            try:
-                resp = self.session.get(url, timeout=15) # Increased timeout
-                resp.raise_for_status()
-                # Basic content check
-                if len(resp.content) < 500 and resp.status_code == 200:
-                     raise ValueError("Content too short (possible block page)")
+    def span(self, stage, start, **args):
+        """Record stage [start, now) on the task trace, if there is one"""
+        if self.trace is not None:
+            self.trace.add(stage, start, time.time(), **args)
+
+    def parse_html(self, markup):
+        start = time.time()
+        soup = BeautifulSoup(markup, 'html.parser')
+        self.span('parse', start)
+        return soup
+
+    def parse_page(self, parser, resp, *args):
+        """parser((body, charset), *args) for one page, in the parse pool when there is one.
+        The charset comes from the site or detect_charset(), never a whole-body detection."""
+        start = time.time()
+        result = run_parser(parser, (resp.content, self.charset or detect_charset(resp)), *args)
+        self.span('parse', start)
+        return result
+
+    def fetch(self, url, timeout=15, cutoff=None):
+        """Single GET, recorded in the metrics; the body is read up to `cutoff`"""
+        domain, kind = urlparse(url).netloc, type(self).__name__
+        start = time.time()
+        try:
+            resp = self.send(url, timeout)
+            skipped = read_body(resp, cutoff)
+        except Exception as e:
+            FETCH_RESPONSES.inc(domain, kind, type(e).__name__)
+            self.span('fetch', start, url=url, error=type(e).__name__)
+            raise
+        self.span('fetch', start, url=url, status=resp.status_code)
+        FETCH_SECONDS.observe(time.time() - start, domain, kind)
+        FETCH_RESPONSES.inc(domain, kind, str(resp.status_code))
+        FETCH_BYTES.inc(domain, kind, amount=len(resp.content))
+        if skipped:
+            FETCH_BYTES_SKIPPED.inc(domain, kind, amount=skipped)
+        return resp
+
+    def send(self, url, timeout):
+        """GET that feeds the domain latency stats and hedges slow answers"""
+        latency = get_domain_latency(urlparse(url).netloc)
+        start = time.time()
+        delay = latency.hedge_delay() if self.hedge else None
+        if delay is None:
+            resp = self.session.get(url, timeout=timeout, stream=True)
+            latency.observe(time.time() - start)
+            return resp
+
+        primary = hedge_executor.submit(self.session.get, url, timeout=timeout, stream=True)
+        done, _ = wait([primary], timeout=delay)
+        if done or not latency.take_hedge():
+            resp = primary.result()
+            latency.observe(time.time() - start)
+            return resp
+
+        self.hedge_stats['sent'] += 1
+        backup = hedge_executor.submit(self.session.get, url, timeout=timeout, stream=True)
+        racing = [primary, backup]
+        error = None
+        while racing:
+            done, _ = wait(racing, return_when=FIRST_COMPLETED)
+            for future in done:
+                racing.remove(future)
+                try:
+                    resp = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                # requests can't be interrupted mid-flight: the loser is closed
+                # as soon as its headers land, before its body is read
+                for other in racing:
+                    other.add_done_callback(close_quietly)
+                if future is backup:
+                    self.hedge_stats['won'] += 1
+                if self.task_id in tasks:
+                    tasks[self.task_id]['hedges'] = dict(self.hedge_stats)
+                latency.observe(time.time() - start)
                 return resp
-            except (SSLError, ReadTimeout, ConnectionError, ChunkedEncodingError, ValueError) as e:
-                wait_time = (i + 1) * 3  # 3s, 6s, 9s, 12s, 15s
-                self.log(f"网络波动 ({str(e)[:50]}...)，{wait_time}秒后重试...")
-                time.sleep(wait_time)
-            except Exception as e:
-                # Other errors, just retry slowly
-                time.sleep(5)
-        return None
+        raise error
+
+    def request(self, url, timeout=15, validate=None, attempts=None, cutoff=None):
+        """Fetch through the task's RetryPolicy: (outcome, resp), outcome 'ok' / 'not_found' / 'failed'"""
+        domain, kind = urlparse(url).netloc, type(self).__name__
+        start = time.time()
+
+        def on_retry(reason, delay):
+            FETCH_RETRIES.inc(domain, kind, reason)
+            if self.trace is not None:
+                now = time.time()
+                self.trace.add('backoff', now, now + delay, url=url, reason=reason)
+
+        outcome, resp = self.retry_policy.run(lambda t: self.fetch(url, timeout=t, cutoff=cutoff), validate=validate,
+                                              log=self.log, timeout=timeout, attempts=attempts,
+                                              on_retry=on_retry)
+        io_clock.seconds = io_seconds() + time.time() - start # Includes back-off sleeps
+        if self.task_id in tasks:
+            tasks[self.task_id]['retries'] = self.retry_policy.snapshot()
+        return outcome, resp
+
+    def set_encoding(self, resp):
+        resp.encoding = self.charset or detect_charset(resp)
+
+    def get_with_retry(self, url, retries=None, cutoff=None):
+        """Standardized retry wrapper for ALL requests"""
+        outcome, resp = self.request(url, validate=check_not_block_page, attempts=retries, cutoff=cutoff)
+        return resp if outcome == 'ok' else None
 
     def update_progress(self, current, total):
         if self.task_id in tasks:
@@ -130,12 +1209,24 @@ class BaseDownloader:
     def match(url):
         return False
 
+    @staticmethod
+    def canonical_url(url):
+        """Book identity of a start URL: host without www./m., path without the TOC page name"""
+        parts = urlparse(url)
+        host = re.sub(r'^(www|m|wap)\.', '', parts.netloc.lower())
+        path = re.sub(r'/(index|list)\.(html?|php)$', '', parts.path).rstrip('/')
+        return f"{host}{path}" + (f"?{parts.query}" if parts.query else '')
+
     def get_chapter_list(self):
         raise NotImplementedError
 
     def get_chapter_content(self, url):
         raise NotImplementedError
 
+    def fetch_chapter(self, chapter):
+        """Content of one chapter dict; subclasses may pick among several URLs"""
+        return self.get_chapter_content(chapter['url'])
+
     def check_control(self):
         while True:
             task = tasks.get(self.task_id)
@@ -154,7 +1245,12 @@ class BaseDownloader:
     def run(self):
         try:
             self.log(f"开始分析页面: {self.start_url}")
-            chapters = self.get_chapter_list()
+            self.warm_up() # While the TOC loads
+            chapters = get_cached_toc(self.start_url) if self.use_toc_cache else None
+            if chapters:
+                self.log("使用搜索时预取的目录")
+            else:
+                chapters = self.get_chapter_list()
             
             # File Setup
             book_title = clean_filename(chapters[0].get('book_name', 'Unknown_Novel'))
@@ -168,6 +1264,13 @@ class BaseDownloader:
 
             tasks[self.task_id]['filename'] = filename
             
+            # Chapter files are named by position in the full list, keep it on
+            # the chapter so retries and reordered fetches write the right file
+            for i, chapter in enumerate(chapters):
+                chapter['index'] = i
+            self.all_chapters = chapters
+            self.register_book(chapters)
+            
             total = len(chapters)
             tasks[self.task_id]['total'] = total
             self.log(f"发现 {total} 章 (含自动修补)，准备下载到: {filename}")
@@ -177,6 +1280,7 @@ class BaseDownloader:
             
             # Final Assembly
             self.assemble_novel(chapters)
+            index_book_async(self.filepath)
             
             # Final Status Update
             self.log(f"下载任务结束！成功: {tasks[self.task_id]['success']}, 失败: {tasks[self.task_id]['fail']}")
@@ -191,30 +1295,66 @@ class BaseDownloader:
             self.cleanup_error()
         finally:
             with active_urls_lock:
-                if self.start_url in active_urls:
-                    active_urls.remove(self.start_url)
+                active_urls.discard(self.book_key)
 
     def assemble_novel(self, chapters):
         """Combine all individual chapter files into the final TXT in order"""
         self.log("正在合并文件，确保章节顺序...")
         try:
-            with open(self.filepath, 'w', encoding='utf-8') as outfile:
-                outfile.write(f"Book: {chapters[0].get('book_name', 'Unknown')}\nSource: {self.start_url}\n\n")
+            # Byte spans of every chapter (title line .. end of text), saved
+            # next to the TXT so the reader can serve one chapter with a seek
+            # Written aside and swapped in: /api/read may have the old file
+            # mmapped, and truncating it under a reader kills the process (SIGBUS)
+            spans = []
+            tmp_path = f"{self.filepath}.{self.task_id}.tmp"
+            with open(tmp_path, 'wb') as outfile:
+                header = f"Book: {chapters[0].get('book_name', 'Unknown')}\nSource: {self.start_url}\n\n".encode('utf-8')
+                outfile.write(header)
+                pos = len(header)
                 
                 for i in range(len(chapters)):
                     chap_path = os.path.join(self.chapters_dir, f"{i:05d}.txt")
                     if os.path.exists(chap_path):
-                        with open(chap_path, 'r', encoding='utf-8') as infile:
-                            outfile.write(infile.read())
+                        with open(chap_path, 'rb') as infile:
+                            data = infile.read()
+                        outfile.write(data)
+                        end = data.rfind(b"\n" + b"=" * 30)
+                        spans.append((pos, pos + (end if end >= 0 else len(data))))
+                        pos += len(data)
+            os.replace(tmp_path, self.filepath)
+            write_chapter_index(self.filepath, spans)
             self.log("合并完成！")
         except Exception as e:
             self.log(f"合并文件失败: {e}")
 
+    def chapter_path(self, index):
+        return os.path.join(self.chapters_dir, f"{index:05d}.txt")
+
+    def prioritize(self, index, ahead=5):
+        """Move chapter `index` and the next few to the front of the fetch queue"""
+        wanted = set(range(index, index + ahead))
+        with self.queue_lock:
+            front = [c for c in self.pending_chapters if c['index'] in wanted]
+            if not front:
+                return False
+            self.pending_chapters = deque(
+                front + [c for c in self.pending_chapters if c['index'] not in wanted])
+        return True
+
     def download_chapters(self, chapters):
         """Separate method to handle the download loop, reusable for retries"""
         total = tasks[self.task_id].get('total', len(chapters)) # Use existing total if available
         
-        for i, chapter in enumerate(chapters):
+        with self.queue_lock:
+            self.pending_chapters = deque(chapters)
+        processed = 0
+        
+        while True:
+            with self.queue_lock:
+                if not self.pending_chapters: break
+                chapter = self.pending_chapters.popleft()
+            processed += 1
+            
             # Check control - Handle Pause with Assembly
             while True:
                 task = tasks.get(self.task_id)
@@ -224,7 +1364,7 @@ class BaseDownloader:
                     if task['status'] != 'paused':
                         task['status'] = 'paused'
                         self.log("任务已暂停... (正在生成临时文件)")
-                        self.assemble_novel(chapters) 
+                        self.assemble_novel(self.all_chapters or chapters) 
                         self.log("已暂停。可下载当前进度。")
                     time.sleep(1)
                 else:
@@ -238,58 +1378,154 @@ class BaseDownloader:
             title = chapter['title']
             url = chapter['url']
             
-            # Check if already downloaded (for retry or resume logic if we implemented persistence)
-            chap_path = os.path.join(self.chapters_dir, f"{i:05d}.txt")
-            if os.path.exists(chap_path) and not chapter in self.failed_chapters:
-                # Already exists and not marked for retry? Skip.
-                # But wait, 'download_chapters' is called with full list in 'run', 
-                # or partial list in 'retry'.
-                # Logic: If running full list, check existence.
-                # If content is valid? 
-                pass 
+            # Already downloaded and not marked for retry: skip
+            chap_path = self.chapter_path(chapter['index'])
 
             # Only log if we are actually downloading
-            if not os.path.exists(chap_path) or chapter in self.failed_chapters:
-                 self.log(f"正在处理: {title}")
-                 
-                 # Fetch content
-                 self.current_chapter_real_title = None
-                 content = self.get_chapter_content(url)
-                 
-                 # Anti-bot
-                 if not chapter in self.failed_chapters: # Don't sleep as much on manual retry?
-                    time.sleep(random.uniform(0.5, 1.5))
-
-                 if content == "404":
-                     self.log(f"章节不存在 (404)，已跳过: {title}")
-                     continue
-
-                 # Handling Failures
-                 if not content.strip():
-                     self.log(f"下载失败，加入补录列表: {title}")
-                     if chapter not in self.failed_chapters:
-                        tasks[self.task_id]['fail'] += 1
-                        self.failed_chapters.append(chapter) 
-                        tasks[self.task_id]['has_failed'] = True 
-                     continue
-                 
-                 # Success
-                 final_title = self.current_chapter_real_title if self.current_chapter_real_title else title
-                 
-                 # Write to individual file
-                 with open(chap_path, 'w', encoding='utf-8') as f:
-                     f.write(f"{final_title}\n\n")
-                     f.write(content)
-                     f.write("\n" + "="*30 + "\n\n")
-                 
-                 # If it was a retry, remove from failed list logic handled in retry_run
-                 if chapter not in self.failed_chapters:
-                    tasks[self.task_id]['success'] += 1
-                 
-                 # Update percentage
-                 # Recalculate based on files present? 
-                 # Simplify: just increment. 
-                 self.update_progress(i + 1, total)
+            if os.path.exists(chap_path) and chapter not in self.failed_chapters:
+                continue
+            self.log(f"正在处理: {title}")
+            started = time.time()
+            if self.trace is not None:
+                self.trace.begin(chapter['index'])
+            outcome = self.download_chapter(chapter, chap_path)
+            if self.trace is not None:
+                self.trace.end(started, title, outcome)
+                tasks[self.task_id]['trace'] = self.trace.summary()
+            if outcome == 'ok':
+                # Update percentage
+                self.update_progress(processed, total)
+
+    def register_book(self, chapters):
+        """Fingerprint the TOC and list this task under it, for later tasks on the same book"""
+        self.index_keys = {c['index']: key for c, key in zip(chapters, chapter_keys(chapters)) if key is not None}
+        self.chapter_keys = {key: index for index, key in self.index_keys.items()}
+        self.fingerprint = toc_fingerprint(chapters)
+        if self.fingerprint:
+            with books_lock:
+                peers = books.setdefault(self.fingerprint, [])
+                if self not in peers:
+                    peers.append(self)
+
+    def copy_from_peer(self, chapter, chap_path):
+        """Copy the chapter file of another task on the same book, if one has it"""
+        key = self.index_keys.get(chapter['index'])
+        if not self.fingerprint or key is None:
+            return False
+        with books_lock:
+            peers = [d for d in books.get(self.fingerprint, ()) if d is not self]
+        for peer in peers:
+            index = peer.chapter_keys.get(key)
+            if index is None or index in peer.missing_chapters:
+                continue
+            src = peer.chapter_path(index)
+            if not os.path.exists(src):
+                continue
+            try:
+                shutil.copyfile(src, chap_path + '.tmp')
+                os.replace(chap_path + '.tmp', chap_path)
+            except OSError:
+                continue
+            self.log(f"复用已下载章节: {chapter['title']}")
+            return True
+        return False
+
+    def download_chapter(self, chapter, chap_path):
+        """Fetch one chapter and write its file: 'ok', 'missing' or 'failed'"""
+        title = chapter['title']
+
+        if self.copy_from_peer(chapter, chap_path):
+            CHAPTERS.inc(type(self).__name__, 'reused')
+            with self.chapter_ready:
+                self.chapter_ready.notify_all()
+            if chapter not in self.failed_chapters:
+                tasks[self.task_id]['success'] += 1
+            return 'ok'
+
+        # Fetch content; another task fetching the same URL right now shares its result
+        self.current_chapter_real_title = None
+        started, io_before = time.time(), io_seconds()
+        (content, real_title), shared = singleflight(chapter['url'], lambda: (self.fetch_chapter(chapter), self.current_chapter_real_title))
+        self.current_chapter_real_title = real_title
+        if not shared:
+            PARSE_SECONDS.observe(max(0.0, time.time() - started - (io_seconds() - io_before)), type(self).__name__)
+
+        # Anti-bot
+        if not chapter in self.failed_chapters and not shared: # Don't sleep as much on manual retry?
+            started = time.time()
+            time.sleep(random.uniform(*CHAPTER_DELAY))
+            self.span('sleep', started)
+
+        if content == "404":
+            CHAPTERS.inc(type(self).__name__, 'missing')
+            self.log(f"章节不存在 (404)，已跳过: {title}")
+            self.missing_chapters.add(chapter['index'])
+            with self.chapter_ready:
+                self.chapter_ready.notify_all()
+            return 'missing'
+
+        # Handling Failures
+        if not content.strip():
+            CHAPTERS.inc(type(self).__name__, 'failed')
+            self.log(f"下载失败，加入补录列表: {title}")
+            if chapter not in self.failed_chapters:
+                tasks[self.task_id]['fail'] += 1
+                self.failed_chapters.append(chapter)
+                tasks[self.task_id]['has_failed'] = True
+            with self.chapter_ready:
+                self.chapter_ready.notify_all()
+            return 'failed'
+
+        # Success
+        CHAPTERS.inc(type(self).__name__, 'ok')
+        final_title = self.current_chapter_real_title if self.current_chapter_real_title else title
+
+        # Write to individual file (tmp + rename, readers may be watching)
+        started = time.time()
+        tmp_path = chap_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f"{final_title}\n\n")
+            f.write(content)
+            f.write("\n" + "="*30 + "\n\n")
+        os.replace(tmp_path, chap_path)
+        self.span('write', started)
+        with self.chapter_ready:
+            self.chapter_ready.notify_all()
+
+        # If it was a retry, remove from failed list logic handled in retry_run
+        if chapter not in self.failed_chapters:
+            tasks[self.task_id]['success'] += 1
+        return 'ok'
+
+    def read_chapter(self, index, wait=0):
+        """Chapter `index` of this task for the reader: (status, title, text).
+
+        status is 'ready', 'pending', 'missing' (404 at the source) or 'failed'.
+        A chapter that isn't on disk yet is moved to the front of the queue and
+        waited for at most `wait` seconds.
+        """
+        chap_path = self.chapter_path(index)
+        deadline = time.time() + wait
+        prioritized = False
+        with self.chapter_ready:
+            while not os.path.exists(chap_path):
+                if index in self.missing_chapters:
+                    return 'missing', None, None
+                if any(c.get('index') == index for c in self.failed_chapters):
+                    return 'failed', None, None
+                if not prioritized:
+                    prioritized = True
+                    if self.prioritize(index):
+                        self.log(f"读者请求，优先下载: {self.all_chapters[index]['title']}")
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return 'pending', None, None
+                self.chapter_ready.wait(remaining)
+        with open(chap_path, 'rb') as f:
+            data = f.read()
+        end = data.rfind(b"\n" + b"=" * 30)
+        title, text = split_chapter(data[:end] if end >= 0 else data)
+        return 'ready', title, text
 
     def retry_run(self):
         """Method to restart downloading only failed chapters"""
@@ -310,6 +1546,7 @@ class BaseDownloader:
         if hasattr(self, 'all_chapters'):
              self.download_chapters(retry_list) # This will overwrite specific files
              self.assemble_novel(self.all_chapters) # Re-assemble EVERYTHING
+             index_book_async(self.filepath)
         else:
              self.log("错误：找不到原始章节列表，无法排序合并。")
         
@@ -319,22 +1556,30 @@ class BaseDownloader:
     def cleanup_error(self):
         tasks[self.task_id]['status'] = 'error'
         with active_urls_lock:
-            if self.start_url in active_urls:
-                active_urls.remove(self.start_url)
+            active_urls.discard(self.book_key)
+
 
+CHEYIL_CUTOFF = PageCutoff(b'chaptercontent', re.compile(rb'<a\b[^>]*\brel=["\']?next\b', re.I))
 
 class CheyilDownloader(BaseDownloader):
+    charset = 'utf-8'
+
     @staticmethod
     def match(url):
         return 'cheyil.cc' in url
 
+    @staticmethod
+    def canonical_url(url):
+        m = re.search(r'/book/(\d+)', url)
+        return f"cheyil.cc/book/{m.group(1)}" if m else BaseDownloader.canonical_url(url)
+
     def get_chapter_list(self):
         response = self.get_with_retry(self.start_url)
         if not response:
              self.log("致命错误：无法访问目录页")
              return []
         
-        response.encoding = 'utf-8'
+        self.set_encoding(response)
         soup = BeautifulSoup(response.text, 'html.parser')
 
         # Try Meta OG:TITLE first
@@ -368,24 +1613,15 @@ class CheyilDownloader(BaseDownloader):
             visited.add(current_url)
 
             try:
-                resp = self.get_with_retry(current_url)
+                resp = self.get_with_retry(current_url, cutoff=CHEYIL_CUTOFF)
                 if not resp:
                     self.log(f"章节获取失败（重试耗尽）: {current_url}")
                     break
                     
-                resp.encoding = 'utf-8'
-                soup = BeautifulSoup(resp.text, 'html.parser')
-                
-                content_div = soup.find('div', id='chaptercontent')
-                if content_div:
-                    for p in content_div.find_all('p'):
-                        txt = p.get_text(strip=True)
-                        if "本章未完" not in txt and "请点击下一页" not in txt:
-                            text_buffer += "    " + txt + "\n\n"
+                text, has_next, href = self.parse_page(parse_cheyil_page, resp)
+                text_buffer += text
                             
-                next_link = soup.find('a', rel='next')
-                if next_link:
-                    href = next_link.get('href')
+                if has_next:
                     full_next = urljoin(current_url, href)
                     if not href or href == '#' or 'book' in href and href.endswith('/'):
                         current_url = None
@@ -403,14 +1639,31 @@ class CheyilDownloader(BaseDownloader):
         return text_buffer
 
 
+def quanben_page_check(resp):
+    """Validator: a Quanben chapter page without the content div and barely any body is a stub"""
+    if b'id="content"' not in resp.content and len(resp.content) < 500: # Bytes: .text would detect the charset
+        return 'invalid_content'
+    return None
+
+QUANBEN_CUTOFF = PageCutoff(b'content', re.compile(rb'<a\b[^>]*>(?:(?!</a>).)*?' + '下一页'.encode('utf-8'), re.I | re.S))
+
 class QuanbenDownloader(BaseDownloader):
     @staticmethod
     def match(url):
         return 'quanben.io' in url
 
+    @staticmethod
+    def canonical_url(url):
+        m = re.search(r'/n/([^/?#]+)', url)
+        return f"quanben.io/n/{m.group(1)}" if m else BaseDownloader.canonical_url(url)
+
     def get_chapter_list(self):
         self.session.headers.update({'Referer': self.start_url})
-        response = self.session.get(self.start_url)
+        outcome, response = self.request(self.start_url)
+        if outcome != 'ok':
+            self.log("致命错误：无法访问目录页")
+            return []
+        self.set_encoding(response)
         html = response.text
         soup = BeautifulSoup(html, 'html.parser')
 
@@ -447,7 +1700,10 @@ class QuanbenDownloader(BaseDownloader):
                 
                 jsonp_url = f"https://www.quanben.io/index.php?c=book&a=list.jsonp&callback={callback}&book_id={book_id}&b={encoded_b}"
                 time.sleep(0.5)
-                jp_resp = self.session.get(jsonp_url)
+                outcome, jp_resp = self.request(jsonp_url)
+                if outcome != 'ok':
+                    raise ValueError(f"JSONP 请求失败 ({outcome})")
+                self.set_encoding(jp_resp)
                 
                 json_match = re.search(r'^\s*[\w]+\s*\((.*)\)\s*;?\s*$', jp_resp.text, re.DOTALL)
                 if json_match:
@@ -459,7 +1715,10 @@ class QuanbenDownloader(BaseDownloader):
                         if href and title:
                             full = urljoin(self.start_url, href)
                             chapters_raw[full] = {'title': title, 'url': full, 'book_name': book_title}
+                else:
+                    raise ValueError("JSONP 响应格式无法识别")
         except Exception as e:
+            self.toc_complete = False
             self.log(f"JSONP部分获取失败 (不影响查漏补缺): {e}")
 
         # 3. Gap Filling / ID Traversal
@@ -522,69 +1781,22 @@ class QuanbenDownloader(BaseDownloader):
             if current_url in visited: break
             visited.add(current_url)
 
-            # Smart Retry with Exponential Backoff
-            max_retries = 5
-            for attempt in range(max_retries):
-                try:
-                    resp = self.session.get(current_url, timeout=15)
-                    
-                    # 404 is normal for gaps, don't retry, just return empty
-                    if resp.status_code == 404:
-                        return "404" 
-                    
-                    # Blocked/Rate Limited?
-                    if resp.status_code in [403, 429, 500, 502, 503]:
-                        wait_time = (attempt + 1) * 5 # 5s, 10s, 15s...
-                        self.log(f"服务器繁忙 ({resp.status_code})，等待 {wait_time}秒后重试...")
-                        time.sleep(wait_time)
-                        continue
-
-                    if resp.status_code == 200:
-                        # Success? Let's check invalid content
-                        soup = BeautifulSoup(resp.text, 'html.parser')
-                        content_div = soup.find('div', id='content')
-                        
-                        if not content_div:
-                            # Maybe generic?
-                            if len(resp.text) < 500: # Suspiciously short page
-                                self.log(f"内容疑似无效，重试中... ({attempt+1}/{max_retries})")
-                                time.sleep(2)
-                                continue
-                            else:
-                                # Generic parsing logic could go here, but for Quanben specific:
-                                pass
-                        break # Valid 200 OK
-                except Exception as e:
-                    wait_time = (attempt + 1) * 3
-                    self.log(f"网络波动 ({e})，{wait_time}秒后重试...")
-                    time.sleep(wait_time)
+            outcome, resp = self.request(current_url, validate=quanben_page_check, cutoff=QUANBEN_CUTOFF)
             
-            else: # Loop finished without break = Failed all retries
+            # 404 is normal for gaps, don't retry, just return empty
+            if outcome == 'not_found':
+                return "404"
+            if outcome != 'ok':
                 self.log(f"放弃章节: {current_url} (多次重试失败)")
                 return "" # Real Fail
 
-            # ... (Parsing logic remains similar)
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            
-            if current_url == url:
-                h1 = soup.find('h1')
-                if h1: self.current_chapter_real_title = h1.get_text(strip=True)
-
-            content_div = soup.find('div', id='content')
-            if content_div:
-                for s in content_div(['script', 'style']):
-                    s.decompose()
-                text_buffer += content_div.get_text("\n", strip=True) + "\n"
+            title, text, has_next, href = self.parse_page(parse_quanben_page, resp)
+            if current_url == url and title:
+                self.current_chapter_real_title = title
+            text_buffer += text
             
             # Pagination Logic
-            next_page = None
-            for a in soup.find_all('a'):
-                if "下一页" in a.get_text():
-                    next_page = a
-                    break
-            
-            if next_page:
-                href = next_page.get('href')
+            if has_next:
                 if href and href != 'javascript:void(0)':
                     full_next = urljoin(current_url, href)
                     if base_id and f"{base_id}_" in full_next:
@@ -605,8 +1817,11 @@ class GenericDownloader(BaseDownloader):
         return True 
 
     def get_chapter_list(self):
-        resp = self.session.get(self.start_url)
-        resp.encoding = resp.apparent_encoding
+        outcome, resp = self.request(self.start_url)
+        if outcome != 'ok':
+            self.log("致命错误：无法访问目录页")
+            return []
+        self.set_encoding(resp)
         soup = BeautifulSoup(resp.text, 'html.parser')
         
         book_title = "Unknown_Book"
@@ -639,72 +1854,716 @@ class GenericDownloader(BaseDownloader):
 
     def get_chapter_content(self, url):
         try:
-            resp = self.session.get(url, timeout=10)
-            resp.encoding = resp.apparent_encoding
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            
-            if url == self.start_url: # Update title check
-                 if soup.title: self.current_chapter_real_title = soup.title.get_text(strip=True)
-
-            divs = soup.find_all('div')
-            best_div = None
-            max_len = 0
-            
-            for d in divs:
-                txt = d.get_text(strip=True)
-                if len(txt) > max_len:
-                    if d.find('script') or d.find('style'):
-                         continue
-                    max_len = len(txt)
-                    best_div = d
+            outcome, resp = self.request(url, timeout=10)
+            if outcome == 'not_found':
+                return "404"
+            if outcome != 'ok':
+                return ""
+            title, text = self.parse_page(parse_generic_page, resp)
             
-            if best_div:
-                return best_div.get_text("\n\n", strip=True)
-            return ""
+            if url == self.start_url and title: # Update title check
+                 self.current_chapter_real_title = title
+            return text
         except:
             return ""
 
+MIRROR_TRUNCATED_RATIO = 0.3 # Chapter shorter than this share of the recent median is suspect
+MIRROR_MIN_OVERLAP = 0.5 # Share of the shorter TOC's chapter keys a mirror must have in common with the start URL's
+
+class MirrorDownloader(BaseDownloader):
+    """One book from several sources.
+
+    The TOCs of all sources are fetched and aligned by chapter number (or
+    normalized title) onto the longest one; a mirror whose title or chapters
+    do not match the start URL's book is dropped. Every chapter is fetched from a
+    source picked by measured speed, and a failed, 404 or truncated chapter is
+    refetched from the next mirror.
+    """
+    use_toc_cache = False # Cached TOCs are single-source
+
+    def __init__(self, start_url, task_id, mirror_urls=()):
+        super().__init__(start_url, task_id)
+        urls = [start_url]
+        for u in mirror_urls:
+            if u and u not in urls:
+                urls.append(u)
+        self.sources = [self.new_source(u) for u in urls]
+        self.lengths = deque(maxlen=50) # Recent good chapter lengths
+
+    def new_source(self, url):
+        downloader = pick_downloader_class(url)(url, self.task_id)
+        downloader.hedge_stats = self.hedge_stats
+        downloader.retry_policy = self.retry_policy # One retry budget for the whole task, not one per mirror
+        return {'url': url, 'downloader': downloader, 'latency': None, 'ok': 0, 'fail': 0, 'streak': 0}
+
+    def set_transport(self, name):
+        super().set_transport(name)
+        for src in self.sources:
+            src['downloader'].set_transport(name)
+
+    def warm_up(self):
+        for src in self.sources:
+            src['downloader'].warm_up()
+
+    @staticmethod
+    def match(url):
+        return False
+
+    def get_chapter_list(self):
+        def fetch(source):
+            source['downloader'].trace = self.trace
+            try:
+                return get_cached_toc(source['url']) or source['downloader'].get_chapter_list()
+            except Exception as e:
+                self.log(f"镜像目录获取失败 {source['url']}: {e}")
+                return []
+        with ThreadPoolExecutor(max_workers=len(self.sources)) as pool:
+            lists = list(pool.map(fetch, self.sources))
+
+        live = sorted([(s, chs) for s, chs in zip(self.sources, lists) if chs], key=lambda x: len(x[1]), reverse=True)
+        for s, chs in zip(self.sources, lists):
+            if not chs:
+                self.log(f"镜像不可用，已移除: {s['url']}")
+        if not live:
+            self.sources = []
+            return []
+
+        # A mirror that is another book (same-name search hit, wrong ID) would
+        # mix its chapters in: keep a source only if its title matches the
+        # start URL's book and enough of its chapters line up with it.
+        ref = lists[0] or live[0][1]
+        ref_name = normalize_book_title(ref[0].get('book_name'))
+        ref_keys = set(chapter_keys(ref)) - {None}
+        kept = []
+        for s, chs in live:
+            if chs is not ref:
+                name = normalize_book_title(chs[0].get('book_name'))
+                keys = set(chapter_keys(chs)) - {None}
+                overlap = len(keys & ref_keys) / max(min(len(keys), len(ref_keys)), 1)
+                if (name and ref_name and name != ref_name) or overlap < MIRROR_MIN_OVERLAP:
+                    self.log(f"镜像不是同一本书，已移除: {s['url']} ({name or '?'}, 重合 {overlap:.0%})")
+                    continue
+            kept.append((s, chs))
+        live = kept
+        self.sources = [s for s, _ in live]
+
+        # Backbone is the longest list; other sources contribute alternates
+        by_key = []
+        for idx, (_, chs) in enumerate(live[1:], start=1):
+            keyed = {k: c['url'] for c, k in zip(chs, chapter_keys(chs)) if k is not None}
+            by_key.append((idx, keyed))
+
+        chapters = []
+        aligned = 0
+        backbone = live[0][1]
+        for c, k in zip(backbone, chapter_keys(backbone)):
+            alts = [(0, c['url'])]
+            if k is not None:
+                alts.extend((idx, keyed[k]) for idx, keyed in by_key if k in keyed)
+            aligned += len(alts) > 1
+            chapters.append({'title': c['title'], 'url': c['url'], 'book_name': c.get('book_name'), 'sources': alts})
+        self.log(f"已对齐 {len(self.sources)} 个来源，{aligned}/{len(chapters)} 章有备用镜像")
+        self.publish_sources()
+        return chapters
+
+    def rank_sources(self, alts):
+        """Order a chapter's (source, url) pairs: first pick is weighted by speed, rest fastest first"""
+        def speed(idx):
+            src = self.sources[idx]
+            if src['latency'] is None:
+                return 10.0 # Unmeasured: try it so it gets measured
+            return 1.0 / (max(src['latency'], 0.05) * (1 + src['streak']))
+        weights = [speed(idx) for idx, _ in alts]
+        first = random.choices(range(len(alts)), weights=weights)[0]
+        rest = sorted((a for i, a in enumerate(alts) if i != first), key=lambda a: -speed(a[0]))
+        return [alts[first]] + rest
+
+    def record(self, src, elapsed, ok):
+        if ok:
+            src['ok'] += 1
+            src['streak'] = 0
+            src['latency'] = elapsed if src['latency'] is None else 0.7 * src['latency'] + 0.3 * elapsed
+        else:
+            src['fail'] += 1
+            src['streak'] += 1
+
+    def is_truncated(self, content):
+        if len(self.lengths) < 5:
+            return False
+        median = sorted(self.lengths)[len(self.lengths) // 2]
+        return len(content) < median * MIRROR_TRUNCATED_RATIO
+
+    def fetch_chapter(self, chapter):
+        alts = chapter.get('sources') or [(0, chapter['url'])]
+        best, best_title = "", None
+        all_404 = True
+        for n, (idx, url) in enumerate(self.rank_sources(alts)):
+            src = self.sources[idx]
+            if n > 0:
+                self.log(f"切换镜像重试: {chapter['title']} -> {urlparse(url).netloc}")
+            d = src['downloader']
+            d.hedge = self.hedge
+            d.trace = self.trace
+            d.current_chapter_real_title = None
+            start = time.time()
+            try:
+                content = d.get_chapter_content(url)
+            except Exception:
+                content = ""
+            ok = bool(content.strip()) and content != "404"
+            all_404 = all_404 and content == "404"
+            self.record(src, time.time() - start, ok)
+            if not ok:
+                continue
+            if len(content) > len(best):
+                best, best_title = content, d.current_chapter_real_title
+            if not self.is_truncated(content):
+                break
+            self.log(f"章节疑似不完整 ({len(content)} 字)，尝试其他镜像: {chapter['title']}")
+        self.publish_sources()
+        if not best:
+            return "404" if all_404 else ""
+        self.lengths.append(len(best))
+        self.current_chapter_real_title = best_title
+        return best
+
+    def get_chapter_content(self, url):
+        for src in self.sources:
+            if urlparse(src['url']).netloc == urlparse(url).netloc:
+                return src['downloader'].get_chapter_content(url)
+        return self.sources[0]['downloader'].get_chapter_content(url) if self.sources else ""
+
+    def publish_sources(self):
+        if self.task_id in tasks:
+            tasks[self.task_id]['sources'] = [{
+                'url': s['url'],
+                'ok': s['ok'],
+                'fail': s['fail'],
+                'latency': round(s['latency'], 3) if s['latency'] is not None else None
+            } for s in self.sources]
+
+DOWNLOADER_CLASSES = [QuanbenDownloader, CheyilDownloader]
+
+def pick_downloader_class(url):
+    for cls in DOWNLOADER_CLASSES:
+        if cls.match(url):
+            return cls
+    return GenericDownloader
+
+# --- Book Identity ---
+# One book reached through other URLs (list.html or the book dir, m./www.
+# hosts) or through a mirror site is still one book. /api/start attaches to a
+# running task with the same canonical URL. Once a TOC is in, tasks with the
+# same fingerprint copy each other's chapter files instead of fetching them,
+# and identical chapter fetches in flight at the same time go out only once.
+BOOK_FINGERPRINT_CHAPTERS = 20
+BOOK_FINGERPRINT_MIN = 5 # Fewer numbered chapters than this: no fingerprint, no sharing
+books = {} # fingerprint -> [downloader], finished tasks included
+books_lock = threading.Lock()
+inflight = {} # chapter url -> Flight
+inflight_lock = threading.Lock()
+
+def book_key(url):
+    return pick_downloader_class(url).canonical_url(url)
+
+def toc_fingerprint(chapters):
+    """Book title plus number and title of the first numbered chapters, None if too few"""
+    marks = []
+    for c in chapters:
+        num = None if c.get('probe') else chapter_number(c['title'])
+        if num is None:
+            continue
+        rest = re.sub(r'第\s*[0-9零〇一二两三四五六七八九十百千万]+\s*[章节回]', '', c['title'])
+        rest = re.sub(r'[^\w\u4e00-\u9fa5]', '', rest).lower()
+        marks.append(f"{num}:{rest}")
+        if len(marks) >= BOOK_FINGERPRINT_CHAPTERS:
+            break
+    if len(marks) < BOOK_FINGERPRINT_MIN:
+        return None
+    title = normalize_book_title(chapters[0].get('book_name', ''))
+    return hashlib.sha1('|'.join([title] + marks).encode('utf-8')).hexdigest()[:16]
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+def singleflight(key, fn, failed=("", None)):
+    """fn() once for all callers asking for `key` at the same time: (result, shared)"""
+    with inflight_lock:
+        flight = inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = inflight[key] = Flight()
+    if not leader:
+        flight.done.wait()
+        return (flight.result if flight.result is not None else failed), True
+    try:
+        flight.result = fn()
+    finally:
+        with inflight_lock:
+            del inflight[key]
+        flight.done.set()
+    return flight.result, False
+
+# --- TOC Cache ---
+# Chapter lists fetched while validating search results, so a later /api/start
+# on the same URL can skip the TOC fetch.
+TOC_CACHE_TTL = 600
+toc_cache = {} # url -> (fetched_at, chapters)
+toc_cache_lock = threading.Lock()
+
+def get_cached_toc(url):
+    with toc_cache_lock:
+        entry = toc_cache.get(url)
+        if not entry:
+            return None
+        if time.time() - entry[0] > TOC_CACHE_TTL:
+            del toc_cache[url]
+            return None
+        return [dict(c) for c in entry[1]]
+
+def put_cached_toc(url, chapters):
+    with toc_cache_lock:
+        toc_cache[url] = (time.time(), [dict(c) for c in chapters])
+
+# --- Local Library Index ---
+# Full-text index over the finished TXT files in DOWNLOAD_FOLDER. SQLite FTS5's
+# unicode61 tokenizer has no idea about Chinese word boundaries, so text is
+# indexed as overlapping CJK bigrams and queries become bigram phrases.
+LIBRARY_DB = os.path.join(DOWNLOAD_FOLDER, 'library.db')
+LIBRARY_INDEX = os.environ.get('LIBRARY_INDEX', '1') != '0' # 0: no index, local search finds nothing
+PASSAGE_CHARS = 800
+
+def cjk_bigrams(text):
+    tokens = []
+    for m in re.finditer(r'([\u3400-\u9fff]+)|([0-9A-Za-z]+)', text):
+        run = m.group(0)
+        if m.group(1) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+def fts_query(text):
+    """Turn user input into an FTS5 query: every CJK run is a bigram phrase"""
+    parts = []
+    for m in re.finditer(r'([\u3400-\u9fff]+)|([0-9A-Za-z]+)', text):
+        run = m.group(0)
+        if m.group(1) and len(run) > 1:
+            parts.append('"' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+        else:
+            parts.append('"' + run.lower() + '"*') # Prefix, a lone CJK char matches its bigrams
+    return ' '.join(parts)
+
+CHAPTER_SEPARATOR = re.compile(rb'^={10,}[ \t]*$', re.M)
+
+def scan_book(data):
+    """Find the chapters of an assembled TXT (bytes).
+
+    Returns (title, source, spans) where each span is the (start, end) byte
+    range of one chapter, from its title line to the end of its text.
+    """
+    title, source = None, None
+    bounds = []
+    pos = 0
+    for m in CHAPTER_SEPARATOR.finditer(data):
+        bounds.append((pos, m.start()))
+        pos = m.end()
+    bounds.append((pos, len(data)))
+
+    spans = []
+    for i, (start, end) in enumerate(bounds):
+        if i == 0 and data.startswith(b'Book: ', start):
+            # assemble_novel header: 'Book: X', 'Source: url', blank line
+            header_end = data.find(b'\n\n', start, end)
+            header_end = end if header_end < 0 else header_end
+            for line in data[start:header_end].decode('utf-8', errors='replace').split('\n'):
+                if line.startswith('Book: '):
+                    title = line[len('Book: '):].strip()
+                elif line.startswith('Source: '):
+                    source = line[len('Source: '):].strip()
+            start = header_end
+        while start < end and data[start] in b'\r\n':
+            start += 1
+        while end > start and data[end - 1] in b'\r\n ':
+            end -= 1
+        if start >= end:
+            continue
+        nl = data.find(b'\n', start, end)
+        if nl < 0 or not data[nl:end].strip():
+            if i == 0 and not title:
+                title = data[start:end].decode('utf-8', errors='replace').strip() # Older scripts only write the book name on top
+            continue
+        spans.append((start, end))
+    return title, source, spans
+
+def split_chapter(raw):
+    """Chapter bytes -> (title, body)"""
+    title, _, body = raw.decode('utf-8', errors='replace').partition('\n')
+    return title.strip(), body.strip('\r\n')
+
+def parse_book_file(data):
+    """Split an assembled TXT (bytes) into (title, source, [(chapter_title, body), ...])"""
+    title, source, spans = scan_book(data)
+    return title, source, [split_chapter(data[s:e]) for s, e in spans]
+
+def local_snippet(text, query, width=40):
+    pos = text.find(query)
+    if pos < 0:
+        pos = 0
+    start = max(0, pos - width)
+    return re.sub(r'\s+', ' ', text[start:pos + len(query) + width]).strip()
+
+class LibraryIndex:
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS books (
+                    id INTEGER PRIMARY KEY, filename TEXT UNIQUE, title TEXT, source TEXT,
+                    mtime REAL, size INTEGER, chapters INTEGER);
+                CREATE TABLE IF NOT EXISTS passages (
+                    id INTEGER PRIMARY KEY, book_id INTEGER, chapter INTEGER, chapter_title TEXT, text TEXT);
+                CREATE INDEX IF NOT EXISTS passages_book ON passages(book_id);
+                CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(title, tokenize='unicode61');
+                CREATE VIRTUAL TABLE IF NOT EXISTS passages_fts USING fts5(body, tokenize='unicode61');
+            """)
+
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db: # Commit on success, roll back on error
+                yield db
+        finally:
+            db.close()
+
+    def add_book(self, path):
+        """(Re)index one TXT file; replaces any previous version of it"""
+        filename = os.path.basename(path)
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            title, source, chapters = parse_book_file(f.read())
+        title = title or os.path.splitext(filename)[0]
+
+        with self.connect() as db:
+            self._delete(db, filename)
+            cur = db.execute(
+                "INSERT INTO books (filename, title, source, mtime, size, chapters) VALUES (?, ?, ?, ?, ?, ?)",
+                (filename, title, source, stat.st_mtime, stat.st_size, len(chapters)))
+            book_id = cur.lastrowid
+            db.execute("INSERT INTO books_fts (rowid, title) VALUES (?, ?)", (book_id, ' '.join(cjk_bigrams(title))))
+            for idx, (chapter_title, body) in enumerate(chapters):
+                for start in range(0, len(body), PASSAGE_CHARS):
+                    chunk = body[start:start + PASSAGE_CHARS]
+                    cur = db.execute(
+                        "INSERT INTO passages (book_id, chapter, chapter_title, text) VALUES (?, ?, ?, ?)",
+                        (book_id, idx, chapter_title, chunk))
+                    db.execute("INSERT INTO passages_fts (rowid, body) VALUES (?, ?)",
+                               (cur.lastrowid, ' '.join(cjk_bigrams(chapter_title + ' ' + chunk))))
+
+    def _delete(self, db, filename):
+        row = db.execute("SELECT id FROM books WHERE filename = ?", (filename,)).fetchone()
+        if not row:
+            return
+        db.execute("DELETE FROM passages_fts WHERE rowid IN (SELECT id FROM passages WHERE book_id = ?)", (row[0],))
+        db.execute("DELETE FROM passages WHERE book_id = ?", (row[0],))
+        db.execute("DELETE FROM books_fts WHERE rowid = ?", (row[0],))
+        db.execute("DELETE FROM books WHERE id = ?", (row[0],))
+
+    def sync(self, folder):
+        """Index new or changed TXT files, drop entries whose file is gone"""
+        with self.connect() as db:
+            known = {r[0]: (r[1], r[2]) for r in db.execute("SELECT filename, mtime, size FROM books")}
+        present = set()
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if not name.endswith('.txt') or not os.path.isfile(path):
+                continue
+            present.add(name)
+            stat = os.stat(path)
+            if known.get(name) != (stat.st_mtime, stat.st_size):
+                self.add_book(path)
+        with self.connect() as db:
+            for name in set(known) - present:
+                self._delete(db, name)
+
+    def search(self, query, limit=10):
+        """Title hits first, then books with matching passages; one entry per book"""
+        match = fts_query(query)
+        if not match:
+            return []
+        hits = {}
+        with self.connect() as db:
+            for book_id, filename, title, source, chapters in db.execute(
+                    "SELECT b.id, b.filename, b.title, b.source, b.chapters FROM books_fts f "
+                    "JOIN books b ON b.id = f.rowid WHERE books_fts MATCH ? ORDER BY rank LIMIT ?",
+                    (match, limit)):
+                hits[book_id] = {'filename': filename, 'title': title, 'source': source, 'chapters': chapters,
+                                 'match': 'title', 'chapter_title': None, 'snippet': ''}
+            for book_id, filename, title, source, chapters, chapter_title, text in db.execute(
+                    "SELECT b.id, b.filename, b.title, b.source, b.chapters, p.chapter_title, p.text "
+                    "FROM passages_fts f JOIN passages p ON p.id = f.rowid JOIN books b ON b.id = p.book_id "
+                    "WHERE passages_fts MATCH ? ORDER BY rank LIMIT ?",
+                    (match, limit * 5)):
+                hit = hits.get(book_id)
+                if hit is None:
+                    if len(hits) >= limit:
+                        continue
+                    hit = hits[book_id] = {'filename': filename, 'title': title, 'source': source,
+                                           'chapters': chapters, 'match': 'passage', 'chapter_title': None, 'snippet': ''}
+                if not hit['snippet']:
+                    hit['chapter_title'] = chapter_title
+                    hit['snippet'] = local_snippet(text, query.strip())
+        return list(hits.values())
+
+# Opened on first use, not at import: benches, harnesses and parse workers that
+# import app never touch SQLite or walk DOWNLOAD_FOLDER
+library_index = None
+library_lock = threading.Lock()
+# Single writer thread: indexing never blocks a download and SQLite sees one writer
+library_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='library')
+
+def get_library_index():
+    """The library index, None when LIBRARY_INDEX is off; the first call opens it and starts a sync"""
+    global library_index
+    if not LIBRARY_INDEX:
+        return None
+    with library_lock:
+        if library_index is None:
+            os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+            library_index = LibraryIndex(LIBRARY_DB)
+            library_executor.submit(library_index.sync, DOWNLOAD_FOLDER)
+    return library_index
+
+def index_book_async(path):
+    index = get_library_index()
+    if not index:
+        return
+    def job():
+        try:
+            index.add_book(path)
+        except Exception as e:
+            print(f"> 本地书库索引失败 {path}: {e}")
+    library_executor.submit(job)
+
+# --- Chapter Reader ---
+# Every assembled TXT gets a '<name>.txt.idx' sidecar: a small header followed by
+# one fixed-size (start, end) record per chapter. Serving chapter N is one seek
+# into the index plus one slice of an mmap of the book, whatever its size.
+CHAPTER_INDEX_MAGIC = b'CIDX'
+CHAPTER_INDEX_HEADER = struct.Struct('<4sI')
+CHAPTER_INDEX_ENTRY = struct.Struct('<QQ')
+READ_WINDOW_MAX = 1024 * 1024
+READ_WAIT_MAX = 30
+
+def chapter_index_path(book_path):
+    return book_path + '.idx'
+
+def write_chapter_index(book_path, spans):
+    tmp = chapter_index_path(book_path) + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(CHAPTER_INDEX_HEADER.pack(CHAPTER_INDEX_MAGIC, len(spans)))
+        for start, end in spans:
+            f.write(CHAPTER_INDEX_ENTRY.pack(start, end))
+    os.replace(tmp, chapter_index_path(book_path))
+
+def ensure_chapter_index(book_path):
+    """Build the sidecar for books that don't have an up to date one (older downloads)"""
+    idx_path = chapter_index_path(book_path)
+    if os.path.exists(idx_path) and os.path.getmtime(idx_path) >= os.path.getmtime(book_path):
+        return idx_path
+    with open(book_path, 'rb') as f:
+        _, _, spans = scan_book(f.read())
+    write_chapter_index(book_path, spans)
+    return idx_path
+
+def read_chapter_span(idx_path, n):
+    """(start, end, total) of chapter n, or (None, None, total) if out of range"""
+    with open(idx_path, 'rb') as f:
+        magic, total = CHAPTER_INDEX_HEADER.unpack(f.read(CHAPTER_INDEX_HEADER.size))
+        if magic != CHAPTER_INDEX_MAGIC:
+            raise ValueError("bad chapter index")
+        if n < 0 or n >= total:
+            return None, None, total
+        f.seek(CHAPTER_INDEX_HEADER.size + n * CHAPTER_INDEX_ENTRY.size)
+        start, end = CHAPTER_INDEX_ENTRY.unpack(f.read(CHAPTER_INDEX_ENTRY.size))
+        return start, end, total
+
+def read_book_bytes(book_path, start, end):
+    """Slice a byte range out of an mmap of the book"""
+    with open(book_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[start:end]
+
+# --- Batch Downloads ---
+# A batch is many books queued at once (an overnight list of 100+ URLs). Its
+# tasks wait as 'queued' and are started by one process-wide scheduler: at
+# most BATCH_MAX_RUNNING books download at a time and at most
+# BATCH_PER_DOMAIN per site, with the sites taking turns so a long list from
+# one site can't starve the others.
+BATCH_MAX_BOOKS = 500
+BATCH_MAX_RUNNING = 8
+BATCH_PER_DOMAIN = 2
+batches = {} # batch_id -> {'task_ids': [...], 'created': ts}
+
+class BookScheduler:
+    """Per-domain fair queue of download tasks"""
+    def __init__(self, max_running=BATCH_MAX_RUNNING, per_domain=BATCH_PER_DOMAIN):
+        self.max_running = max_running
+        self.per_domain = per_domain
+        self.queues = {} # domain -> deque of task ids
+        self.turns = deque() # Domains with queued tasks, in round-robin order
+        self.running = {} # domain -> tasks running
+        self.lock = threading.Lock()
+
+    def submit(self, task_id):
+        domain = re.sub(r'^(www|m|wap)\.', '', downloaders[task_id].domain.lower())
+        with self.lock:
+            if domain not in self.queues:
+                self.queues[domain] = deque()
+                self.turns.append(domain)
+            self.queues[domain].append(task_id)
+        self.pump()
+
+    def pump(self):
+        """Start queued tasks while there are free slots, one domain per turn"""
+        started = []
+        with self.lock:
+            skipped = 0
+            while self.turns and skipped < len(self.turns) and sum(self.running.values()) < self.max_running:
+                domain = self.turns[0]
+                self.turns.rotate(-1)
+                if self.running.get(domain, 0) >= self.per_domain:
+                    skipped += 1
+                    continue
+                skipped = 0
+                task_id = self.queues[domain].popleft()
+                if not self.queues[domain]:
+                    del self.queues[domain]
+                    self.turns.remove(domain)
+                self.running[domain] = self.running.get(domain, 0) + 1
+                started.append((domain, task_id))
+        for domain, task_id in started:
+            tasks[task_id]['status'] = 'running'
+            thread = threading.Thread(target=self.work, args=(domain, task_id))
+            thread.daemon = True
+            thread.start()
+
+    def work(self, domain, task_id):
+        try:
+            downloaders[task_id].run()
+        finally:
+            with self.lock:
+                self.running[domain] -= 1
+            self.pump()
+
+    def snapshot(self):
+        with self.lock:
+            return {'running': {d: n for d, n in self.running.items() if n},
+                    'queued': {d: len(q) for d, q in self.queues.items()}}
+
+book_scheduler = BookScheduler()
+
+# Search engine click-through links are no book page: never a mirror
+ENGINE_REDIRECT_RE = re.compile(r'^https?://(?:[\w-]+\.)*(?:sogou\.com/link\?|baidu\.com/link\?|bing\.com/ck/)')
+
+def mirror_urls(url, mirrors):
+    """Usable mirrors of url: absolute http(s), not url itself, no engine redirects, no repeats"""
+    out = []
+    for m in mirrors:
+        if isinstance(m, str) and m.startswith('http') and m != url and m not in out and not ENGINE_REDIRECT_RE.match(m):
+            out.append(m)
+    return out
+
+def batch_items(data):
+    """(url, mirrors) pairs from {"urls": [...]} or {"books": [search results]}"""
+    items = []
+    for entry in (data.get('urls') or []) + (data.get('books') or []):
+        if isinstance(entry, str):
+            url, mirrors = entry, []
+        elif isinstance(entry, dict):
+            url = entry.get('url')
+            mirrors = [m.get('url') if isinstance(m, dict) else m for m in (entry.get('mirrors') or [])]
+        else:
+            continue
+        if not isinstance(url, str) or not url.startswith('http'):
+            continue
+        items.append((url, mirror_urls(url, mirrors)))
+    return items
+
+def batch_progress(batch_id):
+    """Aggregate status of a batch and a short line per book"""
+    batch = batches[batch_id]
+    books, counts = [], {}
+    chapters_total = chapters_done = 0
+    for tid in batch['task_ids']:
+        t = tasks.get(tid, {})
+        status = t.get('status', 'unknown')
+        counts[status] = counts.get(status, 0) + 1
+        chapters_total += t.get('total', 0)
+        chapters_done += t.get('success', 0)
+        books.append({'task_id': tid, 'url': t.get('url'), 'status': status, 'percent': t.get('percent', 0),
+                      'success': t.get('success', 0), 'fail': t.get('fail', 0), 'filename': t.get('filename')})
+    finished = counts.get('done', 0) + counts.get('error', 0)
+    return {
+        'batch_id': batch_id,
+        'status': 'done' if finished == len(books) else 'running',
+        'books': len(books),
+        'counts': counts,
+        'chapters': {'done': chapters_done, 'total': chapters_total},
+        'percent': int(sum(b['percent'] for b in books) / len(books)) if books else 100,
+        'tasks': books
+    }
+
 # --- Routes ---
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/api/start', methods=['POST'])
-def start_download():
-    data = request.json
-    url = data.get('url')
-    if not url:
-        return jsonify({'error': 'URL is required'}), 400
-
-    # 2. Concurrency Control & Rejoin Logic
+def create_task(url, mirrors, options, status='running', task_id=None):
+    """Register a download task: (task_id, downloader). The downloader is None when a
+    task for the same book is already running and was rejoined; nothing is started.
+    """
+    # 2. Concurrency Control & Rejoin Logic, by book: other URL forms of a running book rejoin it
+    key = book_key(url)
     with active_urls_lock:
-        if url in active_urls:
-            # Try to find the existing running task for this URL
+        if key in active_urls:
+            # Try to find the existing running task for this book
             for tid, tdata in tasks.items():
-                if tdata.get('url') == url and tdata['status'] in ['running', 'paused']:
-                    return jsonify({'task_id': tid, 'message': 'Rejoined existing task'})
+                if tdata.get('book') == key and tdata['status'] in ['running', 'paused', 'queued']:
+                    return tid, None
             
             # If we are here, maybe it's in active_urls but not in running tasks (zombie?), clean it
-            active_urls.remove(url)
+            active_urls.remove(key)
 
-        active_urls.add(url)
+        active_urls.add(key)
 
-    task_id = str(uuid.uuid4())
+    task_id = task_id or str(uuid.uuid4())
     
     # Select Downloader
-    if 'quanben.io' in url:
-        downloader = QuanbenDownloader(url, task_id)
-    elif 'cheyil.cc' in url:
-        downloader = CheyilDownloader(url, task_id)
+    if mirrors:
+        downloader = MirrorDownloader(url, task_id, mirrors)
     else:
-        downloader = GenericDownloader(url, task_id)
+        downloader = pick_downloader_class(url)(url, task_id)
+    if 'hedge' in options:
+        downloader.hedge = bool(options['hedge'])
+    if options.get('transport') in ('requests', 'httpx'):
+        downloader.set_transport(options['transport'])
+    if options.get('trace', TRACE_DOWNLOADS):
+        downloader.trace = DownloadTrace()
 
     downloaders[task_id] = downloader   
     
     tasks[task_id] = {
         'url': url,
-        'status': 'running',
+        'book': key,
+        'status': status,
         'control': 'running',
         'percent': 0,
         'current': 0,
@@ -712,8 +2571,26 @@ def start_download():
         'success': 0,
         'fail': 0,
         'log': 'Task Initialized...',
-        'filename': None
+        'filename': None,
+        'mirrors': mirrors
     }
+    return task_id, downloader
+
+@app.route('/api/start', methods=['POST'])
+def start_download():
+    data = request.json
+    url = data.get('url')
+    # Several sources for one book: {"url": primary, "mirrors": [...]} or {"urls": [...]}
+    mirrors = data.get('mirrors') or []
+    if not url and data.get('urls'):
+        url, mirrors = data['urls'][0], data['urls'][1:]
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+    mirrors = mirror_urls(url, mirrors)
+
+    task_id, downloader = create_task(url, mirrors, data)
+    if downloader is None:
+        return jsonify({'task_id': task_id, 'message': 'Rejoined existing task'})
 
     thread = threading.Thread(target=downloader.run)
     thread.daemon = True
@@ -721,6 +2598,63 @@ def start_download():
 
     return jsonify({'task_id': task_id})
 
+@app.route('/api/batch', methods=['POST'])
+def start_batch():
+    """Queue many books: {"urls": [...]} and/or {"books": [search results]}, plus /api/start options"""
+    data = request.json or {}
+    items = batch_items(data)
+    if not items:
+        return jsonify({'error': 'No URLs'}), 400
+    if len(items) > BATCH_MAX_BOOKS:
+        return jsonify({'error': f'At most {BATCH_MAX_BOOKS} books per batch'}), 400
+
+    task_ids, rejoined = [], 0
+    for url, mirrors in items:
+        task_id, downloader = create_task(url, mirrors, data, status='queued')
+        if downloader is None:
+            rejoined += 1
+        else:
+            book_scheduler.submit(task_id)
+        if task_id not in task_ids:
+            task_ids.append(task_id)
+
+    batch_id = str(uuid.uuid4())
+    batches[batch_id] = {'task_ids': task_ids, 'created': time.time()}
+    return jsonify({'batch_id': batch_id, 'task_ids': task_ids, 'rejoined': rejoined})
+
+@app.route('/api/batch/<batch_id>')
+def get_batch(batch_id):
+    if batch_id not in batches:
+        return jsonify({'error': 'Batch not found'}), 404
+    progress = batch_progress(batch_id)
+    progress['scheduler'] = book_scheduler.snapshot()
+    return jsonify(progress)
+
+@app.route('/api/batch/<batch_id>/zip')
+def download_batch(batch_id):
+    """Zip of the batch's finished books; unfinished ones are left out"""
+    if batch_id not in batches:
+        return jsonify({'error': 'Batch not found'}), 404
+    out = tempfile.TemporaryFile()
+    names = set()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for tid in batches[batch_id]['task_ids']:
+            t = tasks.get(tid, {})
+            path = os.path.join(DOWNLOAD_FOLDER, t['filename']) if t.get('filename') else None
+            if t.get('status') != 'done' or not path or not os.path.exists(path):
+                continue
+            name, n = t['filename'], 1
+            while name in names: # Two books with the same title
+                n += 1
+                name = f"{os.path.splitext(t['filename'])[0]}_{n}.txt"
+            names.add(name)
+            zf.write(path, name)
+    if not names:
+        out.close()
+        return jsonify({'error': 'No finished books yet'}), 404
+    out.seek(0)
+    return send_file(out, as_attachment=True, download_name=f"batch_{batch_id[:8]}.zip", mimetype='application/zip')
+
 @app.route('/api/progress/<task_id>')
 def get_progress(task_id):
     task = tasks.get(task_id)
@@ -728,6 +2662,46 @@ def get_progress(task_id):
         return jsonify({'error': 'Task not found'}), 404
     return jsonify(task)
 
+@app.route('/api/trace/<task_id>')
+def export_trace(task_id):
+    """Stage timeline of a traced task: ?format=chrome (default) or jsonl"""
+    downloader = downloaders.get(task_id)
+    if not downloader:
+        return jsonify({'error': 'Task not found'}), 404
+    if downloader.trace is None:
+        return jsonify({'error': 'Task is not traced, start it with "trace": true'}), 404
+    if request.args.get('format') == 'jsonl':
+        return Response(downloader.trace.export_jsonl(), mimetype='application/x-ndjson')
+    return jsonify(downloader.trace.export_chrome())
+
+@app.route('/api/task/<task_id>/chapter/<int:n>')
+def read_task_chapter(task_id, n):
+    """Read chapter n (0-based) of a task that may still be downloading.
+
+    A chapter that isn't downloaded yet jumps the fetch queue; ?wait=<seconds>
+    (max READ_WAIT_MAX) holds the request until it arrives, otherwise the
+    answer is 202 and the client polls again.
+    """
+    downloader = downloaders.get(task_id)
+    if task_id not in tasks or not downloader:
+        return jsonify({'error': 'Task not found'}), 404
+    if not downloader.all_chapters:
+        return jsonify({'status': 'pending', 'message': '目录解析中'}), 202
+    total = len(downloader.all_chapters)
+    if n < 0 or n >= total:
+        return jsonify({'error': 'Chapter out of range', 'total': total}), 404
+    
+    wait = min(max(0, request.args.get('wait', 0, type=float)), READ_WAIT_MAX)
+    status, title, text = downloader.read_chapter(n, wait)
+    payload = {'chapter': n, 'total': total, 'status': status,
+               'title': title or downloader.all_chapters[n]['title']}
+    if status == 'ready':
+        payload['text'] = text
+        return jsonify(payload)
+    if status == 'pending':
+        return jsonify(payload), 202
+    return jsonify(payload), 404 if status == 'missing' else 502
+
 @app.route('/api/control/<action>', methods=['POST'])
 def control_task(action):
     data = request.json
@@ -753,6 +2727,42 @@ def download_file(filename):
         return send_file(path, as_attachment=True, mimetype='application/octet-stream')
     return "File not found", 404
 
+@app.route('/api/read/<filename>/chapter/<int:n>')
+def read_chapter(filename, n):
+    """Chapter n (0-based) of a downloaded book"""
+    path = os.path.join(DOWNLOAD_FOLDER, os.path.basename(filename))
+    if not os.path.exists(path):
+        return jsonify({'error': 'File not found'}), 404
+    start, end, total = read_chapter_span(ensure_chapter_index(path), n)
+    if start is None:
+        return jsonify({'error': 'Chapter out of range', 'total': total}), 404
+    title, body = split_chapter(read_book_bytes(path, start, end))
+    return jsonify({'chapter': n, 'total': total, 'title': title, 'text': body})
+
+@app.route('/api/read/<filename>')
+def read_window(filename):
+    """Raw byte window of a downloaded book: ?offset=&length= (snapped to UTF-8 boundaries)"""
+    path = os.path.join(DOWNLOAD_FOLDER, os.path.basename(filename))
+    if not os.path.exists(path):
+        return "File not found", 404
+    size = os.path.getsize(path)
+    offset = max(0, request.args.get('offset', 0, type=int))
+    length = min(max(0, request.args.get('length', 64 * 1024, type=int)), READ_WINDOW_MAX)
+    end = min(offset + length, size)
+    data = read_book_bytes(path, offset, min(end + 3, size))
+    # Don't start or stop in the middle of a multi-byte character
+    head = 0
+    while head < len(data) and head < 3 and 0x80 <= data[head] < 0xC0:
+        head += 1
+    cut = end - offset
+    while head < cut < len(data) and 0x80 <= data[cut] < 0xC0:
+        cut += 1
+    resp = Response(data[head:cut], mimetype='text/plain; charset=utf-8')
+    resp.headers['X-Offset'] = str(offset + head)
+    resp.headers['X-Next-Offset'] = str(offset + cut)
+    resp.headers['X-Total-Bytes'] = str(size)
+    return resp
+
 # --- Search Logic ---
 search_tasks = {}
 
@@ -764,9 +2774,253 @@ USER_AGENTS = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/118.0'
 ]
 
-class Searcher:
+# Hard time budgets (seconds). Each engine is abandoned once its own budget
+# runs out, and the whole search is marked done at SEARCH_DEADLINE.
+SEARCH_DEADLINE = 12
+ENGINE_BUDGETS = {
+    "百度": 10,       # Result links are resolved with HEAD requests, slowest engine
+    "搜狗": 6,
+    "Bing": 8,
+    "全本直连": 8,
+    "笔趣阁直连": 8
+}
+
+# Process-wide search pool. Every engine call of every search runs here, capped
+# per engine by ENGINE_CONCURRENCY, so thread count stays bounded no matter how
+# many users search at once. The pool is sized to the sum of the caps, so an
+# admitted engine call never queues behind another.
+ENGINE_CONCURRENCY = {
+    "百度": 4,
+    "搜狗": 4,
+    "Bing": 4,
+    "全本直连": 4,
+    "笔趣阁直连": 4
+}
+engine_slots = {name: threading.BoundedSemaphore(n) for name, n in ENGINE_CONCURRENCY.items()}
+SLOT_POLL_INTERVAL = 0.1 # How often a search waiting for a busy engine retries its slot
+search_executor = ThreadPoolExecutor(max_workers=sum(ENGINE_CONCURRENCY.values()), thread_name_prefix='search')
+
+# Circuit breaker: after ENGINE_FAILURE_THRESHOLD consecutive captcha/timeout/
+# error responses an engine is skipped for a cooldown that doubles on every
+# consecutive trip (capped), then one half-open probe decides whether it closes.
+ENGINE_FAILURE_THRESHOLD = 3
+ENGINE_BASE_COOLDOWN = 60
+ENGINE_MAX_COOLDOWN = 1800
+
+class EngineBlocked(Exception):
+    """Engine answered with a captcha / anti-spider page"""
+
+class EngineHealth:
+    """Health state and circuit breaker (closed -> open -> half_open) for one engine"""
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0 # Consecutive failures
+        self.trips = 0 # Consecutive opens, drives the exponential back-off
+        self.open_until = 0
+        self.probe_in_flight = False
+        self.last_error = None
+        self.last_change = time.time()
+        self.stats = {'success': 0, 'captcha': 0, 'timeout': 0, 'error': 0, 'skipped': 0}
+
+    def allow(self):
+        """True if a request may go out now; admits a single probe once the cooldown is over"""
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() >= self.open_until:
+                self._set_state('half_open')
+            if self.state == 'half_open' and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.stats['skipped'] += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.stats['success'] += 1
+            self.failures = 0
+            self.trips = 0
+            self.probe_in_flight = False
+            if self.state != 'closed':
+                self._set_state('closed')
+
+    def record_failure(self, kind, detail=''):
+        """kind is one of 'captcha', 'timeout', 'error'"""
+        with self.lock:
+            self.stats[kind] += 1
+            self.failures += 1
+            self.last_error = f"{kind}: {detail}"[:120]
+            self.probe_in_flight = False
+            if self.state == 'half_open' or self.failures >= ENGINE_FAILURE_THRESHOLD:
+                cooldown = min(ENGINE_BASE_COOLDOWN * (2 ** self.trips), ENGINE_MAX_COOLDOWN)
+                self.trips += 1
+                self.open_until = time.time() + cooldown
+                self._set_state('open')
+
+    def retry_in(self):
+        return max(0, int(self.open_until - time.time())) if self.state == 'open' else 0
+
+    def _set_state(self, state):
+        self.state = state
+        self.last_change = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'name': self.name,
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'trips': self.trips,
+                'retry_in': self.retry_in(),
+                'last_error': self.last_error,
+                'last_change': self.last_change,
+                'stats': dict(self.stats)
+            }
+
+engine_health = {name: EngineHealth(name) for name in ENGINE_CONCURRENCY}
+
+# Optional enrichment stage: after the engines are done, the top candidates'
+# TOCs are fetched with their real downloader to get true chapter counts.
+SEARCH_VALIDATE_TOP_K = 5
+VALIDATE_DEADLINE = 20
+validate_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='validate')
+
+def validate_candidate(url):
+    """Fetch a candidate's TOC with the downloader /api/start would use"""
+    downloader = pick_downloader_class(url)(url, None)
+    downloader.retry_policy = RetryPolicy(attempts=1)
+    chapters = downloader.get_chapter_list()
+    # A step that failed on its single attempt leaves a partial TOC: good
+    # enough for the chapter count shown, but /api/start must fetch its own
+    if chapters and downloader.toc_complete:
+        put_cached_toc(url, chapters)
+    return chapters
+
+class SearchResultSet:
+    """Incrementally ranked search results, one entry per book.
+
+    Results from different sources are grouped when their normalized titles
+    match and their authors agree (an unknown author matches anything). The
+    best-ranked item of a group is shown, the rest are kept as 'mirrors'.
+    Groups are kept in rank order with bisect, so adding a batch never
+    re-sorts the whole list.
+    """
     def __init__(self):
-        self.headers = self.get_random_headers()
+        self.seen_urls = set()
+        self.by_title = {} # title key -> [group, ...]
+        self.ranked = [] # groups, best first
+        self.keys = [] # rank keys parallel to self.ranked
+        self.seq = 0
+
+    @staticmethod
+    def rank(item):
+        # Books already in the local library come first, candidates whose TOC
+        # failed validation sink to the bottom
+        return (item.get('is_local', False), item.get('downloadable') is not False,
+                item.get('is_completed', False), item.get('count', 0) or 0)
+
+    def _key(self, group):
+        return tuple(-int(v) for v in self.rank(group['book'])) + (group['seq'],)
+
+    def _insert(self, group):
+        key = self._key(group)
+        pos = bisect.bisect(self.keys, key)
+        self.keys.insert(pos, key)
+        self.ranked.insert(pos, group)
+
+    def _remove(self, group):
+        pos = bisect.bisect_left(self.keys, self._key(group))
+        del self.keys[pos]
+        del self.ranked[pos]
+
+    def add(self, items):
+        """Merge a batch of results, returns how many were not seen before"""
+        added = 0
+        for item in items:
+            if item['url'] in self.seen_urls:
+                continue
+            self.seen_urls.add(item['url'])
+            added += 1
+
+            title_key = normalize_book_title(item.get('title', ''))
+            author_key = normalize_author(item.get('author'))
+            group = None
+            if title_key and not item.get('is_captcha'):
+                for g in self.by_title.get(title_key, []):
+                    if not author_key or not g['author_key'] or g['author_key'] == author_key:
+                        group = g
+                        break
+
+            if group is None:
+                group = {'book': item, 'mirrors': [], 'author_key': author_key, 'seq': self.seq}
+                self.seq += 1
+                if title_key and not item.get('is_captcha'):
+                    self.by_title.setdefault(title_key, []).append(group)
+                self._insert(group)
+                continue
+
+            # Re-rank the group: the better candidate becomes the shown book
+            self._remove(group)
+            if self.rank(item) > self.rank(group['book']):
+                group['mirrors'].append(group['book'])
+                group['book'] = item
+            else:
+                group['mirrors'].append(item)
+            if author_key and not group['author_key']:
+                group['author_key'] = author_key
+            self._insert(group)
+        return added
+
+    def top(self, k):
+        """Best k shown books that are worth validating"""
+        return [g['book'] for g in self.ranked if not g['book'].get('is_captcha') and not g['book'].get('is_local')][:k]
+
+    def update(self, book, fields):
+        """Update a shown book in place and move it to its new rank"""
+        for group in self.ranked:
+            if group['book'] is book:
+                self._remove(group)
+                book.update(fields)
+                self._insert(group)
+                return
+
+    def mirror_entry(self, item):
+        return {
+            'source': item.get('source'),
+            'url': item['url'],
+            'latest': item.get('latest'),
+            'count': item.get('count', 0)
+        }
+
+    def results(self):
+        """Snapshot for the progress payload"""
+        out = []
+        for group in self.ranked:
+            book = dict(group['book'])
+            if (book.get('author') or '') in UNKNOWN_AUTHORS:
+                for m in group['mirrors']:
+                    if (m.get('author') or '') not in UNKNOWN_AUTHORS:
+                        book['author'] = m['author']
+                        break
+            book['mirrors'] = [self.mirror_entry(m) for m in group['mirrors']]
+            out.append(book)
+        return out
+
+    def __len__(self):
+        return len(self.ranked)
+
+class SearchContext:
+    """Per-search request state, so concurrent searches never share headers"""
+    def __init__(self, task_id, keyword, headers):
+        self.task_id = task_id
+        self.keyword = keyword
+        self.headers = headers
+        self.start = time.time()
+
+class Searcher:
+    http = requests # Transport for engine queries: the requests module or a Session
 
     def get_random_headers(self):
         return {
@@ -780,83 +3034,198 @@ class Searcher:
         if task_id in search_tasks:
             search_tasks[task_id]['logs'].append(msg)
 
-    def search_all(self, task_id, keyword):
-        """Search ALL sources in parallel for maximum results"""
+    def search_all(self, task_id, keyword, validate_top_k=0):
+        """Search ALL sources in parallel, bounded by per-engine deadlines"""
         self.log(task_id, f"🔍 全网并行检索: {keyword}")
-        self.headers = self.get_random_headers()
+        ctx = SearchContext(task_id, keyword, self.get_random_headers())
+        
+        result_set = SearchResultSet()
         
-        all_results = []
-        seen_urls = set()
+        # Local library answers in milliseconds, publish it before any engine
+        try:
+            index = get_library_index()
+            local_hits = [self.local_result(hit) for hit in index.search(keyword)] if index else []
+        except Exception as e:
+            local_hits = []
+            self.log(task_id, f"❌ 本地书库查询失败: {e}")
+        if local_hits:
+            result_set.add(local_hits)
+            if task_id in search_tasks:
+                search_tasks[task_id]['results'] = result_set.results()
+            self.log(task_id, f"📚 本地书库: 命中 {len(local_hits)} 本")
         
-        # Define search functions to run in parallel
-        # Note: search_direct_sites itself is threaded, so we can treat it as one block or split it.
-        # Let's split them for granular control
-        tasks = [
-            ("百度", self.search_baidu_wrapper, (task_id, keyword)),
-            ("搜狗", self.search_sogou, (task_id, keyword)),
-            ("Bing", self.search_bing, (task_id, keyword)),
-            ("直连搜索", self.search_direct_sites, (task_id, keyword))
+        # Each direct site is its own engine so it gets its own budget
+        # (no nested thread pool that the outer search has to wait for).
+        engines = [
+            ("百度", self.search_baidu_wrapper, (ctx,)),
+            ("搜狗", self.search_sogou, (ctx,)),
+            ("Bing", self.search_bing, (ctx,)),
+            ("全本直连", self.search_direct_site, (ctx, self.search_quanben)),
+            ("笔趣阁直连", self.search_direct_site, (ctx, self.search_biquge))
         ]
         
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_source = {
-                executor.submit(func, *args): name 
-                for name, func, args in tasks
-            }
-            
-            completed_count = 0
-            # Set a global timeout for all searches (e.g. 15 seconds max)
-            try:
-                for future in as_completed(future_to_source, timeout=12):
-                    source = future_to_source[future]
-                    try:
-                        res = future.result(timeout=1) # Should be instant since as_completed yielded
+        start = ctx.start
+        future_to_source = {}
+        deadlines = {}
+        completed_count = 0
+        pending = set()
+        waiting = {} # Engines saturated by other searches: name -> (func, args, slot)
+
+        def launch(name, func, args, slot):
+            """Submit one engine call that already holds its slot; False if the breaker refused it"""
+            health = engine_health.get(name)
+            if health and not health.allow():
+                if slot: slot.release()
+                ENGINE_REQUESTS.inc(name, 'skipped_open')
+                self.log(task_id, f"⚠️ {name}: 熔断中，已跳过 ({health.retry_in()}秒后重试)")
+                return False
+            future = search_executor.submit(func, *args)
+            # Real engine latency, stragglers included
+            future.add_done_callback(lambda f, n=name, t0=time.time(): ENGINE_SECONDS.observe(time.time() - t0, n))
+            if slot:
+                # Abandoned stragglers keep their slot until they really finish
+                future.add_done_callback(lambda f, s=slot: s.release())
+            future_to_source[future] = name
+            deadlines[future] = start + budgets[name]
+            pending.add(future)
+            return True
+
+        budgets = {name: min(ENGINE_BUDGETS.get(name, SEARCH_DEADLINE), SEARCH_DEADLINE) for name, _, _ in engines}
+        for name, func, args in engines:
+            slot = engine_slots.get(name)
+            if slot and not slot.acquire(blocking=False):
+                waiting[name] = (func, args, slot)
+            elif not launch(name, func, args, slot):
+                completed_count += 1
+
+        # Never block on stragglers: abandoned engines finish in the background
+        # and their results are simply dropped. A saturated engine waits for a
+        # free slot for as long as its own budget allows, then is skipped.
+        while pending or waiting:
+            now = time.time()
+            for name in list(waiting):
+                func, args, slot = waiting[name]
+                if slot.acquire(blocking=False):
+                    del waiting[name]
+                    if not launch(name, func, args, slot):
                         completed_count += 1
-                        if res:
-                            new_items = []
-                            for item in res:
-                                if item['url'] not in seen_urls:
-                                    seen_urls.add(item['url'])
-                                    new_items.append(item)
-                            
-                            count = len(new_items)
-                            if count > 0:
-                                all_results.extend(new_items)
-                                all_results.sort(key=lambda x: (x.get('is_completed', False), x.get('count', 0)), reverse=True)
-                                
-                                # Use COPY to avoid serialization race conditions
-                                if task_id in search_tasks:
-                                    search_tasks[task_id]['results'] = list(all_results)
-
-                                self.log(task_id, f"✅ {source}: 贡献 {count} 个结果")
+                elif start + budgets[name] <= now:
+                    del waiting[name]
+                    completed_count += 1
+                    ENGINE_REQUESTS.inc(name, 'skipped_busy')
+                    self.log(task_id, f"⚠️ {name}: 并发已满，已跳过")
+            
+            expired = [f for f in pending if deadlines[f] <= now]
+            for future in expired:
+                pending.discard(future)
+                future.cancel()
+                completed_count += 1
+                source = future_to_source[future]
+                ENGINE_REQUESTS.inc(source, 'deadline')
+                if source in engine_health:
+                    engine_health[source].record_failure('timeout', 'deadline exceeded')
+                self.log(task_id, f"⚠️ {source}: 响应超时，已跳过")
+            
+            timeout = min([deadlines[f] for f in pending] + [start + budgets[n] for n in waiting], default=now) - now
+            if waiting:
+                timeout = min(timeout, SLOT_POLL_INTERVAL)
+            if pending:
+                done, _ = wait(pending, timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+            else:
+                done = set()
+                time.sleep(max(timeout, 0))
+            
+            for future in done:
+                pending.discard(future)
+                completed_count += 1
+                source = future_to_source[future]
+                health = engine_health.get(source)
+                try:
+                    res = future.result()
+                    captcha = bool(res) and any(item.get('is_captcha') for item in res)
+                    ENGINE_REQUESTS.inc(source, 'captcha' if captcha else ('ok' if res else 'empty'))
+                    if health:
+                        if captcha:
+                            health.record_failure('captcha', 'captcha page')
                         else:
-                            self.log(task_id, f"⚠️ {source}: 无结果")
-                            
-                        # Progress Update
-                        progress = int((completed_count / len(tasks)) * 100)
-                        if task_id in search_tasks:
-                            search_tasks[task_id]['progress'] = progress
-                            
-                    except Exception as e:
-                        self.log(task_id, f"❌ {source} 处理异常: {e}")
-            except TimeoutError:
-                self.log(task_id, "⚠️ 部分搜索源响应超时，已跳过")
-            except Exception as e:
-                self.log(task_id, f"❌ 搜索线程池异常: {e}")
+                            health.record_success()
+                    if res:
+                        count = result_set.add(res)
+                        if count > 0:
+                            # Fresh snapshot to avoid serialization race conditions
+                            if task_id in search_tasks:
+                                search_tasks[task_id]['results'] = result_set.results()
 
-        all_results.sort(key=lambda x: (x.get('is_completed', False), x.get('count', 0)), reverse=True)
+                            self.log(task_id, f"✅ {source}: 贡献 {count} 个结果")
+                    else:
+                        self.log(task_id, f"⚠️ {source}: 无结果")
+                except EngineBlocked as e:
+                    ENGINE_REQUESTS.inc(source, 'captcha')
+                    if health: health.record_failure('captcha', str(e))
+                    self.log(task_id, f"⚠️ {source}: 触发验证码")
+                except RequestTimeout as e:
+                    ENGINE_REQUESTS.inc(source, 'timeout')
+                    if health: health.record_failure('timeout', str(e))
+                    self.log(task_id, f"⚠️ {source}: 响应超时")
+                except Exception as e:
+                    ENGINE_REQUESTS.inc(source, 'error')
+                    if health: health.record_failure('error', str(e))
+                    self.log(task_id, f"❌ {source} 处理异常: {e}")
+            
+            # Progress Update
+            progress = int((completed_count / len(engines)) * 100)
+            if task_id in search_tasks:
+                search_tasks[task_id]['progress'] = progress
 
         if task_id in search_tasks:
-            search_tasks[task_id]['results'] = list(all_results)
+            search_tasks[task_id]['results'] = result_set.results()
+            search_tasks[task_id]['validating'] = bool(validate_top_k and len(result_set))
             search_tasks[task_id]['status'] = 'done'
             search_tasks[task_id]['progress'] = 100
+            search_tasks[task_id]['elapsed'] = round(time.time() - start, 2)
             
-            if all_results:
-                self.log(task_id, f"✨ 搜索完成！共找到 {len(all_results)} 个结果。")
+            if len(result_set):
+                self.log(task_id, f"✨ 搜索完成！共找到 {len(result_set)} 本书 ({len(result_set.seen_urls)} 个来源)。")
             else:
                  self.log(task_id, f"❌ 未找到有效结果。")
 
-    def search_baidu_wrapper(self, task_id, keyword):
+        if validate_top_k and len(result_set):
+            self.validate_candidates(task_id, result_set, validate_top_k)
+
+    def validate_candidates(self, task_id, result_set, top_k):
+        """Pre-fetch the TOC of the top candidates in parallel and fill in real chapter counts"""
+        candidates = result_set.top(top_k)
+        self.log(task_id, f"🔎 正在校验前 {len(candidates)} 个结果的目录...")
+        
+        futures = {validate_executor.submit(validate_candidate, book['url']): book for book in candidates}
+        deadline = time.time() + VALIDATE_DEADLINE
+        pending = set(futures)
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                # Same deadline model as the engines: stragglers are left behind
+                for future in pending:
+                    future.cancel()
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                book = futures[future]
+                try:
+                    chapters = future.result()
+                except Exception:
+                    chapters = []
+                fields = {'validated': True, 'downloadable': bool(chapters), 'count': len(chapters)}
+                if chapters and book.get('latest') in (None, '', '未知'):
+                    fields['latest'] = chapters[-1]['title']
+                result_set.update(book, fields)
+                self.log(task_id, f"{'✅' if chapters else '⚠️'} 校验 {book.get('title', '')}: {len(chapters)} 章")
+            if done and task_id in search_tasks:
+                search_tasks[task_id]['results'] = result_set.results()
+        
+        if task_id in search_tasks:
+            search_tasks[task_id]['validating'] = False
+
+    def search_baidu_wrapper(self, ctx):
         """Wrapper for existing baidu logic to fit new structure"""
         # Re-implement baidu logic here briefly or call existing if separated?
         # The previous 'search_all' HAD the baidu logic inside.
@@ -866,253 +3235,23 @@ class Searcher:
         
         results = []
         try:
-            query = f"{keyword} 小说 最新章节 目录"
+            query = f"{ctx.keyword} 小说 最新章节 目录"
             url = f"https://www.baidu.com/s?wd={query}"
-            resp = requests.get(url, headers=self.headers, timeout=5)
+            resp = self.http.get(url, headers=ctx.headers, timeout=5)
             if resp.status_code == 200:
                 soup = BeautifulSoup(resp.content, 'html.parser')
                 page_title = soup.title.get_text() if soup.title else ""
                 if "安全验证" in page_title:
-                    return results # Empty
+                    raise EngineBlocked("百度安全验证")
                 
                 containers = soup.find_all('div', class_=lambda x: x and 'c-container' in x)
                 if not containers: containers = soup.select('.result')
                 if containers:
-                    results = self.parse_baidu_results(task_id, containers, keyword)
+                    results = self.parse_baidu_results(ctx, containers)
+        except (EngineBlocked, RequestTimeout): raise
         except: pass
         return results
 
-    def search_sogou(self, task_id, keyword):
-        results = []
-        try:
-            query = f"{keyword} 小说 目录"
-            url = f"https://www.sogou.com/web?query={query}"
-            resp = requests.get(url, headers=self.headers, timeout=5)
-            
-            if "验证码" in resp.text or "antispider" in resp.url:
-                self.log(task_id, "⚠️ Sogou 触发验证码")
-                return []
-                
-            soup = BeautifulSoup(resp.content, 'html.parser')
-            # Sogou wrappers: .vrwrap, .rb
-            containers = soup.select('.vrwrap, .rb')
-            self.log(task_id, f"Sogou 返回了 {len(containers)} 个潜在结果...")
-            
-            count = 0
-            for div in containers:
-                if count >= 8: break
-                try:
-                    h3 = div.find('h3')
-                    a = h3.find('a') if h3 else None
-                    if not a: continue
-                    
-                    link = a['href']
-                    title = a.get_text().strip()
-                    if keyword not in title: continue # Stricter check for simplicity
-                    
-                    # Sogou links are redirects usually (/link?url=...)
-                    # Need resolve? Yes.
-                    real_url = link
-                    if link.startswith('/'):
-                        real_url = "https://www.sogou.com" + link
-                    
-                    # Snippet
-                    snippet = ""
-                    p = div.find('p', class_='str_info') or div.find('div', class_='ft')
-                    if p: snippet = p.get_text().strip()
-                    
-                    results.append({
-                        "title": title,
-                        "author": "未知", # Sogou extract difficult
-                        "protagonist": "未知",
-                        "source": "Sogou",
-                        "url": real_url,
-                        "is_completed": False,
-                        "latest": "未知",
-                        "snippet": snippet[:50]
-                    })
-                    count += 1
-                    self.log(task_id, f"✅ Sogou发现: {title}")
-                except: continue
-        except Exception as e:
-            pass
-        return results
-
-    def search_direct_sites(self, task_id, keyword):
-        """Search specific sites concurrently"""
-        results = []
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            futures = [
-                executor.submit(self.search_quanben, keyword),
-                executor.submit(self.search_biquge, keyword)
-            ]
-            
-            for future in futures:
-                try:
-                    res = future.result()
-                    if res:
-                        results.extend(res)
-                        for r in res:
-                            self.log(task_id, f"✅ 发现: {r['title']} [直连: {r['source']}]")
-                except Exception as e:
-                    print(f"Direct search error: {e}")
-        return results
-
-    def search_quanben(self, keyword):
-        try:
-            # Quanben.io
-            url = "https://www.quanben.io/index.php"
-            params = {"c": "book", "a": "search", "keywords": keyword}
-            resp = requests.get(url, params=params, headers=self.headers, timeout=10)
-            if resp.status_code != 200: return []
-            
-            soup = BeautifulSoup(resp.content, 'html.parser')
-            results = []
-            # Quanben usually lists results in main container
-            # Structure: .p10 > li matches? OR just find links
-            # Link pattern: /n/bookid/
-            
-            for a in soup.find_all('a', href=True):
-                href = a['href']
-                text = a.get_text().strip()
-                # Strict check for book profile link
-                if re.search(r'/n/\w+/', href) and text and keyword in text:
-                    full_url = urljoin("https://www.quanben.io", href)
-                    if not any(r['url'] == full_url for r in results):
-                        results.append({
-                            "title": text,
-                            "author": "全本小说", # Unknown on list page usually
-                            "protagonist": "未知",
-                            "source": "quanben.io",
-                            "url": full_url,
-                            "is_completed": True, # Quanben implies finished mostly
-                            "latest": "未知",
-                            "snippet": "全本小说网直连搜索结果"
-                        })
-            return results
-        except: return []
-
-    def search_biquge(self, keyword):
-        try:
-            # Using a stable biquge mirror. 
-            # Many biquge sites use POST /search.php?keyword=...
-            # or GET /s?q=...
-            # Let's try bqgka.com (often redirects to valid) or similar.
-            # Actually, standard biquges often use `search.php?keyword=`
-            # Checking a common one: www.xbiquge.so
-            
-            url = f"https://www.xbiquge.so/modules/article/search.php"
-            params = {'searchkey': keyword}
-            resp = requests.get(url, params=params, headers=self.headers, timeout=10)
-            
-            soup = BeautifulSoup(resp.content, 'html.parser')
-            results = []
-            
-            # Table rows usually: tr > td > a (Title), td (Latest), td (Author)
-            rows = soup.find_all('tr')
-            for row in rows:
-                cols = row.find_all('td')
-                if len(cols) >= 3:
-                    a_title = cols[0].find('a')
-                    if not a_title: continue
-                    
-                    title = a_title.get_text().strip()
-                    link = a_title['href']
-                    if keyword not in title: continue
-                    
-                    # Ensure full URL
-                    full_url = urljoin(url, link)
-                    
-                    # Latest Chapter
-                    latest = cols[1].get_text().strip()
-                    
-                    # Author
-                    author = cols[2].get_text().strip()
-                    
-                    results.append({
-                        "title": title,
-                        "author": author,
-                        "protagonist": "未知",
-                        "source": "xbiquge.so",
-                        "url": full_url,
-                        "is_completed": False, 
-                        "latest": latest,
-                        "snippet": f"作者：{author} | 最新：{latest}"
-                    })
-            return results
-        except Exception as e:
-            return []
-
-    def search_bing(self, task_id, keyword):
-        results = []
-        # Bing Search
-        query = f"{keyword} 小说 最新章节 目录"
-        url = f"https://www.bing.com/search?q={query}"
-        
-        # Bing needs slightly different headers sometimes, but generic works
-        resp = requests.get(url, headers=self.headers, timeout=10)
-        if resp.status_code != 200: return []
-        
-        soup = BeautifulSoup(resp.content, 'html.parser')
-        
-        # Bing Results: li.b_algo
-        containers = soup.select('li.b_algo')
-        self.log(task_id, f"Bing 返回了 {len(containers)} 个潜在结果...")
-        
-        count = 0
-        for li in containers:
-            if count >= 8: break
-            try:
-                h2 = li.find('h2')
-                if not h2: continue
-                a = h2.find('a')
-                if not a: continue
-                
-                link = a['href']
-                title_text = a.get_text().strip()
-                
-                # Check snippet
-                snippet = ""
-                p = li.find('p')
-                if p: snippet = p.get_text().strip()
-                
-                # Bing urls are direct usually! No redirect resolution needed mostly.
-                # But sometimes they are bing redirects.
-                real_url = link 
-                
-                domain = urlparse(real_url).netloc
-                if 'bing.com' in domain or 'microsoft.com' in domain: continue
-
-                # Metadata Extraction (Reuse same logic or simplified)
-                is_completed = "完结" in snippet or "完本" in snippet
-                author = "未知"
-                protagonist = "未知"
-                
-                # Extract Author logic (same as before)
-                author_match = re.search(r'(作者|笔名)[:：]\s*([^\s\u3000]+)', snippet)
-                if author_match: author = author_match.group(2).strip()
-                
-                if keyword not in title_text and len(keyword) > 2:
-                     # Relaxed Bing check: Bing is usually decent relevance
-                     pass 
-
-                results.append({
-                    "title": title_text,
-                    "author": author,
-                    "protagonist": protagonist,
-                    "source": domain,
-                    "url": real_url,
-                    "is_completed": is_completed,
-                    "latest": "未知",
-                    "snippet": snippet[:60] + "..."
-                })
-                count += 1
-                self.log(task_id, f"✅ Bing发现: {title_text}")
-                
-            except: continue
-            
-        return results
-
     def _extract_metadata(self, snippet, title="", latest_chapter=""):
         """Helper to extract common metadata from text"""
         meta = {
@@ -1156,12 +3295,12 @@ class Searcher:
 
         return meta
 
-    def parse_baidu_results(self, task_id, containers, keyword):
+    def parse_baidu_results(self, ctx, containers):
         results = []
         count = 0
         def clean_text(s):
              return re.sub(r'[^\w\u4e00-\u9fa5]', '', s)
-        clean_keyword = clean_text(keyword)
+        clean_keyword = clean_text(ctx.keyword)
 
         for div in containers:
             if count >= 8: break 
@@ -1193,7 +3332,7 @@ class Searcher:
 
                 # Resolve Redirect
                 try:
-                    head_resp = requests.head(link, headers=self.headers, allow_redirects=True, timeout=5)
+                    head_resp = self.http.head(link, headers=ctx.headers, allow_redirects=True, timeout=5)
                     real_url = head_resp.url
                     domain = urlparse(real_url).netloc
                     if 'baidu.com' in domain or 'zhihu.com' in domain or 'tieba' in domain: continue
@@ -1210,20 +3349,20 @@ class Searcher:
                         "snippet": abstract[:50] + "..."
                     })
                     count += 1
-                    self.log(task_id, f"✅ 发现: {title_text}")
+                    self.log(ctx.task_id, f"✅ 发现: {title_text}")
                 except: continue
             except: continue
         return results
 
-    def search_sogou(self, task_id, keyword):
+    def search_sogou(self, ctx):
         results = []
         try:
-            query = f"{keyword} 小说 目录"
+            query = f"{ctx.keyword} 小说 目录"
             url = f"https://www.sogou.com/web?query={query}"
-            resp = requests.get(url, headers=self.headers, timeout=5)
+            resp = self.http.get(url, headers=ctx.headers, timeout=5)
             
             if "验证码" in resp.text or "antispider" in resp.url:
-                self.log(task_id, "⚠️ Sogou 触发验证码")
+                self.log(ctx.task_id, "⚠️ Sogou 触发验证码")
                 return [{
                     "title": "⚠️ Sogou搜索需人工验证",
                     "author": "系统提示",
@@ -1240,7 +3379,7 @@ class Searcher:
             soup = BeautifulSoup(resp.content, 'html.parser')
             # Sogou wrappers: .vrwrap, .rb
             containers = soup.select('.vrwrap, .rb')
-            self.log(task_id, f"Sogou 返回了 {len(containers)} 个潜在结果...")
+            self.log(ctx.task_id, f"Sogou 返回了 {len(containers)} 个潜在结果...")
             
             count = 0
             for div in containers:
@@ -1252,7 +3391,7 @@ class Searcher:
                     
                     link = a['href']
                     title = a.get_text().strip()
-                    if keyword not in title: continue 
+                    if ctx.keyword not in title: continue 
                     
                     # Snippet
                     snippet = ""
@@ -1279,44 +3418,51 @@ class Searcher:
                         "snippet": snippet[:50]
                     })
                     count += 1
-                    self.log(task_id, f"✅ Sogou发现: {title}")
+                    self.log(ctx.task_id, f"✅ Sogou发现: {title}")
                 except: continue
+        except RequestTimeout: raise
         except Exception as e:
             pass
         return results
 
-    def search_direct_sites(self, task_id, keyword):
-        """Search specific sites concurrently"""
-        results = []
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            futures = [
-                executor.submit(self.search_quanben, keyword),
-                executor.submit(self.search_biquge, keyword)
-            ]
-            
-            for future in futures:
-                try:
-                    res = future.result()
-                    if res:
-                        results.extend(res)
-                        for r in res:
-                            self.log(task_id, f"✅ 发现: {r['title']} [直连: {r['source']}]")
-                except Exception as e:
-                    print(f"Direct search error: {e}")
+    def local_result(self, hit):
+        """Shape a LibraryIndex hit like an engine result"""
+        snippet = hit['snippet']
+        if hit['chapter_title']:
+            snippet = f"{hit['chapter_title']}: {snippet}"
+        return {
+            "title": hit['title'],
+            "author": "未知",
+            "protagonist": "未知",
+            "source": "本地书库",
+            "url": f"/api/download/{quote(hit['filename'])}",
+            "filename": hit['filename'],
+            "is_local": True,
+            "is_completed": True,
+            "latest": "已下载",
+            "count": hit['chapters'],
+            "snippet": snippet[:80]
+        }
+
+    def search_direct_site(self, ctx, site_search):
+        """Run one direct-site search and log its hits"""
+        results = site_search(ctx)
+        for r in results:
+            self.log(ctx.task_id, f"✅ 发现: {r['title']} [直连: {r['source']}]")
         return results
 
-    def search_quanben(self, keyword):
+    def search_quanben(self, ctx):
         try:
             url = "https://www.quanben.io/index.php"
-            params = {"c": "book", "a": "search", "keywords": keyword}
-            resp = requests.get(url, params=params, headers=self.headers, timeout=5)
+            params = {"c": "book", "a": "search", "keywords": ctx.keyword}
+            resp = self.http.get(url, params=params, headers=ctx.headers, timeout=5)
             if resp.status_code != 200: return []
             soup = BeautifulSoup(resp.content, 'html.parser')
             results = []
             for a in soup.find_all('a', href=True):
                 href = a['href']
                 text = a.get_text().strip()
-                if re.search(r'/n/\w+/', href) and text and keyword in text:
+                if re.search(r'/n/\w+/', href) and text and ctx.keyword in text:
                     full_url = urljoin("https://www.quanben.io", href)
                     # User feedback: Ensure we point to list.html for correct parsing
                     if full_url.endswith('/') and not full_url.endswith('list.html'):
@@ -1340,13 +3486,14 @@ class Searcher:
                             "snippet": "全本小说网直连搜索结果"
                         })
             return results
+        except RequestTimeout: raise
         except: return []
 
-    def search_biquge(self, keyword):
+    def search_biquge(self, ctx):
         try:
             url = f"https://www.xbiquge.so/modules/article/search.php"
-            params = {'searchkey': keyword}
-            resp = requests.get(url, params=params, headers=self.headers, timeout=5)
+            params = {'searchkey': ctx.keyword}
+            resp = self.http.get(url, params=params, headers=ctx.headers, timeout=5)
             soup = BeautifulSoup(resp.content, 'html.parser')
             results = []
             rows = soup.find_all('tr')
@@ -1357,7 +3504,7 @@ class Searcher:
                     if not a_title: continue
                     title = a_title.get_text().strip()
                     link = a_title['href']
-                    if keyword not in title: continue
+                    if ctx.keyword not in title: continue
                     full_url = urljoin(url, link)
                     latest = cols[1].get_text().strip()
                     author = cols[2].get_text().strip()
@@ -1378,24 +3525,25 @@ class Searcher:
                         "snippet": f"作者：{author} | 最新：{latest}"
                     })
             return results
+        except RequestTimeout: raise
         except Exception as e:
             return []
 
-    def search_bing(self, task_id, keyword):
+    def search_bing(self, ctx):
         results = []
         # Bing Search
-        query = f"{keyword} 小说 最新章节 目录"
+        query = f"{ctx.keyword} 小说 最新章节 目录"
         url = f"https://www.bing.com/search?q={query}"
         
         # Bing user agent rotation often needed?
-        resp = requests.get(url, headers=self.headers, timeout=10)
+        resp = self.http.get(url, headers=ctx.headers, timeout=10)
         if resp.status_code != 200: return []
         
         soup = BeautifulSoup(resp.content, 'html.parser')
         
         # Bing Results: li.b_algo
         containers = soup.select('li.b_algo')
-        self.log(task_id, f"Bing 返回了 {len(containers)} 个潜在结果...")
+        self.log(ctx.task_id, f"Bing 返回了 {len(containers)} 个潜在结果...")
         
         count = 0
         for li in containers:
@@ -1419,7 +3567,7 @@ class Searcher:
                 # Reuse Helper
                 meta = self._extract_metadata(snippet, title_text)
                 
-                if keyword not in title_text and len(keyword) > 2: pass 
+                if ctx.keyword not in title_text and len(ctx.keyword) > 2: pass 
 
                 results.append({
                     "title": title_text,
@@ -1433,16 +3581,18 @@ class Searcher:
                     "snippet": snippet[:60] + "..."
                 })
                 count += 1
-                self.log(task_id, f"✅ Bing发现: {title_text}")
+                self.log(ctx.task_id, f"✅ Bing发现: {title_text}")
                 
             except: continue
             
         return results
 
 searcher = Searcher()
+if http_cassette:
+    searcher.http = use_cassette(requests.Session())
 
-def run_search_async(task_id, keyword):
-    searcher.search_all(task_id, keyword)
+def run_search_async(task_id, keyword, validate_top_k=0):
+    searcher.search_all(task_id, keyword, validate_top_k)
 
 @app.route('/api/search/start', methods=['POST'])
 def start_search():
@@ -1451,6 +3601,8 @@ def start_search():
     if not keyword:
         return jsonify({'error': 'No keyword'}), 400
     
+    validate_top_k = SEARCH_VALIDATE_TOP_K if data.get('validate', True) else 0
+    
     task_id = str(uuid.uuid4())
     search_tasks[task_id] = {
         'status': 'running',
@@ -1459,7 +3611,7 @@ def start_search():
         'results': []
     }
     
-    thread = threading.Thread(target=run_search_async, args=(task_id, keyword))
+    thread = threading.Thread(target=run_search_async, args=(task_id, keyword, validate_top_k))
     thread.daemon = True
     thread.start()
     
@@ -1471,9 +3623,41 @@ def search_progress(task_id):
         return jsonify({'error': 'Task not found'}), 404
     return jsonify(search_tasks[task_id])
 
+def active_task_counts():
+    counts = {}
+    for t in list(tasks.values()):
+        counts[(t['status'],)] = counts.get((t['status'],), 0) + 1
+    return counts
+
+def queue_depths():
+    depths = {}
+    for task_id, d in list(downloaders.items()):
+        if tasks.get(task_id, {}).get('status') in ('running', 'paused'):
+            key = (type(d).__name__,)
+            depths[key] = depths.get(key, 0) + len(d.pending_chapters)
+    return depths
+
+ENGINE_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+Gauge('novel_tasks', 'Download tasks by status', ('status',), active_task_counts)
+Gauge('novel_queue_depth', 'Chapters waiting in the fetch queues of running tasks', ('downloader',), queue_depths)
+Gauge('novel_search_tasks_running', 'Searches in progress', (),
+      lambda: {(): sum(1 for s in list(search_tasks.values()) if s['status'] == 'running')})
+Gauge('novel_search_engine_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open)', ('engine',),
+      lambda: {(name,): ENGINE_STATES[h.state] for name, h in engine_health.items()})
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/search/engines')
+def search_engines():
+    """Circuit breaker state of every search engine"""
+    return jsonify({'engines': [h.snapshot() for h in engine_health.values()]})
+
 # --- End Search Logic ---
 
 # --- End Search Logic ---
 
 if __name__ == '__main__':
+    get_library_index() # Sync the library while the server starts, not on the first search
     app.run(host='0.0.0.0', debug=True, port=3000)
@@ -0,0 +1,311 @@
+"""API load test: N downloads and M searches against one app instance.
+
+The app runs in a child process (gunicorn like the Procfile when it is
+installed, otherwise the werkzeug server) with every outbound request routed
+to an in-process MockSite. Client threads poll the way static/script.js
+does. A download polls /api/progress every second until it is done, and a
+search polls /api/search/progress every 0.5 s until it is done and validated.
+The report gives p50/p99 per endpoint, and the server's CPU, thread count
+and RSS over time, sampled from /proc (Linux only).
+
+    python bench_api.py --downloads 20 --searches 10 --chapters 30 --latency lognormal:50:0.5
+    python bench_api.py --downloads 50 --max-p99-ms 500 --json load.json
+
+Exits 1 when a request failed or an endpoint's p99 is above --max-p99-ms.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from mock_site import MockSite, route_to_mock, site_options, site_kwargs, BOOK_URLS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DOWNLOAD_POLL = 1.0 # static/script.js pollProgress
+SEARCH_POLL = 0.5 # static/script.js pollSearch
+FIRST_DOWNLOAD_BOOK = 2001 # Apart from the books the search engines return
+
+
+def mock_app():
+    """gunicorn factory: the app with all outbound requests sent to BENCH_MOCK_SITE"""
+    import app
+    site_url = os.environ['BENCH_MOCK_SITE']
+    app.TRANSPORT_HOOKS.append(lambda session: route_to_mock(session, site_url))
+    app.searcher.http = route_to_mock(requests.Session(), site_url)
+    app.CHAPTER_DELAY = tuple(float(x) for x in os.environ.get('BENCH_CHAPTER_DELAY', '0:0').split(':'))
+    return app.app
+
+def serve_werkzeug(port):
+    from werkzeug.serving import make_server
+    make_server('127.0.0.1', port, mock_app(), threaded=True).serve_forever()
+
+
+# --- Server process ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(args, site, work_dir):
+    port = free_port()
+    env = dict(os.environ, BENCH_MOCK_SITE=site.url, BENCH_CHAPTER_DELAY=args.chapter_delay,
+               PYTHONPATH=HERE + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    server = args.server
+    if server == 'auto':
+        server = 'gunicorn' if shutil.which('gunicorn') else 'werkzeug'
+    if server == 'gunicorn':
+        cmd = ['gunicorn', '-b', f'127.0.0.1:{port}'] + args.gunicorn_args.split() + ['bench_api:mock_app()']
+    else:
+        cmd = [sys.executable, os.path.join(HERE, 'bench_api.py'), '--serve-werkzeug', str(port)]
+    log = open(os.path.join(work_dir, 'server.log'), 'w')
+    proc = subprocess.Popen(cmd, cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            break
+        try:
+            if requests.get(base + '/', timeout=2).status_code == 200:
+                return proc, base, server
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    log.close()
+    with open(os.path.join(work_dir, 'server.log')) as f:
+        sys.exit(f"Server did not come up ({' '.join(cmd)}):\n{f.read()[-2000:]}")
+
+def process_tree(pid):
+    """pid and all its descendants, from /proc"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        tree.append(p)
+        todo.extend(children.get(p, []))
+    return tree
+
+def sample_resources(pid):
+    """(cpu seconds, threads, rss bytes) summed over the server's process tree"""
+    cpu = threads = rss = 0
+    ticks, page = os.sysconf('SC_CLK_TCK'), os.sysconf('SC_PAGE_SIZE')
+    for p in process_tree(pid):
+        try:
+            with open(f'/proc/{p}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # Fields after the command name start at field 3 (state)
+        cpu += (int(fields[11]) + int(fields[12])) / ticks
+        threads += int(fields[17])
+        rss += int(fields[21]) * page
+    return cpu, threads, rss
+
+
+# --- Clients ---
+
+class LoadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.requests = [] # (seconds since start, endpoint, ms, ok)
+        self.active = {'downloads': 0, 'searches': 0}
+        self.finished = {'downloads': {}, 'searches': {}}
+
+    def timed(self, session, method, url, endpoint, **kwargs):
+        t = time.perf_counter()
+        try:
+            resp = session.request(method, url, timeout=30, **kwargs)
+            ok = resp.status_code < 400
+        except requests.RequestException:
+            resp, ok = None, False
+        ms = (time.perf_counter() - t) * 1000
+        with self.lock:
+            self.requests.append((time.time() - self.start, endpoint, ms, ok))
+        return resp if ok else None
+
+    def track(self, kind, delta, outcome=None):
+        with self.lock:
+            self.active[kind] += delta
+            if outcome:
+                self.finished[kind][outcome] = self.finished[kind].get(outcome, 0) + 1
+
+def download_client(stats, base, url, deadline):
+    session = requests.Session()
+    stats.track('downloads', 1)
+    outcome = 'timeout'
+    resp = stats.timed(session, 'POST', base + '/api/start', 'POST /api/start', json={'url': url})
+    if resp is None:
+        outcome = 'start_failed'
+    else:
+        task_id = resp.json()['task_id']
+        while time.time() < deadline:
+            time.sleep(DOWNLOAD_POLL)
+            resp = stats.timed(session, 'GET', f"{base}/api/progress/{task_id}", 'GET /api/progress')
+            data = resp.json() if resp is not None else {}
+            if data.get('status') in ('done', 'error'):
+                outcome = data['status']
+                break
+    stats.track('downloads', -1, outcome)
+
+def search_client(stats, base, keyword, deadline):
+    session = requests.Session()
+    stats.track('searches', 1)
+    outcome = 'timeout'
+    resp = stats.timed(session, 'POST', base + '/api/search/start', 'POST /api/search/start', json={'keyword': keyword})
+    if resp is None:
+        outcome = 'start_failed'
+    else:
+        task_id = resp.json()['task_id']
+        while time.time() < deadline:
+            time.sleep(SEARCH_POLL)
+            resp = stats.timed(session, 'GET', f"{base}/api/search/progress/{task_id}", 'GET /api/search/progress')
+            data = resp.json() if resp is not None else {}
+            if data.get('status') == 'done' and not data.get('validating'):
+                outcome = 'done' if data.get('results') else 'no_results'
+                break
+    stats.track('searches', -1, outcome)
+
+
+# --- Report ---
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+def endpoint_table(requests_log):
+    table = {}
+    for _, endpoint, ms, ok in requests_log:
+        row = table.setdefault(endpoint, {'count': 0, 'errors': 0, 'ms': []})
+        row['count'] += 1
+        row['errors'] += not ok
+        row['ms'].append(ms)
+    return {endpoint: {'count': r['count'], 'errors': r['errors'], 'p50_ms': round(percentile(r['ms'], 0.5), 1),
+                       'p99_ms': round(percentile(r['ms'], 0.99), 1), 'max_ms': round(max(r['ms']), 1)}
+            for endpoint, r in sorted(table.items())}
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Flask API against the mock site')
+    parser.add_argument('--downloads', type=int, default=10)
+    parser.add_argument('--searches', type=int, default=5)
+    parser.add_argument('--keyword', default='模拟小说')
+    parser.add_argument('--ramp', type=float, default=5.0, help='seconds over which clients start')
+    parser.add_argument('--duration', type=float, default=600.0, help='give up on clients after this many seconds')
+    parser.add_argument('--interval', type=float, default=1.0, help='resource sampling interval')
+    parser.add_argument('--chapter-delay', default='0:0', help='anti-bot pause MIN:MAX seconds in the app')
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'werkzeug'], default='auto')
+    parser.add_argument('--gunicorn-args', default='', help='extra gunicorn options, e.g. "--threads 8"')
+    parser.add_argument('--max-p99-ms', type=float, default=None)
+    parser.add_argument('--json', help='write endpoints and timeline to this file')
+    parser.add_argument('--serve-werkzeug', type=int, help=argparse.SUPPRESS)
+    site_options(parser)
+    args = parser.parse_args()
+    if args.serve_werkzeug:
+        return serve_werkzeug(args.serve_werkzeug)
+
+    work_dir = tempfile.mkdtemp(prefix='bench_api_')
+    site = MockSite(**site_kwargs(args)).start()
+    proc, base, server = start_server(args, site, work_dir)
+    print(f"{server} on {base} (pid {proc.pid}), mock site {site.url}, work dir {work_dir}", file=sys.stderr)
+
+    stats = LoadStats()
+    timeline = []
+    done = threading.Event()
+
+    def monitor():
+        last_cpu, last_t = sample_resources(proc.pid)[0], time.time()
+        while not done.wait(args.interval):
+            cpu, threads, rss = sample_resources(proc.pid)
+            now = time.time()
+            with stats.lock:
+                since = now - stats.start - args.interval
+                window = [ms for t, e, ms, _ in stats.requests if e == 'GET /api/progress' and t >= since]
+                active = dict(stats.active)
+            timeline.append({'t': round(now - stats.start, 1), 'cpu_pct': round((cpu - last_cpu) / (now - last_t) * 100, 1),
+                             'threads': threads, 'rss_mib': round(rss / 2 ** 20, 1), **active,
+                             'progress_p99_ms': round(percentile(window, 0.99), 1)})
+            last_cpu, last_t = cpu, now
+
+    deadline = time.time() + args.duration
+    layouts = list(BOOK_URLS)
+    downloads = [(download_client, (stats, base, BOOK_URLS[layouts[i % len(layouts)]].format(book=FIRST_DOWNLOAD_BOOK + i), deadline))
+                 for i in range(args.downloads)]
+    searches = [(search_client, (stats, base, args.keyword, deadline)) for _ in range(args.searches)]
+    clients = [] # Interleaved, so searches run while downloads poll
+    for i in range(max(len(downloads), len(searches))):
+        clients.extend(group[i] for group in (downloads, searches) if i < len(group))
+
+    monitor_thread = threading.Thread(target=monitor, daemon=True)
+    monitor_thread.start()
+    threads = []
+    for n, (target, client_args) in enumerate(clients):
+        if n:
+            time.sleep(args.ramp / (len(clients) - 1))
+        t = threading.Thread(target=target, args=client_args, daemon=True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join(max(0, deadline - time.time()) + 5)
+    done.set()
+    monitor_thread.join()
+    wall = time.time() - stats.start
+
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    site.shutdown()
+
+    endpoints = endpoint_table(stats.requests)
+    print(f"\n{'endpoint':<28}{'count':>7}{'errors':>8}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for endpoint, r in endpoints.items():
+        print(f"{endpoint:<28}{r['count']:>7}{r['errors']:>8}{r['p50_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}")
+
+    print(f"\n{'t':>6}{'cpu%':>7}{'threads':>9}{'rss MiB':>9}{'dl':>5}{'srch':>6}{'progress p99':>14}")
+    step = max(1, len(timeline) // 30)
+    for row in timeline[::step]:
+        print(f"{row['t']:>6}{row['cpu_pct']:>7}{row['threads']:>9}{row['rss_mib']:>9}{row['downloads']:>5}"
+              f"{row['searches']:>6}{row['progress_p99_ms']:>14}")
+    if timeline:
+        print(f"\npeak rss {max(r['rss_mib'] for r in timeline)} MiB, peak threads {max(r['threads'] for r in timeline)}, "
+              f"mean cpu {sum(r['cpu_pct'] for r in timeline) / len(timeline):.1f}%")
+    print(f"downloads {stats.finished['downloads']}, searches {stats.finished['searches']}, {wall:.1f}s")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'server': server, 'args': {k: v for k, v in vars(args).items() if k != 'serve_werkzeug'},
+                       'endpoints': endpoints, 'timeline': timeline, 'finished': stats.finished,
+                       'mock_site': site.snapshot(), 'seconds': round(wall, 1)}, f, ensure_ascii=False, indent=1)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    failed = [e for e, r in endpoints.items() if r['errors']]
+    slow = [e for e, r in endpoints.items() if args.max_p99_ms is not None and r['p99_ms'] > args.max_p99_ms]
+    if failed:
+        print(f"Failed requests: {', '.join(failed)}")
+    if slow:
+        print(f"p99 above {args.max_p99_ms} ms: {', '.join(slow)}")
+    if failed or slow:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""End-to-end download throughput against mock_site.py.
+
+Starts a MockSite in-process and runs the real downloaders (the full run():
+TOC, chapter loop, retries, assembly) on synthetic books, several tasks per
+layout at once. Afterwards every chapter file is checked for the markers of
+all its pages, so a chapter that lost a page counts as truncated.
+
+    python bench_download.py --tasks 4 --chapters 50 --latency lognormal:60:0.5 --error-rate 0.05
+    python bench_download.py --layouts quanben --gap-every 10 --chapter-delay 0.5:1.5
+    python bench_download.py --tasks 8 --transport httpx    # needs httpx installed
+
+The anti-bot pause between chapters is off unless --chapter-delay is given.
+Everything is written under a temporary directory, never to downloads/ or
+the library index.
+"""
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+WORK_DIR = tempfile.mkdtemp(prefix='bench_download_')
+os.chdir(WORK_DIR) # app.py keeps downloads/ relative to the cwd
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+
+import app
+from mock_site import MockSite, route_to_mock, site_options, site_kwargs, BOOK_URLS, FIRST_BOOK
+
+
+def new_task(url, task_id):
+    app.tasks[task_id] = {
+        'url': url, 'status': 'running', 'control': 'running', 'percent': 0, 'current': 0, 'total': 0,
+        'success': 0, 'fail': 0, 'log': 'Task Initialized...', 'filename': None, 'mirrors': []
+    }
+
+def check_chapters(d, book, pages):
+    """(intact, truncated) chapter files of one finished task"""
+    intact = truncated = 0
+    for c in d.all_chapters or []:
+        path = d.chapter_path(c['index'])
+        m = re.search(r'/(\d+)\.html$', c['url'])
+        if not m or not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        found = sum(f"【{book}-{m.group(1)}-{p}】" in text for p in range(1, pages + 1))
+        if found == pages:
+            intact += 1
+        else:
+            truncated += 1
+    return intact, truncated
+
+def run_layout(site, layout, args):
+    app.books.clear() # The layouts serve the same books: don't let one copy another's chapters
+    runs = []
+    for i in range(args.tasks):
+        book = FIRST_BOOK + i
+        url = BOOK_URLS[layout].format(book=book)
+        task_id = f"bench-{layout}-{book}"
+        d = app.pick_downloader_class(url)(url, task_id)
+        d.set_transport(args.transport)
+        route_to_mock(d.session, site.url)
+        d.hedge = args.hedge
+        if args.retry_base is not None:
+            d.retry_policy = app.RetryPolicy(base=args.retry_base)
+        new_task(url, task_id)
+        runs.append((book, d))
+
+    before = site.snapshot()
+    start = time.time()
+    threads = [threading.Thread(target=d.run, daemon=True) for _, d in runs]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    after = site.snapshot()
+
+    expected = len(site.listed()) * args.tasks
+    row = {'layout': layout, 'tasks': args.tasks, 'expected': expected, 'ok': 0, 'failed': 0,
+           'missing': 0, 'intact': 0, 'truncated': 0, 'retries': 0, 'errors': 0}
+    for book, d in runs:
+        task = app.tasks[d.task_id]
+        row['ok'] += task['success']
+        row['failed'] += task['fail']
+        row['missing'] += len(d.missing_chapters)
+        intact, truncated = check_chapters(d, book, site.pages)
+        row['intact'] += intact
+        row['truncated'] += truncated
+        retries = d.retry_policy.snapshot()
+        row['retries'] += retries['retries']
+        row['errors'] += sum(retries['errors'].values())
+        if task['status'] != 'done':
+            row['failed'] += 1
+    row['seconds'] = round(elapsed, 2)
+    row['chapters_per_sec'] = round(row['ok'] / elapsed, 1) if elapsed else 0.0
+    row['requests'] = after['requests'] - before['requests']
+    row['injected'] = after['injected'] - before['injected']
+    row['recovered'] = round(row['intact'] / expected * 100, 1) if expected else 100.0
+    return row
+
+def main():
+    parser = argparse.ArgumentParser(description='Download throughput against the mock site')
+    parser.add_argument('--layouts', default='cheyil,quanben,generic')
+    parser.add_argument('--tasks', type=int, default=2, help='concurrent books per layout')
+    parser.add_argument('--chapter-delay', default='0:0', help='anti-bot pause MIN:MAX seconds')
+    parser.add_argument('--retry-base', type=float, default=None, help='RetryPolicy base delay override')
+    parser.add_argument('--hedge', action='store_true')
+    parser.add_argument('--transport', default='requests', choices=('requests', 'httpx'))
+    parser.add_argument('--json', action='store_true', help='print rows as JSON lines')
+    parser.add_argument('--verbose', action='store_true', help='show the downloader logs')
+    site_options(parser)
+    args = parser.parse_args()
+
+    app.CHAPTER_DELAY = tuple(float(x) for x in args.chapter_delay.split(':'))
+    site = MockSite(**site_kwargs(args)).start()
+    print(f"Mock site {site.url}: {args.chapters} chapters x {args.pages} pages, latency {args.latency}, "
+          f"errors {args.error_rate:.0%} ({args.error_codes}), {args.tasks} tasks per layout, "
+          f"{args.transport} transport", file=sys.stderr)
+
+    rows = []
+    for layout in args.layouts.split(','):
+        if layout not in BOOK_URLS:
+            parser.error(f"unknown layout: {layout}")
+        print(f"Running {layout}...", file=sys.stderr)
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else open(os.devnull, 'w')):
+            rows.append(run_layout(site, layout, args))
+    site.shutdown()
+
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+        return
+    print(f"{'layout':<9}{'ok':>7}{'/exp':>6}{'miss':>6}{'fail':>6}{'trunc':>6}{'sec':>8}{'ch/s':>7}"
+          f"{'reqs':>7}{'inject':>7}{'retry':>7}{'recov%':>8}")
+    for r in rows:
+        print(f"{r['layout']:<9}{r['ok']:>7}{r['expected']:>6}{r['missing']:>6}{r['failed']:>6}{r['truncated']:>6}"
+              f"{r['seconds']:>8}{r['chapters_per_sec']:>7}{r['requests']:>7}{r['injected']:>7}{r['retries']:>7}"
+              f"{r['recovered']:>8}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""Offline parser benchmark over the bundled HTML fixtures.
+
+Runs the real downloader TOC / chapter parsers and the Searcher result parser
+against the saved pages, served by an in-process requests adapter so nothing
+touches the network. Throughput is pages per CPU second of the calling
+thread: the median of --repeats batches of --iterations runs (the Quanben
+TOC's polite sleep doesn't count). Memory is the tracemalloc peak of one run
+plus the blocks it leaves allocated. Chapter pages are parsed in app's parse
+pool when it has one, and then only what is left on the calling thread is
+measured: run with PARSE_PROCESSES=0 to time the parsers themselves.
+
+    python bench_parsers.py                  # compare with bench_baseline.json
+    python bench_parsers.py --save-baseline  # store this run as the baseline
+    python bench_parsers.py --only cheyil    # cases whose name contains "cheyil"
+
+Exits 1 when a case is slower than the baseline by more than --threshold or
+uses more memory by more than --memory-threshold. The speed threshold is set
+from the run-to-run noise measured on the baseline machine (see
+SPEED_THRESHOLD); the spread column shows how noisy this run was. Baselines are machine
+specific: the file records the machine it was saved on, and on any other
+machine regressions are only reported. The committed baseline is from
+PARSE_PROCESSES=0; elsewhere, save one on the base commit before changing a
+parser and compare after.
+"""
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Read by app at import: keep its downloads/ and library index out of the repo
+WORK_DIR = tempfile.mkdtemp(prefix='bench_parsers_')
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+os.environ.setdefault('DOWNLOAD_FOLDER', WORK_DIR)
+os.environ.setdefault('LIBRARY_INDEX', '0')
+import app
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, 'bench_baseline.json')
+# Measured here with no code change: the median throughput of repeat runs
+# moved by up to ±45% (shared box), peak memory by 0.1 KiB. A speed gate any
+# tighter than the noise only fails at random, so it only catches a 2x slowdown.
+SPEED_THRESHOLD = 0.5
+MEMORY_THRESHOLD = 0.15
+
+CHEYIL_BOOK = 'https://www.cheyil.cc/book/1187702/'
+CHEYIL_CHAPTER = 'https://www.cheyil.cc/book/1187702/171109886.html'
+QUANBEN_BOOK = 'https://www.quanben.io/n/zhiyeyisheng-kaijuyigeyiliaoxiugaiqi/list.html'
+
+
+class FixtureAdapter(BaseAdapter):
+    """Answers URLs matching a route with a fixture file, anything else with a 404"""
+    def __init__(self, routes):
+        super().__init__()
+        self.routes = routes # [(regex, filename)]
+        self.pages = 0
+
+    def send(self, request, **kwargs):
+        self.pages += 1
+        resp = requests.Response()
+        resp.url = request.url
+        resp.request = request
+        resp.headers = CaseInsensitiveDict()
+        for pattern, filename in self.routes:
+            if re.search(pattern, request.url):
+                resp.status_code, resp.reason = 200, 'OK'
+                resp.headers['Content-Type'] = 'text/html; charset=utf-8'
+                resp._content = read_fixture(filename)
+                return resp
+        resp.status_code, resp.reason = 404, 'Not Found'
+        resp._content = b''
+        return resp
+
+    def close(self):
+        pass
+
+fixtures = {}
+
+def read_fixture(filename):
+    if filename not in fixtures:
+        with open(os.path.join(HERE, filename), 'rb') as f:
+            fixtures[filename] = f.read()
+    return fixtures[filename]
+
+def fixture_session(adapter):
+    session = requests.Session()
+    session.headers.update(app.HEADERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def downloader_case(cls, start_url, routes, action):
+    def run():
+        adapter = FixtureAdapter(routes)
+        d = cls(start_url, 'bench')
+        d.session = fixture_session(adapter)
+        return action(d), adapter
+    return run
+
+def search_case(method, keyword, routes):
+    def run():
+        adapter = FixtureAdapter(routes)
+        s = app.Searcher()
+        s.http = fixture_session(adapter)
+        ctx = app.SearchContext('bench', keyword, s.get_random_headers())
+        return getattr(s, method)(ctx), adapter
+    return run
+
+# name -> (run, minimum number of items a working parser returns)
+CASES = {
+    'cheyil_toc': (downloader_case(
+        app.CheyilDownloader, CHEYIL_BOOK, [(r'/book/\d+/$', 'main_page.html')],
+        lambda d: d.get_chapter_list()), 10),
+    'cheyil_chapter': (downloader_case(
+        app.CheyilDownloader, CHEYIL_BOOK, [(r'/book/\d+/\d+(_\d+)?\.html$', 'chapter_1.html')],
+        lambda d: d.get_chapter_content(CHEYIL_CHAPTER)), 500),
+    'quanben_toc': (downloader_case(
+        app.QuanbenDownloader, QUANBEN_BOOK, [(r'/list\.html$', 'quanben_list.html')],
+        lambda d: d.get_chapter_list()), 10),
+    'generic_toc': (downloader_case(
+        app.GenericDownloader, CHEYIL_BOOK, [(r'/book/\d+/$', 'main_page.html')],
+        lambda d: d.get_chapter_list()), 10),
+    'generic_chapter': (downloader_case(
+        app.GenericDownloader, CHEYIL_BOOK, [(r'/book/\d+/\d+\.html$', 'chapter_1.html')],
+        lambda d: d.get_chapter_content(CHEYIL_CHAPTER)), 500),
+    'search_quanben': (search_case(
+        'search_quanben', '斗破苍穹', [(r'quanben\.io/index\.php', 'quanben_home.html')]), 1),
+}
+
+
+def measure(run, min_items, iterations, repeats):
+    """{'pages_per_sec', 'ms_per_page', 'spread', 'peak_kib', 'blocks', 'items'} of one case"""
+    result, adapter = run() # Warm-up, also checks the parser still finds something
+    items = len(result)
+    if items < min_items:
+        raise RuntimeError(f"parser returned {items} items, expected at least {min_items}")
+    pages = adapter.pages
+
+    # Median over repeats of the mean of a batch: one lucky or unlucky batch
+    # (GC pause, CPU frequency, a neighbour on the box) moves neither
+    batches = []
+    for _ in range(repeats):
+        start = time.thread_time()
+        for _ in range(iterations):
+            run()
+        batches.append((time.thread_time() - start) / iterations)
+    batches.sort()
+    per_run = max(batches[len(batches) // 2], 1e-9)
+    spread = (batches[-1] - batches[0]) / per_run
+
+    tracemalloc.start()
+    try:
+        result, adapter = run()
+        _, peak = tracemalloc.get_traced_memory()
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    finally:
+        tracemalloc.stop()
+    return {
+        'pages_per_sec': round(pages / per_run, 1),
+        'ms_per_page': round(per_run / pages * 1000, 3),
+        'spread': round(spread, 3), # (slowest - fastest) / median batch
+        'peak_kib': round(peak / 1024, 1),
+        'blocks': blocks,
+        'items': items,
+    }
+
+def machine_info():
+    """What a baseline's numbers depend on besides the code"""
+    return {'system': platform.system(), 'machine': platform.machine(), 'cores': os.cpu_count(),
+            'python': '.'.join(platform.python_version_tuple()[:2]), 'parse_processes': app.PARSE_PROCESSES}
+
+def compare(name, current, baseline, speed_threshold, memory_threshold):
+    """Regression messages of one case against its baseline entry"""
+    problems = []
+    if not baseline:
+        return problems
+    if current['pages_per_sec'] < baseline['pages_per_sec'] * (1 - speed_threshold):
+        problems.append(f"{name}: {current['pages_per_sec']} pages/s, baseline {baseline['pages_per_sec']}")
+    if current['peak_kib'] > baseline['peak_kib'] * (1 + memory_threshold):
+        problems.append(f"{name}: peak {current['peak_kib']} KiB, baseline {baseline['peak_kib']}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=5, help='runs per timed batch')
+    parser.add_argument('--repeats', type=int, default=7, help='timed batches, the median counts')
+    parser.add_argument('--only', default='', help='run cases whose name contains this')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=SPEED_THRESHOLD, help='allowed throughput drop')
+    parser.add_argument('--memory-threshold', type=float, default=MEMORY_THRESHOLD, help='allowed peak memory growth')
+    args = parser.parse_args()
+
+    baseline, saved_on = {}, None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            data = json.load(f)
+        baseline, saved_on = data.get('cases', {}), data.get('machine')
+    machine = machine_info()
+    if saved_on and saved_on != machine:
+        print(f"Baseline saved on a different setup: {saved_on}\nThis run: {machine}\n")
+
+    results, problems = {}, []
+    print(f"{'case':<18}{'pages/s':>10}{'ms/page':>10}{'spread':>8}{'peak KiB':>10}{'blocks':>9}{'items':>7}  vs baseline")
+    for name, (run, min_items) in CASES.items():
+        if args.only not in name:
+            continue
+        with contextlib.redirect_stdout(io.StringIO()): # Downloader logs
+            try:
+                r = measure(run, min_items, args.iterations, args.repeats)
+            except Exception as e:
+                r = None
+                error = e
+        if r is None:
+            problems.append(f"{name}: {error}")
+            print(f"{name:<18}FAILED: {error}")
+            continue
+        results[name] = r
+        base = baseline.get(name)
+        delta = f"{(r['pages_per_sec'] / base['pages_per_sec'] - 1) * 100:+.1f}%" if base else '-'
+        print(f"{name:<18}{r['pages_per_sec']:>10}{r['ms_per_page']:>10}{r['spread']:>8.0%}{r['peak_kib']:>10}{r['blocks']:>9}{r['items']:>7}  {delta}")
+        problems.extend(compare(name, r, base, args.threshold, args.memory_threshold))
+
+    if args.save_baseline:
+        if saved_on != machine:
+            baseline = {} # Numbers from another machine don't mix with these
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'machine': machine, 'cases': baseline}, f, indent=2, sort_keys=True)
+        print(f"Baseline saved: {args.baseline}")
+    elif problems:
+        print("\nRegressions:")
+        for p in problems:
+            print(f"  {p}")
+        if saved_on and saved_on != machine:
+            print("Not failing: the baseline is from a different setup, save one here to compare")
+        else:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
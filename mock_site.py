@@ -0,0 +1,408 @@
+"""Stand-in novel site for end-to-end download tests.
+
+Serves synthetic books in the three layouts the downloaders know, picked by
+the Host header: *cheyil.cc* gets the Cheyil layout, *quanben.io* the Quanben
+one (with the staticchars / JSONP full list), anything else a plain page for
+GenericDownloader. Chapters are split over --pages pages, and every page
+starts with a 【book-chapter-page】 marker so a client can check nothing was
+skipped. Latency, 429/503 injection and Quanben id gaps are configurable.
+
+The search engines the Searcher queries (Baidu, Sogou, Bing, the Quanben and
+xbiquge site searches) answer with --search-results books titled
+模拟小说<id>, spread over the three layouts.
+
+    python mock_site.py --port 8765 --latency lognormal:80:0.5 --error-rate 0.05
+
+Books exist for any numeric id:
+    Cheyil   http://www.cheyil.cc/book/<id>/
+    Quanben  http://www.quanben.io/n/mock-<id>/list.html
+    Generic  http://<any host>/book/<id>/index.html
+MockSiteAdapter sends such URLs to the local server (see bench_download.py).
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, urlunparse, parse_qs
+
+from requests.adapters import HTTPAdapter
+
+STATICCHARS = 'PXhw7UT1B0a9kQDKZsjIASmOezxYG4CHo5Jyfg2b8FLpEvRr3WtVnlqMidu6cN'
+QUANBEN_LIST_VISIBLE = 30 # Chapters on list.html, the rest only come from the JSONP call
+TEXT_CHARS = '天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳云腾致雨露结为霜金生丽水玉出昆冈剑号巨阙珠称夜光'
+WORDS = ['风起', '少年', '归来', '夜雨', '破局', '试炼', '重逢', '惊变', '长夜', '远行']
+FIRST_BOOK = 1001
+BOOK_URLS = {
+    'cheyil': 'https://www.cheyil.cc/book/{book}/',
+    'quanben': 'https://www.quanben.io/n/mock-{book}/list.html',
+    'generic': 'http://novels.example/book/{book}/index.html',
+}
+
+
+class LatencyModel:
+    """Per-request delay from a spec: fixed:MS, uniform:MIN:MAX or lognormal:MEDIAN_MS:SIGMA"""
+    def __init__(self, spec='fixed:0'):
+        kind, *params = spec.split(':')
+        if kind not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError(f"unknown latency model: {spec}")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        self.spec = spec
+
+    def sample(self, rng):
+        if self.kind == 'fixed':
+            ms = self.params[0]
+        elif self.kind == 'uniform':
+            ms = rng.uniform(*self.params)
+        else:
+            median, sigma = self.params
+            ms = median * rng.lognormvariate(0, sigma)
+        return max(ms, 0) / 1000
+
+
+class MockSite(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), chapters=100, pages=2, paragraphs=12,
+                 latency='fixed:0', error_rate=0.0, error_codes=(429, 503), retry_after=0,
+                 gap_every=0, search_results=5, seed=None):
+        super().__init__(address, MockHandler)
+        self.chapters = chapters
+        self.pages = pages
+        self.paragraphs = paragraphs
+        self.latency = LatencyModel(latency)
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.retry_after = retry_after
+        self.gap_every = gap_every # Every n-th chapter id doesn't exist (Quanben gap probing)
+        self.search_results = search_results
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'injected': 0, 'status': {}}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def count(self, status, injected=False):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['injected'] += injected
+            self.stats['status'][status] = self.stats['status'].get(status, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {'requests': self.stats['requests'], 'injected': self.stats['injected'],
+                    'status': dict(self.stats['status'])}
+
+    # --- Book content ---
+
+    def exists(self, number):
+        """Chapter numbers are 1-based"""
+        return 1 <= number <= self.chapters and not (self.gap_every and number % self.gap_every == 0)
+
+    def listed(self):
+        return [n for n in range(1, self.chapters + 1) if self.exists(n)]
+
+    @staticmethod
+    def book_title(book_id):
+        return f"模拟小说{book_id}"
+
+    @staticmethod
+    def chapter_title(number):
+        return f"第{number}章 {WORDS[number % len(WORDS)]}"
+
+    def page_paragraphs(self, book_id, number, page):
+        rng = random.Random(f"{book_id}:{number}:{page}")
+        paras = [f"【{book_id}-{number}-{page}】"]
+        for _ in range(self.paragraphs):
+            paras.append(''.join(rng.choice(TEXT_CHARS) for _ in range(rng.randint(40, 120))) + '。')
+        return paras
+
+    def search_hits(self):
+        """(book id, title, url, snippet) of every search result"""
+        hits = []
+        layouts = list(BOOK_URLS)
+        for i in range(self.search_results):
+            book = FIRST_BOOK + i
+            snippet = f"作者：作者{book} 主角：林{book} 最新：{self.chapter_title(self.chapters)} 共{self.chapters}章"
+            hits.append((book, self.book_title(book), BOOK_URLS[layouts[i % len(layouts)]].format(book=book), snippet))
+        return hits
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.serve(head=False)
+
+    def do_HEAD(self):
+        self.serve(head=True)
+
+    def serve(self, head):
+        self.head = head
+        site = self.server
+        time.sleep(site.latency.sample(site.rng))
+        if site.error_rate and site.rng.random() < site.error_rate:
+            status = site.rng.choice(site.error_codes)
+            headers = {'Retry-After': str(site.retry_after)} if status == 429 and site.retry_after else {}
+            return self.reply(status, f"<html><body>{status}</body></html>", headers, injected=True)
+
+        host = self.headers.get('Host', '')
+        parts = urlparse(self.path)
+        query = parse_qs(parts.query)
+        if 'cheyil.cc' in host:
+            body = self.cheyil(parts.path)
+        elif 'quanben.io' in host:
+            body = self.quanben(parts.path, query)
+        elif 'baidu.com' in host:
+            return self.baidu(parts.path, query)
+        elif 'sogou.com' in host:
+            body = self.search_page('sogou') if parts.path == '/web' else None
+        elif 'bing.com' in host:
+            body = self.search_page('bing') if parts.path == '/search' else None
+        elif 'xbiquge.so' in host and parts.path == '/modules/article/search.php':
+            body = self.search_page('biquge')
+        else:
+            body = self.generic(parts.path)
+        if body is None:
+            return self.reply(404, "<html><body>404 Not Found</body></html>")
+        jsonp = (query.get('a') or [''])[0] == 'list.jsonp'
+        self.reply(200, body, content_type='application/javascript' if jsonp else 'text/html')
+
+    def reply(self, status, body, headers=None, content_type='text/html', injected=False):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if not self.head:
+            self.wfile.write(data)
+        self.server.count(status, injected)
+
+    @staticmethod
+    def chapter_page(path):
+        """(book, chapter number, page) of .../<book>/<n>.html or .../<n>_<page>.html"""
+        m = re.search(r'/([\w-]+)/(\d+)(?:_(\d+))?\.html$', path)
+        if not m:
+            return None
+        return m.group(1), int(m.group(2)), int(m.group(3) or 1)
+
+    # --- Cheyil: div.chapterlist > div.all, p paragraphs in #chaptercontent, rel=next ---
+
+    def cheyil(self, path):
+        site = self.server
+        m = re.match(r'^/book/(\d+)/$', path)
+        if m:
+            book = m.group(1)
+            links = ''.join(f'<dd><a href="/book/{book}/{n}.html">{site.chapter_title(n)}</a></dd>' for n in site.listed())
+            return (f'<html><head><meta charset="UTF-8"><title>{site.book_title(book)}</title>'
+                    f'<meta property="og:title" content="{site.book_title(book)}"></head><body>'
+                    f'<h1>{site.book_title(book)}</h1><div class="chapterlist"><div class="all"><dl>{links}</dl></div></div>'
+                    f'</body></html>')
+        found = self.chapter_page(path)
+        if not found or not path.startswith('/book/'):
+            return None
+        book, number, page = found
+        if not site.exists(number) or page > site.pages:
+            return None
+        paras = ''.join(f'<p>{p}</p>' for p in site.page_paragraphs(book, number, page))
+        if page < site.pages:
+            paras += '<p>本章未完，请点击下一页继续阅读</p>'
+            next_href = f'/book/{book}/{number}_{page + 1}.html'
+        else:
+            next_href = f'/book/{book}/{number + 1}.html'
+        return (f'<html><head><meta charset="UTF-8"><title>{site.chapter_title(number)}</title></head><body>'
+                f'<h1>{site.chapter_title(number)}</h1><div id="chaptercontent">{paras}</div>'
+                f'<a href="/book/{book}/">目录</a><a rel="next" href="{next_href}">下一页</a></body></html>')
+
+    # --- Quanben: ul.list3 + load_more JSONP, div#content, "下一页" pagination ---
+
+    def quanben(self, path, query):
+        site = self.server
+        if path == '/index.php':
+            if (query.get('a') or [''])[0] == 'search':
+                return self.search_page('quanben')
+            return self.quanben_jsonp(query)
+        m = re.match(r'^/n/mock-(\d+)/list\.html$', path)
+        if m:
+            book = m.group(1)
+            callback = ''.join(random.Random(book).choice(STATICCHARS) for _ in range(6))
+            links = ''.join(f'<li><a href="/n/mock-{book}/{n}.html">{site.chapter_title(n)}</a></li>'
+                            for n in site.listed()[:QUANBEN_LIST_VISIBLE])
+            return (f'<html><head><meta charset="utf-8" /><title>{site.book_title(book)} - 全本小说网</title>'
+                    f'<meta property="og:title" content="{site.book_title(book)}" /></head><body>'
+                    f'<h1 itemprop="name headline">{site.book_title(book)}</h1>'
+                    f'<ul class="list3">{links}</ul>'
+                    f'<a href="javascript:void(0)" onclick="load_more(\'{book}\')">[展开完整列表]</a>'
+                    f'<script>var staticchars="{STATICCHARS}";var callback=\'{callback}\';'
+                    f'function load_more(book){{}}</script></body></html>')
+        found = self.chapter_page(path)
+        if not found or not found[0].startswith('mock-'):
+            return None
+        book, number, page = found
+        book = book[len('mock-'):]
+        if not site.exists(number) or page > site.pages:
+            return None
+        text = '<br>'.join(site.page_paragraphs(book, number, page))
+        nav = f'<a href="/n/mock-{book}/list.html">目录</a>'
+        if page < site.pages:
+            nav += f'<a href="/n/mock-{book}/{number}_{page + 1}.html">下一页</a>'
+        return (f'<html><head><meta charset="utf-8" /><title>{site.chapter_title(number)}</title></head><body>'
+                f'<h1>{site.chapter_title(number)}</h1><div id="content">{text}</div>{nav}</body></html>')
+
+    def quanben_jsonp(self, query):
+        """list.jsonp: b must be callback encoded with staticchars, as the site's JS does it"""
+        site = self.server
+        arg = lambda k: (query.get(k) or [''])[0]
+        if arg('a') != 'list.jsonp' or not arg('book_id').isdigit():
+            return None
+        callback, encoded = arg('callback'), arg('b')
+        decoded = ''.join(STATICCHARS[(STATICCHARS.find(c) - 3) % 62] if c in STATICCHARS else c
+                          for c in encoded[1::3])
+        if len(encoded) != 3 * len(callback) or decoded != callback:
+            return f"{callback}({json.dumps({'content': ''})});"
+        book = arg('book_id')
+        links = ''.join(f'<li><a href="/n/mock-{book}/{n}.html">{site.chapter_title(n)}</a></li>'
+                        for n in site.listed())
+        return f"{callback}({json.dumps({'content': links}, ensure_ascii=False)});"
+
+    # --- Generic: numbered links on the index, the text in the biggest div ---
+
+    def generic(self, path):
+        site = self.server
+        m = re.match(r'^/book/(\d+)/(?:index\.html)?$', path)
+        if m:
+            book = m.group(1)
+            links = ''.join(f'<li><a href="/book/{book}/{n}.html">{site.chapter_title(n)}</a></li>' for n in site.listed())
+            return (f'<html><head><meta charset="utf-8"><title>{site.book_title(book)}_模拟书站</title></head>'
+                    f'<body><div class="nav"><a href="/">首页</a></div><ul class="toc">{links}</ul></body></html>')
+        found = self.chapter_page(path)
+        if not found or not path.startswith('/book/') or found[2] != 1:
+            return None
+        book, number, _ = found
+        if not site.exists(number):
+            return None
+        # The generic parser reads a single page: the whole chapter is on it
+        text = '<br>'.join(p for page in range(1, site.pages + 1) for p in site.page_paragraphs(book, number, page))
+        return (f'<html><head><meta charset="utf-8"><title>{site.chapter_title(number)}_模拟书站</title></head><body>'
+                f'<div class="nav"><a href="/">首页</a></div><div class="text">{text}</div></body></html>')
+
+
+    # --- Search engines ---
+
+    def baidu(self, path, query):
+        """/s lists results behind /link?url= redirects, which the Searcher resolves with HEAD"""
+        hits = self.server.search_hits()
+        if path == '/link':
+            target = (query.get('url') or [''])[0]
+            for book, _, url, _ in hits:
+                if target == str(book):
+                    return self.reply(302, '', {'Location': url})
+            return self.reply(404, "<html><body>404 Not Found</body></html>")
+        if path != '/s':
+            return self.reply(404, "<html><body>404 Not Found</body></html>")
+        items = ''.join(f'<div class="result c-container"><h3><a href="http://www.baidu.com/link?url={book}">{title}最新章节</a></h3>'
+                        f'<div class="c-abstract">{snippet}</div></div>' for book, title, _, snippet in hits)
+        self.reply(200, f'<html><head><title>百度搜索</title></head><body><div id="content_left">{items}</div></body></html>')
+
+    def search_page(self, engine):
+        hits = self.server.search_hits()
+        if engine == 'sogou':
+            items = ''.join(f'<div class="vrwrap"><h3><a href="{url}">{title}</a></h3><p class="str_info">{snippet}</p></div>'
+                            for _, title, url, snippet in hits)
+        elif engine == 'bing':
+            items = '<ol id="b_results">' + ''.join(f'<li class="b_algo"><h2><a href="{url}">{title}</a></h2><p>{snippet}</p></li>'
+                                                    for _, title, url, snippet in hits) + '</ol>'
+        elif engine == 'quanben':
+            items = ''.join(f'<div class="list2"><h3><a href="/n/mock-{book}/">{title}</a></h3></div>' for book, title, _, _ in hits)
+        else: # xbiquge: title / latest chapter / author rows
+            items = '<table><tr><th>书名</th><th>最新章节</th><th>作者</th></tr>' + ''.join(
+                f'<tr><td><a href="/book/{book}/index.html">{title}</a></td><td>{self.server.chapter_title(self.server.chapters)}</td>'
+                f'<td>作者{book}</td></tr>' for book, title, _, _ in hits) + '</table>'
+        return f'<html><head><meta charset="utf-8"><title>搜索结果</title></head><body>{items}</body></html>'
+
+
+class MockSiteAdapter(HTTPAdapter):
+    """Sends every request to a MockSite, keeping the original host in the Host header.
+
+    With `inner` (e.g. app.HttpxAdapter) the rewritten request goes out through
+    that adapter instead of urllib3.
+    """
+    def __init__(self, site_url, inner=None, **kwargs):
+        kwargs.setdefault('pool_maxsize', 32)
+        super().__init__(**kwargs)
+        self.site = urlparse(site_url)
+        self.inner = inner
+
+    def send(self, request, **kwargs):
+        original = request.url
+        parts = urlparse(original)
+        request.url = urlunparse(parts._replace(scheme=self.site.scheme, netloc=self.site.netloc))
+        request.headers['Host'] = parts.netloc
+        try:
+            resp = (self.inner or super()).send(request, **kwargs)
+        finally:
+            request.url = original
+        resp.url = original
+        return resp
+
+def route_to_mock(session, site_url):
+    """Route a session to the mock site, keeping a non-urllib3 transport it already has mounted"""
+    current = session.get_adapter('https://')
+    adapter = MockSiteAdapter(site_url, inner=None if isinstance(current, HTTPAdapter) else current)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def site_options(parser):
+    """MockSite options, shared with bench_download.py"""
+    parser.add_argument('--chapters', type=int, default=100)
+    parser.add_argument('--pages', type=int, default=2, help='pages per chapter')
+    parser.add_argument('--paragraphs', type=int, default=12, help='paragraphs per page')
+    parser.add_argument('--latency', default='fixed:0', help='fixed:MS, uniform:MIN:MAX or lognormal:MEDIAN_MS:SIGMA')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with an error')
+    parser.add_argument('--error-codes', default='429,503')
+    parser.add_argument('--retry-after', type=int, default=0, help='Retry-After seconds on injected 429s')
+    parser.add_argument('--gap-every', type=int, default=0, help='every n-th chapter id is missing')
+    parser.add_argument('--search-results', type=int, default=5, help='books each search engine returns')
+    parser.add_argument('--seed', type=int, default=None)
+
+def site_kwargs(args):
+    return dict(chapters=args.chapters, pages=args.pages, paragraphs=args.paragraphs, latency=args.latency,
+                error_rate=args.error_rate, error_codes=[int(c) for c in args.error_codes.split(',') if c],
+                retry_after=args.retry_after, gap_every=args.gap_every,
+                search_results=args.search_results, seed=args.seed)
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock novel site')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    site_options(parser)
+    args = parser.parse_args()
+    site = MockSite((args.host, args.port), **site_kwargs(args))
+    print(f"Mock site on {site.url} ({args.chapters} chapters x {args.pages} pages, latency {args.latency}, errors {args.error_rate:.0%})")
+    print(f"  Generic  {site.url}/book/1001/index.html")
+    print(f"  Cheyil   http://www.cheyil.cc/book/1001/   (Host header, or MockSiteAdapter)")
+    print(f"  Quanben  http://www.quanben.io/n/mock-1001/list.html")
+    try:
+        site.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""Headless downloads with the app.py downloaders, no Flask and no polling.
+
+Books run through the same BookScheduler as /api/batch: --jobs at a time,
+--per-domain per site. Task ids come from the book key, so running the same
+list again resumes. Chapters already on disk are kept and only the rest are
+fetched.
+
+    python novel_cli.py https://www.cheyil.cc/book/1187702/
+    python novel_cli.py -f books.txt --jobs 8 --format epub --out-dir ~/novels
+    python novel_cli.py URL --mirror MIRROR_URL --retry-failed
+    python novel_cli.py URL --out-dir . --work-dir /tmp/novels  # only the book lands in .
+
+A line of the --file list is one book: its URL, optionally followed by mirror
+URLs of the same book. Blank lines and lines starting with # are skipped.
+Exits 1 when a book failed or still has failed chapters.
+
+The local library index stays off (LIBRARY_INDEX=0): the web app indexes
+the books when it next starts on the same folder (DOWNLOAD_FOLDER).
+"""
+import argparse
+import contextlib
+import hashlib
+import html
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+import zipfile
+
+# Read by app at import: a headless run never searches the library
+os.environ.setdefault('LIBRARY_INDEX', '0')
+import app
+
+FORMATS = ('txt', 'epub', 'json')
+
+
+def read_url_file(path):
+    """[(url, mirrors)] from a list file"""
+    books = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            urls = line.split()
+            books.append((urls[0], urls[1:]))
+    return books
+
+def cli_task_id(url):
+    """Stable per book, so a rerun finds the chapter files of the last one"""
+    return 'cli-' + hashlib.sha1(app.book_key(url).encode('utf-8')).hexdigest()[:12]
+
+def write_json(path, title, source, chapters):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'title': title, 'source': source,
+                   'chapters': [{'title': t, 'text': body} for t, body in chapters]}, f, ensure_ascii=False, indent=1)
+
+def write_epub(path, title, source, chapters):
+    """Minimal EPUB 3: one XHTML file per chapter plus the nav document"""
+    def xhtml(head, body):
+        return ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+                '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="zh">'
+                f'<head><meta charset="utf-8"/><title>{html.escape(head)}</title></head><body>{body}</body></html>')
+
+    book_id = f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, source or title)}"
+    names = [f"c{i:05d}.xhtml" for i in range(len(chapters))]
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED) # Must be first, uncompressed
+        zf.writestr('META-INF/container.xml',
+                    '<?xml version="1.0"?><container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                    '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+                    '</rootfiles></container>')
+        for name, (head, body) in zip(names, chapters):
+            paras = ''.join(f"<p>{html.escape(line.strip())}</p>" for line in body.split('\n') if line.strip())
+            zf.writestr(f"OEBPS/{name}", xhtml(head, f"<h2>{html.escape(head)}</h2>{paras}"))
+        toc = ''.join(f'<li><a href="{name}">{html.escape(head)}</a></li>' for name, (head, _) in zip(names, chapters))
+        zf.writestr('OEBPS/nav.xhtml', xhtml(title, f'<nav epub:type="toc"><h1>{html.escape(title)}</h1><ol>{toc}</ol></nav>'))
+        items = ''.join(f'<item id="c{i}" href="{name}" media-type="application/xhtml+xml"/>' for i, name in enumerate(names))
+        spine = ''.join(f'<itemref idref="c{i}"/>' for i in range(len(names)))
+        zf.writestr('OEBPS/content.opf',
+                    '<?xml version="1.0" encoding="utf-8"?>'
+                    '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="bookid">'
+                    '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+                    f'<dc:identifier id="bookid">{book_id}</dc:identifier><dc:title>{html.escape(title)}</dc:title>'
+                    f'<dc:language>zh</dc:language><dc:source>{html.escape(source or "")}</dc:source>'
+                    f'<meta property="dcterms:modified">{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}</meta>'
+                    '</metadata><manifest><item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>'
+                    f'{items}</manifest><spine>{spine}</spine></package>')
+
+def export_book(txt_path, fmt):
+    """Write the assembled TXT in another format next to it; returns the new path"""
+    if fmt == 'txt':
+        return txt_path
+    with open(txt_path, 'rb') as f:
+        title, source, chapters = app.parse_book_file(f.read())
+    path = os.path.splitext(txt_path)[0] + '.' + fmt
+    (write_epub if fmt == 'epub' else write_json)(path, title or os.path.basename(txt_path)[:-4], source, chapters)
+    return path
+
+def wait_for(batch_id, quiet, interval=2.0):
+    """Block until every book of the batch has finished, printing progress to stderr"""
+    last = None
+    while True:
+        p = app.batch_progress(batch_id)
+        if p['status'] == 'done':
+            return p
+        line = (f"[{p['counts'].get('done', 0) + p['counts'].get('error', 0)}/{p['books']} books] "
+                f"{p['chapters']['done']}/{p['chapters']['total']} chapters, {p['percent']}%")
+        if not quiet and line != last:
+            print(line, file=sys.stderr)
+            last = line
+        time.sleep(interval)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Download novels without the web UI')
+    parser.add_argument('urls', nargs='*', help='book URLs')
+    parser.add_argument('-f', '--file', help='file with one book per line: URL [MIRROR_URL ...]')
+    parser.add_argument('--mirror', action='append', default=[], help='mirror of the (single) URL given')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='books downloading at once')
+    parser.add_argument('--per-domain', type=int, default=app.BATCH_PER_DOMAIN, help='books at once per site')
+    parser.add_argument('--format', choices=FORMATS, default='txt')
+    parser.add_argument('-o', '--out-dir', default=app.DOWNLOAD_FOLDER)
+    parser.add_argument('--work-dir', help='chapter cache and assembly; only the books go to --out-dir (default: --out-dir)')
+    parser.add_argument('--output', help='file name for a single book (default: its title)')
+    parser.add_argument('--no-resume', action='store_true', help='discard chapters left by an earlier run')
+    parser.add_argument('--retry-failed', action='store_true', help='one more pass over failed chapters')
+    parser.add_argument('--delay', help='anti-bot pause MIN:MAX seconds between chapters')
+    parser.add_argument('--transport', choices=('requests', 'httpx'))
+    parser.add_argument('--hedge', action='store_true')
+    parser.add_argument('-q', '--quiet', action='store_true', help='no progress lines')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the downloader logs')
+    args = parser.parse_args(argv)
+
+    books = [(u, []) for u in args.urls]
+    if args.mirror:
+        if len(books) != 1:
+            parser.error('--mirror needs exactly one URL')
+        books[0] = (books[0][0], args.mirror)
+    if args.file:
+        books += read_url_file(args.file)
+    if not books:
+        parser.error('no URLs given')
+    if args.output and len(books) != 1:
+        parser.error('--output needs exactly one book')
+
+    work_dir = args.work_dir or args.out_dir
+    os.makedirs(args.out_dir, exist_ok=True)
+    os.makedirs(work_dir, exist_ok=True)
+    app.DOWNLOAD_FOLDER = work_dir
+    if args.delay:
+        app.CHAPTER_DELAY = tuple(float(x) for x in args.delay.split(':'))
+    scheduler = app.BookScheduler(max_running=args.jobs, per_domain=args.per_domain)
+    options = {'hedge': args.hedge}
+    if args.transport:
+        options['transport'] = args.transport
+
+    with contextlib.ExitStack() as logs:
+        if not args.verbose:
+            logs.enter_context(contextlib.redirect_stdout(logs.enter_context(open(os.devnull, 'w'))))
+        task_ids = []
+        for url, mirrors in books:
+            task_id = cli_task_id(url)
+            if args.no_resume:
+                shutil.rmtree(os.path.join(work_dir, task_id), ignore_errors=True)
+            task_id, downloader = app.create_task(url, mirrors, options, status='queued', task_id=task_id)
+            if downloader is not None:
+                scheduler.submit(task_id)
+            if task_id not in task_ids:
+                task_ids.append(task_id)
+        batch_id = str(uuid.uuid4())
+        app.batches[batch_id] = {'task_ids': task_ids, 'created': time.time()}
+        wait_for(batch_id, args.quiet)
+        if args.retry_failed:
+            for tid in task_ids:
+                if app.downloaders[tid].failed_chapters:
+                    app.downloaders[tid].retry_run()
+
+    failed = 0
+    for tid in task_ids:
+        task, d = app.tasks[tid], app.downloaders[tid]
+        if task['status'] != 'done' or not task.get('filename'):
+            failed += 1
+            print(f"FAILED {task['url']}: {task['log']}")
+            continue
+        path = os.path.join(work_dir, task['filename'])
+        target = os.path.join(args.out_dir, args.output or task['filename'])
+        if target != path:
+            shutil.move(path, target) # The work dir may be on another filesystem
+            if os.path.exists(app.chapter_index_path(path)):
+                # The reader sidecar only matters in a books folder the web app serves
+                if work_dir == args.out_dir:
+                    os.replace(app.chapter_index_path(path), app.chapter_index_path(target))
+                else:
+                    os.remove(app.chapter_index_path(path))
+            path = target
+        path = export_book(path, args.format)
+        if d.failed_chapters:
+            failed += 1
+        print(f"{'PARTIAL' if d.failed_chapters else 'OK':<8}{path}  "
+              f"({task['total'] - len(d.failed_chapters) - len(d.missing_chapters)} chapters, "
+              f"{len(d.failed_chapters)} failed, {len(d.missing_chapters)} missing)")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
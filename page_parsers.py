@@ -0,0 +1,65 @@
+"""Chapter page parsers: body bytes and charset in, cleaned text out.
+
+Kept apart from app.py so the parse pool's worker processes import only
+this module and bs4, not the app with its library index, thread pools and
+DNS patch. Every function takes (body bytes, charset) and returns plain
+picklable values.
+"""
+from bs4 import BeautifulSoup
+
+
+def decode_markup(markup):
+    """(body bytes, charset) from the fetch thread -> text, the way resp.text decodes"""
+    content, encoding = markup
+    try:
+        return str(content, encoding or 'utf-8', errors='replace')
+    except LookupError:
+        return str(content, 'utf-8', errors='replace')
+
+def parse_cheyil_page(markup):
+    """(text, has next link, its href) of one Cheyil chapter page; may run in the parse pool"""
+    soup = BeautifulSoup(decode_markup(markup), 'html.parser')
+    text = ""
+    content_div = soup.find('div', id='chaptercontent')
+    if content_div:
+        for p in content_div.find_all('p'):
+            txt = p.get_text(strip=True)
+            # Pagination and site ad noise
+            if "本章未完" not in txt and "请点击下一页" not in txt and "没钱又任性提示您" not in txt:
+                text += "    " + txt + "\n\n"
+    next_link = soup.find('a', rel='next')
+    return text, next_link is not None, next_link.get('href') if next_link else None
+
+def parse_quanben_page(markup):
+    """(h1 title, text, has next link, its href) of one Quanben chapter page; may run in the parse pool"""
+    soup = BeautifulSoup(decode_markup(markup), 'html.parser')
+    h1 = soup.find('h1')
+    title = h1.get_text(strip=True) if h1 else None
+    text = ""
+    content_div = soup.find('div', id='content')
+    if content_div:
+        for s in content_div(['script', 'style']):
+            s.decompose()
+        text = content_div.get_text("\n", strip=True) + "\n"
+    next_page = None
+    for a in soup.find_all('a'):
+        if "下一页" in a.get_text():
+            next_page = a
+            break
+    return title, text, next_page is not None, next_page.get('href') if next_page else None
+
+def parse_generic_page(markup):
+    """(page title, text of the longest script-free div) of any page; may run in the parse pool"""
+    soup = BeautifulSoup(decode_markup(markup), 'html.parser')
+    title = soup.title.get_text(strip=True) if soup.title else None
+    best_div = None
+    max_len = 0
+    
+    for d in soup.find_all('div'):
+        txt = d.get_text(strip=True)
+        if len(txt) > max_len:
+            if d.find('script') or d.find('style'):
+                 continue
+            max_len = len(txt)
+            best_div = d
+    return title, best_div.get_text("\n\n", strip=True) if best_div else ""
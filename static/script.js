@@ -84,7 +84,8 @@ async function pollSearch(taskId) {
             renderSearchResults(data.results);
         }
 
-        if (data.status === 'done') {
+        // Keep polling while the server is still validating candidate TOCs
+        if (data.status === 'done' && !data.validating) {
             clearInterval(searchPollInterval);
             // One final render to be safe
             renderSearchResults(data.results);
@@ -155,7 +156,7 @@ function renderSearchResults(books) {
                         metaHtml += `<span style="color: #60a5fa;">👤 ${book.author}</span>`;
                     }
 
-                    metaHtml += `<span style="opacity: 0.5">|</span> <span style="color: #fbbf24;">${book.source || '未知源'}</span>`;
+                    metaHtml += `<span style="opacity: 0.5">|</span> <span style="color: #fbbf24;">${book.is_local ? '📚 ' : ''}${book.source || '未知源'}</span>`;
 
                     if (book.is_completed) {
                         metaHtml += `<span style="background: #10b981; color: white; padding: 1px 5px; border-radius: 3px; font-size: 0.65rem;">完结</span>`;
@@ -165,18 +166,61 @@ function renderSearchResults(books) {
                         metaHtml += `<span style="opacity: 0.5">|</span> <span style="font-size: 0.75rem; color: #94a3b8; max-width: 150px; overflow: hidden; text-overflow: ellipsis; white-space: nowrap;">${book.latest}</span>`;
                     }
 
+                    if (book.mirrors && book.mirrors.length > 0) {
+                        metaHtml += `<span style="opacity: 0.5">|</span> <span style="color: #a78bfa;">🔁 +${book.mirrors.length} 源</span>`;
+                    }
+
+                    if (book.validated) {
+                        metaHtml += book.downloadable
+                            ? `<span style="color: #10b981; font-size: 0.75rem;">✔ ${book.count} 章</span>`
+                            : `<span style="color: #ef4444; font-size: 0.75rem;">✘ 目录无效</span>`;
+                    }
+
                     metaHtml += `</div>`;
 
+                    // Alternative sources for the same book (grouped server-side).
+                    // Library hits and engine click-through links are no book page
+                    const mirrorUrls = (book.mirrors || []).map(m => m.url).filter(isBookPage);
+                    let mirrorsHtml = '';
+                    if (book.mirrors && book.mirrors.length > 0) {
+                        mirrorsHtml = `<div style="font-size: 0.7rem; margin-top: 4px; display: flex; gap: 6px; flex-wrap: wrap;">` +
+                            book.mirrors.map((m, i) =>
+                                `<span class="mirror-link" data-mirror="${i}" style="color: #94a3b8; border: 1px solid rgba(148,163,184,0.3); padding: 0 5px; border-radius: 3px; cursor: pointer;">${m.source || '镜像'}${m.count ? ' · ' + m.count + '章' : ''}</span>`
+                            ).join('') +
+                            (!book.is_local && mirrorUrls.length > 0 && isBookPage(book.url)
+                                ? `<span class="multi-source" style="color: #a78bfa; border: 1px solid rgba(167,139,250,0.5); padding: 0 5px; border-radius: 3px; cursor: pointer;">🔁 多源下载</span>`
+                                : '') +
+                            `</div>`;
+                    }
+
                     div.innerHTML = `
                         <div style="flex: 1; overflow: hidden; padding-right: 10px;">
                             <div style="font-weight: bold; font-size: 1rem; color: #fff; margin-bottom: 2px;">${book.title || '无标题'}</div>
                             ${metaHtml}
+                            ${book.is_local && book.snippet ? `<div style="font-size: 0.75rem; color: #94a3b8; margin-top: 4px;">${book.snippet}</div>` : ''}
+                            ${mirrorsHtml}
                         </div>
-                        <div style="background: #2563eb; color: #fff; padding: 6px 12px; border-radius: 6px; font-size: 0.85rem; white-space: nowrap; box-shadow: 0 2px 4px rgba(0,0,0,0.2);">
-                            下载
+                        <div style="background: ${book.is_local ? '#10b981' : '#2563eb'}; color: #fff; padding: 6px 12px; border-radius: 6px; font-size: 0.85rem; white-space: nowrap; box-shadow: 0 2px 4px rgba(0,0,0,0.2);">
+                            ${book.is_local ? '保存' : '下载'}
                         </div>
                     `;
-                    div.onclick = () => selectBook(book.url);
+                    // Local library hits are already downloaded: just save the file.
+                    // A click downloads from one source; mirrors for failover only
+                    // go along when the user asks for a multi-source download.
+                    div.onclick = book.is_local ? () => window.open(book.url, '_blank') : () => selectBook(book.url);
+                    div.querySelectorAll('.mirror-link').forEach(el => {
+                        el.onclick = (e) => {
+                            e.stopPropagation();
+                            selectBook(book.mirrors[el.dataset.mirror].url);
+                        };
+                    });
+                    const multi = div.querySelector('.multi-source');
+                    if (multi) {
+                        multi.onclick = (e) => {
+                            e.stopPropagation();
+                            selectBook(book.url, mirrorUrls);
+                        };
+                    }
                     container.appendChild(div);
                 } catch (e) {
                     console.error("Error rendering item", index, e);
@@ -191,7 +235,16 @@ function renderSearchResults(books) {
     }
 }
 
-function selectBook(url) {
+let pendingMirrors = [];
+
+// Search engine click-through links (Sogou/Baidu /link?url=, Bing /ck/a) and
+// local library paths can't be a download source
+function isBookPage(url) {
+    return /^https?:\/\//.test(url) && !/^https?:\/\/([\w-]+\.)*(sogou\.com\/link\?|baidu\.com\/link\?|bing\.com\/ck\/)/.test(url);
+}
+
+function selectBook(url, mirrors) {
+    pendingMirrors = mirrors || [];
     urlInput.value = url;
     closeSearch();
     startDownload();
@@ -207,6 +260,8 @@ function startDownload() {
         alert("请输入有效的网址！");
         return;
     }
+    const mirrors = pendingMirrors;
+    pendingMirrors = [];
 
     // Stop search polling if active to prevent log pollution
     if (searchPollInterval) clearInterval(searchPollInterval);
@@ -225,7 +280,7 @@ function startDownload() {
     fetch('/api/start', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ url: url })
+        body: JSON.stringify({ url: url, mirrors: mirrors })
     })
         .then(response => response.json())
         .then(data => {
@@ -289,8 +344,9 @@ function pollProgress() {
             if (total > 0) {
                 const success = data.success || 0;
                 const fail = data.fail || 0;
+                const retries = data.retries ? ` <span style="color:#f59e0b" title="重试次数">↻${data.retries.retries}</span>` : '';
                 document.getElementById('progressStats').innerHTML =
-                    `${current} / ${total} <span style="color:#10b981;margin-left:8px">✔${success}</span> <span style="color:#ef4444">✘${fail}</span>`;
+                    `${current} / ${total} <span style="color:#10b981;margin-left:8px">✔${success}</span> <span style="color:#ef4444">✘${fail}</span>${retries}`;
             }
 
             // Update Log - Fix Duplicates Check